@@ -0,0 +1,524 @@
+#!/usr/bin/env python3
+# Measures where a purchase's time goes by running purchases through the same web_automation_wrapper(),
+# get_webdriver() and close_webdriver() code debbit runs, in headless Firefox, against example_merchant pages served
+# from docs/example-merchant on a local web server. Needs Firefox and geckodriver set up the same way as for debbit.
+#
+# python benchmark.py purchases -n 20 --json purchases.json
+#
+# Prints latency percentiles for each phase of a purchase and optionally saves them, plus every individual purchase,
+# as JSON so runs before and after a change can be compared. Phases:
+#
+# browser_start  - starting Firefox and geckodriver, get_webdriver() minus cookie_restore
+# cookie_restore - restore_cookies() or write_cookies_to_profile(), depending on cookies: transport
+# automation     - example_merchant's web_automation(), every attempt if a purchase was retried
+# pacing         - the part of automation spent in utils.pace delays and settles, 0 with --pacing fast
+# cookie_persist - persist_cookies() or read_cookies_from_profile()
+# quit           - quitting Firefox, close_webdriver() minus cookie_persist
+# total          - the whole web_automation_wrapper() call
+#
+# python benchmark.py cookies -n 10 --cookies 200
+#
+# Starts and quits Firefox n times with each cookies: transport, restoring and persisting a file of synthetic cookies,
+# and reports the same phases (total is get_webdriver() plus close_webdriver()). Every round checks that all the
+# cookies made it back into the file.
+#
+# python benchmark.py resources -n 10 --heavy-pages 20
+#
+# Runs the purchases benchmark twice, without and then with resource_blocking, and prints how much each phase sped
+# up. --heavy-pages adds that many slow images plus a web font, a video and a tracker script to every example merchant
+# page, the example pages on their own load almost nothing. The tracker script is served from localhost, which is
+# blocked like a tracker host. purchases takes --block-resources and --heavy-pages too.
+import argparse
+import base64
+import functools
+import http.server
+import json
+import logging
+import os
+import platform
+import shutil
+import tempfile
+import time
+from datetime import datetime
+from threading import Thread
+
+import cookie_db
+import debbit
+import resource_blocking
+import utils
+from clock import VirtualClock
+from failure_store import FailureStore
+from failure_writer import FailureWriter
+from metrics import LiveStats, MetricsStore
+from profiles import ProfileStore
+from purchase_executor import PurchaseExecutor
+from retries import RetryStore
+from state import StateStore
+from webdriver_pool import WebDriverPool
+
+LOGGER = logging.getLogger('debbit')
+PHASES = ['browser_start', 'cookie_restore', 'automation', 'pacing', 'cookie_persist', 'quit', 'total']
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark debbit against a local copy of the example merchant')
+    subparsers = parser.add_subparsers(dest='benchmark', required=True)
+
+    purchases_parser = subparsers.add_parser('purchases', help='end to end purchase latency by phase')
+    purchases_parser.add_argument('-n', type=int, default=10, help='number of purchases')
+    purchases_parser.add_argument('--reuse-browser', action='store_true', help='keep Firefox open between purchases like the browser pool does, the final quit is not measured')
+    purchases_parser.add_argument('--pacing', choices=['human', 'fast'], default='fast', help='pacing profile, as in config.txt, human keeps the pauses that let people watch example_merchant work')
+    purchases_parser.add_argument('--coverage-policy', choices=['always', 'never', 'on_retry', 'sampled'], default='always', help='coverage policy, as in config.txt')
+    purchases_parser.add_argument('--persistent-profile', action='store_true', help='keep the Firefox profile between launches, starting from an empty one')
+    purchases_parser.add_argument('--cookie-transport', choices=['sqlite', 'extension'], default='extension', help='cookies transport, as in config.txt')
+    purchases_parser.add_argument('--block-resources', action='store_true', help='turn on resource_blocking for every category')
+    purchases_parser.add_argument('--heavy-pages', type=int, default=0, help='add this many slow images, a web font, a video and a tracker script to every page')
+    purchases_parser.add_argument('--show-browser', action='store_true', help='run Firefox with a visible window')
+    purchases_parser.add_argument('--pages', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'docs', 'example-merchant'), help='directory with the example merchant pages')
+    purchases_parser.add_argument('--json', help='also write the report to this file')
+    purchases_parser.add_argument('--verbose', action='store_true', help="print debbit's log output")
+
+    resources_parser = subparsers.add_parser('resources', help='purchase latency without and with resource blocking')
+    resources_parser.add_argument('-n', type=int, default=10, help='number of purchases each way')
+    resources_parser.add_argument('--heavy-pages', type=int, default=20, help='slow images added to every page, 0 for the plain example pages')
+    resources_parser.add_argument('--reuse-browser', action='store_true', help='keep Firefox open between purchases like the browser pool does')
+    resources_parser.add_argument('--show-browser', action='store_true', help='run Firefox with a visible window')
+    resources_parser.add_argument('--pages', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'docs', 'example-merchant'), help='directory with the example merchant pages')
+    resources_parser.add_argument('--json', help='also write the report to this file')
+    resources_parser.add_argument('--verbose', action='store_true', help="print debbit's log output")
+
+    cookies_parser = subparsers.add_parser('cookies', help='cookie restore and persist latency by transport')
+    cookies_parser.add_argument('-n', type=int, default=5, help='browser launches per transport')
+    cookies_parser.add_argument('--cookies', type=int, default=100, help='number of synthetic cookies to restore and persist')
+    cookies_parser.add_argument('--transport', choices=['sqlite', 'extension'], action='append', help='transport to measure, repeat for several, defaults to all')
+    cookies_parser.add_argument('--show-browser', action='store_true', help='run Firefox with a visible window')
+    cookies_parser.add_argument('--json', help='also write the report to this file')
+    cookies_parser.add_argument('--verbose', action='store_true', help="print debbit's log output")
+
+    args = parser.parse_args()
+
+    logging.basicConfig(format='%(levelname)s: %(asctime)s %(message)s')
+    LOGGER.setLevel(logging.INFO if args.verbose else logging.WARNING)
+
+    if args.benchmark == 'cookies':
+        report = benchmark_cookies(args)
+        print_cookies_report(report)
+    elif args.benchmark == 'resources':
+        report = benchmark_resources(args)
+        print_resources_report(report)
+    else:
+        report = benchmark_purchases(args)
+        print_report(report)
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+
+
+def benchmark_purchases(args):
+    example_merchant = __import__('program_files.merchants.example_merchant', fromlist=["*"])
+    server = serve_example_merchant(args.pages, args.heavy_pages)
+    example_merchant.BASE_URL = 'http://127.0.0.1:' + str(server.server_address[1]) + '/debbit/example-merchant/'
+
+    timer = PhaseTimer()
+    state_dir = tempfile.mkdtemp(prefix='debbit_benchmark_')
+    debbit.CONFIG = debbit.Config({
+        'mode': 'burst',
+        'hide_web_browser': not args.show_browser,
+        'notify_failure': 'your.email@website.com',
+        'send_failures_to_developer': False,
+        'coverage': {'policy': args.coverage_policy},
+        'cookies': {'transport': args.cookie_transport},
+        'profiles': {'persistent': args.persistent_profile},
+        'pacing': {'profile': args.pacing},
+        'resource_blocking': {'enabled': args.block_resources},
+        'benchmark_card': {'example_merchant': {
+            'total_purchases': args.n,
+            'amount_min': 1,
+            'amount_max': 100,
+            'usr': 'benchmark',
+            'psw': 'benchmark',
+            'card': '2222',
+            'burst_count': args.n,
+            'advanced': {'resource_blocking': {'block_hosts': ['localhost']}}  # where --heavy-pages serves its tracker
+        }}
+    })
+    debbit.CLOCK = VirtualClock(datetime.now())  # a failed purchase's retry is simply the next purchase, its backoff never waited out
+    debbit.STATE_STORE = StateStore(state_dir)
+    debbit.PROFILE_STORE = ProfileStore(os.path.join(state_dir, 'profiles'))
+    debbit.RETRY_STORE = RetryStore(state_dir)
+    debbit.PURCHASE_EXECUTOR = PurchaseExecutor()
+    debbit.FAILURE_STORE = FailureStore(os.path.join(state_dir, 'failures'))  # removed with state_dir, the user's failures folder is left alone
+    debbit.FAILURE_WRITER = FailureWriter(debbit.write_failure)
+    debbit.METRICS_STORE = MetricsStore(os.path.join(state_dir, 'metrics'))
+    debbit.LIVE_STATS = LiveStats()
+    debbit.restore_cookies = timer.wrap('cookie_restore', debbit.restore_cookies)
+    debbit.persist_cookies = timer.wrap('cookie_persist', debbit.persist_cookies)
+    debbit.write_cookies_to_profile = timer.wrap('cookie_restore', debbit.write_cookies_to_profile)
+    debbit.read_cookies_from_profile = timer.wrap('cookie_persist', debbit.read_cookies_from_profile)
+    resource_blocking.preferences = proxy_localhost(resource_blocking.preferences)
+    debbit.WEB_DRIVER_POOL = WebDriverPool(
+        timer.wrap('get_webdriver', timer.capture_browser(debbit.get_webdriver)),
+        timer.wrap('close_webdriver', debbit.close_webdriver),
+        max_sessions=1 if args.reuse_browser else 0,
+        idle_timeout=0
+    )
+
+    merchant = debbit.Merchant('benchmark_card', 'example_merchant', timer.wrap('automation', timer.capture_pacing(example_merchant.web_automation)), debbit.CONFIG.cards['benchmark_card']['example_merchant'], example_merchant.COOKIE_DOMAINS + ['127.0.0.1'])
+    cookies_file = debbit.absolute_path('program_files', 'cookies', merchant.name + '_' + merchant.usr)
+    if os.path.exists(cookies_file):
+        os.remove(cookies_file)  # the first purchase logs in, later purchases restore the login from cookies
+
+    results = {}
+    try:
+        for i in range(args.n):
+            timer.start_purchase()
+            start = time.perf_counter()
+            try:
+                result = debbit.web_automation_wrapper(merchant).name
+            except (Exception, SystemExit):  # gave up after repeated failures or an unverified purchase
+                result = 'stopped'
+            timer.finish_purchase(time.perf_counter() - start, result)
+            results[result] = results.get(result, 0) + 1
+
+            print('purchase ' + str(i + 1) + ' of ' + str(args.n) + ': ' + result + ' in ' + str(round(timer.samples[-1]['total'], 2)) + 's')
+            if result == 'stopped':
+                break
+    finally:
+        timer.start_purchase()  # the final quit of a reused browser isn't part of any purchase
+        debbit.WEB_DRIVER_POOL.close_all()
+        debbit.FAILURE_WRITER.flush()
+        resource_blocking.preferences = resource_blocking.preferences.__wrapped__
+        server.shutdown()
+        shutil.rmtree(state_dir, ignore_errors=True)
+        if os.path.exists(cookies_file):
+            os.remove(cookies_file)
+
+    return {
+        'benchmark': 'purchases',
+        'date': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        'platform': platform.platform(),
+        'python': platform.python_version(),
+        'browser': timer.browser,
+        'purchases': len(timer.samples),
+        'reuse_browser': args.reuse_browser,
+        'pacing': args.pacing,
+        'headless': not args.show_browser,
+        'coverage_policy': args.coverage_policy,
+        'cookie_transport': args.cookie_transport,
+        'persistent_profile': args.persistent_profile,
+        'block_resources': args.block_resources,
+        'heavy_pages': args.heavy_pages,
+        'results': results,
+        'phases': {phase: summarize([sample[phase] for sample in timer.samples if phase in sample]) for phase in PHASES},
+        'samples': timer.samples
+    }
+
+
+# Firefox never sends localhost through a proxy unless told to, which would let the heavy pages' tracker through
+def proxy_localhost(preferences):
+    @functools.wraps(preferences)
+    def preferences_with_localhost(block, allowed_hosts, blocked_hosts):
+        prefs = preferences(block, allowed_hosts, blocked_hosts)
+        prefs['network.proxy.allow_hijacking_localhost'] = 'trackers' in block
+        return prefs
+    return preferences_with_localhost
+
+
+def benchmark_resources(args):
+    runs = {}
+    for block_resources in [False, True]:
+        print('resource blocking ' + ('on' if block_resources else 'off'))
+        runs['blocked' if block_resources else 'unblocked'] = benchmark_purchases(argparse.Namespace(
+            n=args.n,
+            reuse_browser=args.reuse_browser,
+            pacing='fast',
+            coverage_policy='always',
+            persistent_profile=False,
+            cookie_transport='extension',
+            block_resources=block_resources,
+            heavy_pages=args.heavy_pages,
+            show_browser=args.show_browser,
+            pages=args.pages
+        ))
+
+    return {
+        'benchmark': 'resources',
+        'date': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        'platform': platform.platform(),
+        'python': platform.python_version(),
+        'heavy_pages': args.heavy_pages,
+        'runs': runs
+    }
+
+
+def benchmark_cookies(args):
+    transports = args.transport or ['sqlite', 'extension']
+    report = {
+        'benchmark': 'cookies',
+        'date': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        'platform': platform.platform(),
+        'python': platform.python_version(),
+        'launches': args.n,
+        'cookies': args.cookies,
+        'headless': not args.show_browser,
+        'transports': {}
+    }
+
+    restore_cookies = debbit.restore_cookies
+    persist_cookies = debbit.persist_cookies
+    write_cookies_to_profile = debbit.write_cookies_to_profile
+    read_cookies_from_profile = debbit.read_cookies_from_profile
+
+    for transport in transports:
+        timer = PhaseTimer()
+        debbit.CONFIG = debbit.Config({
+            'mode': 'burst',
+            'hide_web_browser': not args.show_browser,
+            'notify_failure': 'your.email@website.com',
+            'send_failures_to_developer': False,
+            'cookies': {'transport': transport},
+            'benchmark_card': {'cookie_benchmark': {
+                'total_purchases': 1,
+                'amount_min': 1,
+                'amount_max': 1,
+                'usr': 'benchmark',
+                'psw': 'benchmark',
+                'card': '2222',
+                'burst_count': 1
+            }}
+        })
+        debbit.restore_cookies = timer.wrap('cookie_restore', restore_cookies)
+        debbit.persist_cookies = timer.wrap('cookie_persist', persist_cookies)
+        debbit.write_cookies_to_profile = timer.wrap('cookie_restore', write_cookies_to_profile)
+        debbit.read_cookies_from_profile = timer.wrap('cookie_persist', read_cookies_from_profile)
+        get_webdriver = timer.wrap('get_webdriver', timer.capture_browser(debbit.get_webdriver))
+        close_webdriver = timer.wrap('close_webdriver', debbit.close_webdriver)
+
+        merchant = debbit.Merchant('benchmark_card', 'cookie_benchmark', None, debbit.CONFIG.cards['benchmark_card']['cookie_benchmark'], ['github.io'])
+        cookies_file = debbit.absolute_path('program_files', 'cookies', merchant.name + '_' + merchant.usr)
+        cookies = synthetic_cookies(args.cookies)
+        expected = cookie_db.filter_cookies(cookies, merchant.cookie_domains, time.time())
+        if not os.path.exists(os.path.dirname(cookies_file)):
+            os.makedirs(os.path.dirname(cookies_file))
+
+        lost = 0
+        try:
+            for i in range(args.n):
+                with open(cookies_file, 'w', encoding='utf-8') as f:  # unfiltered, like a file saved by an older version
+                    f.write(base64.b64encode(json.dumps(cookies).encode('utf-8')).decode('ascii'))
+
+                timer.start_purchase()
+                start = time.perf_counter()
+                close_webdriver(get_webdriver(merchant), merchant)
+
+                persisted = debbit.load_cookies(merchant) or []
+                missing = len(set([cookie['name'] for cookie in expected]) - set([cookie['name'] for cookie in persisted]))
+                lost += missing
+                timer.finish_purchase(time.perf_counter() - start, 'lost ' + str(missing) + ' cookies' if missing else 'ok')
+                print(transport + ' launch ' + str(i + 1) + ' of ' + str(args.n) + ': ' + timer.samples[-1]['result'] + ' in ' + str(round(timer.samples[-1]['total'], 2)) + 's')
+        finally:
+            debbit.restore_cookies = restore_cookies
+            debbit.persist_cookies = persist_cookies
+            debbit.write_cookies_to_profile = write_cookies_to_profile
+            debbit.read_cookies_from_profile = read_cookies_from_profile
+            if os.path.exists(cookies_file):
+                os.remove(cookies_file)
+
+        report['browser'] = timer.browser
+        report['transports'][transport] = {
+            'lost_cookies': lost,
+            'phases': {phase: summarize([sample[phase] for sample in timer.samples if phase in sample]) for phase in PHASES if phase not in ['automation', 'pacing']},
+            'samples': timer.samples
+        }
+
+    return report
+
+
+# Persistent cookies for the example merchant's domain, half of them host-only, with every fifth one from an ad domain
+# that is filtered out when restoring
+def synthetic_cookies(count):
+    expires = time.time() + 30 * 86400
+    return [{
+        'name': 'debbit_benchmark_' + str(i),
+        'value': base64.b64encode(os.urandom(24)).decode('ascii'),
+        'domain': '.ads.example.com' if i % 5 == 4 else 'jakehilborn.github.io' if i % 2 else '.github.io',
+        'hostOnly': bool(i % 2),
+        'path': '/',
+        'secure': True,
+        'httpOnly': bool(i % 3),
+        'sameSite': 'no_restriction',
+        'session': False,
+        'firstPartyDomain': '',
+        'expirationDate': expires,
+        'storeId': 'firefox-default'
+    } for i in range(count)]
+
+
+# Serves the docs directory at http://127.0.0.1:<port>/debbit/ so the example merchant pages' links, which assume they
+# are hosted at jakehilborn.github.io/debbit/, resolve to the local copy. With heavy_images, every page also loads that
+# many images, a web font, a video and a tracker script, each served after HEAVY_DELAY_SECS like a slow CDN would.
+def serve_example_merchant(pages_dir, heavy_images=0):
+    docs_dir = os.path.dirname(os.path.abspath(pages_dir))
+
+    class Handler(http.server.SimpleHTTPRequestHandler):
+        def translate_path(self, path):
+            if path.startswith('/debbit/'):
+                path = path[len('/debbit'):]
+            return super().translate_path(path)
+
+        def do_GET(self):
+            path = self.path.split('?')[0]
+            if path.startswith('/heavy/'):
+                time.sleep(HEAVY_DELAY_SECS)
+                extension = path.rsplit('.', 1)[-1]
+                self._send(HEAVY_CONTENT_TYPES.get(extension, 'application/octet-stream'), b'' if extension == 'js' else os.urandom(HEAVY_ASSET_BYTES))
+            elif heavy_images and path.endswith('.html') and os.path.isfile(self.translate_path(path)):
+                with open(self.translate_path(path), 'r', encoding='utf-8') as f:
+                    page = f.read()
+                self._send('text/html; charset=utf-8', page.replace('</body>', heavy_assets(heavy_images, self.server.server_address[1]) + '</body>').encode('utf-8'))
+            else:
+                super().do_GET()
+
+        def _send(self, content_type, data):
+            self.send_response(200)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(data)))
+            self.send_header('Cache-Control', 'no-store')  # like a purchase a day apart, nothing is cached between loads
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), functools.partial(Handler, directory=docs_dir))
+    Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+HEAVY_DELAY_SECS = 0.5
+HEAVY_ASSET_BYTES = 200 * 1024
+HEAVY_CONTENT_TYPES = {'png': 'image/png', 'woff2': 'font/woff2', 'mp4': 'video/mp4', 'js': 'application/javascript'}
+
+
+def heavy_assets(images, port):
+    return (''.join(['<img src="/heavy/image_' + str(i) + '.png" width="1" height="1">' for i in range(images)]) +
+            '<style>@font-face { font-family: heavy; src: url("/heavy/font.woff2"); } body { font-family: heavy, sans-serif; }</style>'
+            '<video src="/heavy/video.mp4" preload="auto" autoplay muted width="1" height="1"></video>'
+            '<script src="http://localhost:' + str(port) + '/heavy/tracker.js"></script>')
+
+
+# Adds up the seconds spent in each wrapped function during the current purchase
+class PhaseTimer:
+    def __init__(self):
+        self.samples = []
+        self.current = {}
+        self.browser = None
+
+    def wrap(self, phase, function):
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.current[phase] = self.current.get(phase, 0) + time.perf_counter() - start
+        return timed
+
+    # Remembers the browser name and version of the first Firefox started
+    def capture_browser(self, get_webdriver):
+        def get_webdriver_and_capture(merchant):
+            driver = get_webdriver(merchant)
+            if not self.browser:
+                self.browser = driver.capabilities.get('browserName', '') + ' ' + driver.capabilities.get('browserVersion', '')
+            return driver
+        return get_webdriver_and_capture
+
+    # Adds up the delays and settles of each attempt's utils.pace, which web_automation_wrapper() sets per attempt
+    def capture_pacing(self, web_automation):
+        def web_automation_and_capture(*args, **kwargs):
+            try:
+                return web_automation(*args, **kwargs)
+            finally:
+                self.current['pacing'] = self.current.get('pacing', 0) + utils.pace.delay_secs + utils.pace.settle_secs
+        return web_automation_and_capture
+
+    def start_purchase(self):
+        self.current = {}
+
+    def finish_purchase(self, total_secs, result):
+        sample = {'result': result, 'total': total_secs}
+        for phase in ['cookie_restore', 'automation', 'pacing', 'cookie_persist']:
+            if phase in self.current:
+                sample[phase] = self.current[phase]
+        if 'get_webdriver' in self.current:
+            sample['browser_start'] = self.current['get_webdriver'] - self.current.get('cookie_restore', 0)
+        if 'close_webdriver' in self.current:
+            sample['quit'] = self.current['close_webdriver'] - self.current.get('cookie_persist', 0)
+        self.samples.append(sample)
+
+
+def summarize(secs):
+    if not secs:
+        return {'count': 0}
+
+    return {
+        'count': len(secs),
+        'mean': round(sum(secs) / len(secs), 4),
+        'min': round(min(secs), 4),
+        'p50': round(percentile(secs, 50), 4),
+        'p90': round(percentile(secs, 90), 4),
+        'p95': round(percentile(secs, 95), 4),
+        'p99': round(percentile(secs, 99), 4),
+        'max': round(max(secs), 4)
+    }
+
+
+# Nearest-rank percentile, always one of the measured values
+def percentile(values, p):
+    ordered = sorted(values)
+    rank = max(1, -(-len(ordered) * p // 100))  # ceil without floats
+    return ordered[int(rank) - 1]
+
+
+def print_report(report):
+    print('')
+    print(str(report['purchases']) + ' ' + debbit.plural('purchase', report['purchases']) + ' with ' + str(report['browser']) + ', results: ' + json.dumps(report['results']))
+    print_phases(report['phases'])
+
+
+def print_resources_report(report):
+    unblocked = report['runs']['unblocked']
+    blocked = report['runs']['blocked']
+    for name, run in [('without', unblocked), ('with', blocked)]:
+        print('')
+        print(str(run['purchases']) + ' ' + debbit.plural('purchase', run['purchases']) + ' ' + name + ' resource blocking, results: ' + json.dumps(run['results']))
+        print_phases(run['phases'])
+
+    print('')
+    print('phase          p50 saved  p90 saved')
+    for phase in PHASES:
+        if not unblocked['phases'][phase]['count'] or not blocked['phases'][phase]['count']:
+            continue
+        print(phase.ljust(15) + ''.join([(str(round(unblocked['phases'][phase][key] - blocked['phases'][phase][key], 2)) + 's').rjust(10) + ' ' for key in ['p50', 'p90']]).rstrip())
+
+
+def print_cookies_report(report):
+    print('')
+    print(str(report['launches']) + ' Firefox ' + debbit.plural('start', report['launches']) + ' per transport with ' + str(report['browser']) + ', ' + str(report['cookies']) + ' cookies')
+    for transport, results in report['transports'].items():
+        print('')
+        print(transport + ' transport, cookies lost: ' + str(results['lost_cookies']))
+        print_phases(results['phases'])
+
+
+def print_phases(phases):
+    print('phase            count      p50      p90      p99      max')
+    for phase, stats in phases.items():
+        if not stats['count']:
+            print(phase.ljust(15) + '      0')
+            continue
+        print(phase.ljust(15) + str(stats['count']).rjust(7) + ''.join([(str(round(stats[key], 2)) + 's').rjust(9) for key in ['p50', 'p90', 'p99', 'max']]))
+
+
+if __name__ == '__main__':
+    main()
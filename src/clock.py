@@ -0,0 +1,34 @@
+import time
+from datetime import datetime
+
+
+# Where debbit reads the time from. The scheduling code calls CLOCK.now(), CLOCK.time() and CLOCK.sleep() instead of
+# datetime.now(), time.time() and time.sleep() so simulate.py can run a whole month of scheduling against a
+# VirtualClock in seconds.
+class SystemClock:
+    def now(self):
+        return datetime.now()
+
+    def time(self):
+        return time.time()
+
+    def sleep(self, secs):
+        time.sleep(secs)
+
+
+# A clock that only moves when told to. sleep() returns immediately after moving the clock forward.
+class VirtualClock:
+    def __init__(self, start):
+        self.unix_time = start.timestamp()
+
+    def now(self):
+        return datetime.fromtimestamp(self.unix_time)
+
+    def time(self):
+        return self.unix_time
+
+    def sleep(self, secs):
+        self.unix_time += secs
+
+    def advance_to(self, unix_time):
+        self.unix_time = max(self.unix_time, unix_time)
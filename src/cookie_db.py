@@ -0,0 +1,137 @@
+import os
+import sqlite3
+import time
+
+# Schema of moz_cookies as of Firefox 91. Firefox upgrades a cookies.sqlite with an older user_version the first time it
+# opens it, so writing this version works with every newer Firefox.
+SCHEMA_VERSION = 12
+CREATE_TABLE = '''CREATE TABLE moz_cookies (
+    id INTEGER PRIMARY KEY,
+    originAttributes TEXT NOT NULL DEFAULT '',
+    name TEXT,
+    value TEXT,
+    host TEXT,
+    path TEXT,
+    expiry INTEGER,
+    lastAccessed INTEGER,
+    creationTime INTEGER,
+    isSecure INTEGER,
+    isHttpOnly INTEGER,
+    inBrowserElement INTEGER DEFAULT 0,
+    sameSite INTEGER DEFAULT 0,
+    rawSameSite INTEGER DEFAULT 0,
+    schemeMap INTEGER DEFAULT 0,
+    CONSTRAINT moz_uniqueid UNIQUE (name, host, path, originAttributes)
+)'''
+
+SAME_SITE = {'no_restriction': 0, 'lax': 1, 'strict': 2}  # WebExtension cookies.SameSiteStatus -> nsICookie value
+SCHEME_HTTPS = 2
+
+
+# Reads and writes a Firefox profile's cookies.sqlite directly so cookies can be restored before Firefox starts and
+# persisted after it quits, without loading restore-cookies.html or persist-cookies.html. Cookies are the same dicts the
+# selenium-cookies-extension produces with browser.cookies.getAll(), so the files in program_files/cookies work with
+# either transport.
+#
+# cookies.sqlite only holds persistent cookies. Saved session cookies, which have no expirationDate, are written with a
+# one day expiry, and session cookies a website sets while Firefox is open are not read back.
+def write_cookies(profile_dir, cookies):
+    path = os.path.join(profile_dir, 'cookies.sqlite')
+    if os.path.exists(path):
+        os.remove(path)
+
+    now_us = int(time.time() * 1000000)
+    rows = []
+    for i, cookie in enumerate(cookies):
+        expiry = cookie.get('expirationDate') or time.time() + 86400
+        rows.append((
+            origin_attributes(cookie.get('firstPartyDomain')),
+            cookie['name'],
+            cookie['value'],
+            cookie['domain'],
+            cookie.get('path', '/'),
+            int(expiry),
+            now_us,
+            now_us + i,  # Firefox orders cookies by creationTime, keep them distinct and in the saved order
+            int(bool(cookie.get('secure'))),
+            int(bool(cookie.get('httpOnly'))),
+            SAME_SITE.get(cookie.get('sameSite'), 0),
+            SAME_SITE.get(cookie.get('sameSite'), 0),
+            SCHEME_HTTPS
+        ))
+
+    db = sqlite3.connect(path)
+    try:
+        db.execute(CREATE_TABLE)
+        db.executemany('INSERT OR REPLACE INTO moz_cookies (originAttributes, name, value, host, path, expiry, lastAccessed, creationTime, isSecure, isHttpOnly, sameSite, rawSameSite, schemeMap) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', rows)
+        db.execute('PRAGMA user_version = ' + str(SCHEMA_VERSION))
+        db.commit()
+    finally:
+        db.close()
+
+
+# Returns the cookies in a profile's cookies.sqlite or None if Firefox never created one
+def read_cookies(profile_dir):
+    path = os.path.join(profile_dir, 'cookies.sqlite')
+    if not os.path.exists(path):
+        return None
+
+    db = sqlite3.connect(path)
+    try:
+        rows = db.execute('SELECT originAttributes, name, value, host, path, expiry, isSecure, isHttpOnly, sameSite FROM moz_cookies ORDER BY creationTime').fetchall()
+    finally:
+        db.close()
+
+    now = time.time()
+    same_site_names = {value: name for name, value in SAME_SITE.items()}
+    cookies = []
+    for attributes, name, value, host, path, expiry, secure, http_only, same_site in rows:
+        if expiry > 100000000000:  # Firefox 133+ stores milliseconds
+            expiry = expiry / 1000
+        if expiry < now:
+            continue
+
+        cookies.append({
+            'name': name,
+            'value': value,
+            'domain': host,
+            'hostOnly': not host.startswith('.'),
+            'path': path,
+            'secure': bool(secure),
+            'httpOnly': bool(http_only),
+            'sameSite': same_site_names.get(same_site, 'no_restriction'),
+            'session': False,
+            'firstPartyDomain': first_party_domain(attributes),
+            'expirationDate': expiry,
+            'storeId': 'firefox-default'
+        })
+    return cookies
+
+
+# Drops cookies that have expired and, if domains is not None, cookies that don't belong to one of the domains or their
+# subdomains, e.g. ad and tracker cookies picked up during checkout. Session cookies never expire here.
+def filter_cookies(cookies, domains, now):
+    kept = []
+    for cookie in cookies:
+        if cookie.get('expirationDate') and cookie['expirationDate'] < now:
+            continue
+        if domains is not None and not any([domain_matches(cookie['domain'], domain) for domain in domains]):
+            continue
+        kept.append(cookie)
+    return kept
+
+
+def domain_matches(cookie_domain, domain):
+    host = cookie_domain.lstrip('.').lower()
+    return host == domain or host.endswith('.' + domain)
+
+
+def origin_attributes(first_party_domain):
+    return '^firstPartyDomain=' + first_party_domain if first_party_domain else ''
+
+
+def first_party_domain(attributes):
+    for attribute in (attributes or '').lstrip('^').split('&'):
+        if attribute.startswith('firstPartyDomain='):
+            return attribute[len('firstPartyDomain='):]
+    return ''
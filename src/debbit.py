@@ -1,38 +1,64 @@
 #!/usr/bin/env python3
+import atexit
 import base64
+import json
 import logging
 import os
 import platform
 import random
+import shutil
 import smtplib
 import ssl
 import sys
+import tempfile
 import time
 import traceback
 import urllib.request
-import zipfile
 from datetime import datetime
 from datetime import timedelta
 from email import encoders
 from email.mime.base import MIMEBase
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
-from io import BytesIO
-from threading import Timer, Lock, Thread
 
 import coverage
 import yaml  # PyYAML
 from selenium import webdriver
-from selenium.common.exceptions import SessionNotCreatedException
+from selenium.common.exceptions import SessionNotCreatedException, TimeoutException
 from selenium.webdriver.firefox.options import Options
 
+import cookie_db
+import resource_blocking
+import retries
+import utils
+from clock import SystemClock
+from failure_store import FailureStore
+from failure_writer import FailureWriter
+from line_recorder import LineRecorder
+from log_pipeline import JsonLinesFormatter, LogPipeline, RotatingGzipFileHandler
+from metrics import LiveStats, MetricsStore, percentile, prometheus_family, step_seconds
+from planner import PlanStore
+from preflight import HttpSession, PreflightCache
+from profiles import ProfileStore
+from purchase_executor import PurchaseExecutor
+from retries import RetryStore
 from result import Result
+from scheduler import Scheduler
+from state import StateStore, SqliteStateStore
+from status_server import StatusServer
+from webdriver_pool import WebDriverPool
+
+LOGGER = logging.getLogger('debbit')
+DAYS_IN_MONTH = {1: 31, 2: 28, 3: 31, 4: 30, 5: 31, 6: 30, 7: 31, 8: 31, 9: 30, 10: 31, 11: 30, 12: 31}
 
 
 def main():
     update_check()
 
-    now = datetime.now()
+    now = CLOCK.now()
+    prev_month = now.replace(day=1) - timedelta(days=1)
+    STATE_STORE.compact(prev_month.year, prev_month.month)  # fold transaction journals left behind by the last run into the state files
+    STATE_STORE.compact(now.year, now.month)
     state = load_state(now.year, now.month)
 
     if not state:
@@ -43,95 +69,335 @@ def main():
         LOGGER.info(str(cur_purchase_count) + ' ' + merchant_id + ' ' + plural('purchase', cur_purchase_count) + ' complete for ' + now.strftime('%B %Y'))
     LOGGER.info('')
 
-    for card, merchants in CONFIG.cards.items():
-        for merchant_name, merchant_conf in merchants.items():
-            load_merchant(card, merchant_name, merchant_conf)
+    merchants = load_merchants()
+    for merchant in merchants:
+        SCHEDULER.schedule(CLOCK.time(), run_plan, merchant)
 
+    # Worker threads are only started while that many purchases are in progress at the same time, usually one or two no
+    # matter how many merchants are configured. A merchant waiting to retry a failure doesn't hold one.
+    SCHEDULER.max_workers = max(len(merchants), 1)
+    SCHEDULER.start()
 
-def load_state(year, month):
-    padded_month = '0' + str(month) if month < 10 else str(month)
-    filename = absolute_path('state', 'debbit_' + str(year) + '_' + padded_month + '.txt')
+    if CONFIG.status_server_enabled:
+        StatusServer(CONFIG.status_server_port, lambda: status(merchants), lambda: prometheus_metrics(merchants)).start()
+
+
+# Entry point for "debbit plan". Prints this month's planned purchases for every merchant without opening a browser.
+def print_plan():
+    now = CLOCK.now()
+    planned = []
+    for merchant in load_merchants():
+        for slot in current_plan(merchant, now)['slots']:
+            planned.append((merchant, slot))
+
+    if not planned:
+        LOGGER.info('No purchases left to plan for ' + now.strftime('%B %Y'))
+        return
+
+    LOGGER.info('Planned purchases for ' + now.strftime('%B %Y') + ', saved in ' + PLAN_STORE.directory)
+    purchases_per_day = {}
+    for merchant, slot in sorted(planned, key=lambda planned_slot: planned_slot[1]['unix_time']):
+        amounts = ', '.join(['$' + utils.cents_to_str(amount) for amount in slot['amounts']])
+        LOGGER.info(slot['human_time'] + '  ' + merchant.id + '  ' + str(slot['purchases']) + ' ' + plural('purchase', slot['purchases']) + '  ' + amounts)
+        day = slot['human_time'][:10]
+        purchases_per_day[day] = purchases_per_day.get(day, 0) + slot['purchases']
+
+    LOGGER.info('')
+    LOGGER.info('Purchases per day:')
+    for day, count in purchases_per_day.items():
+        LOGGER.info(day + '  ' + str(count))
+
+
+# Entry point for "debbit failures", which lists recorded failures, and "debbit failures export [failure ...]", which
+# saves each failure (or every failure if none are named) as a zip in failures/exports for sharing
+def failures_command(args):
+    failures = dict(FAILURE_STORE.list())
+
+    if args[:1] == ['export']:
+        if not os.path.exists(absolute_path('failures', 'exports')):
+            os.makedirs(absolute_path('failures', 'exports'))
+
+        for failure_id in args[1:] or list(failures):
+            if failure_id not in failures:
+                LOGGER.error('No recorded failure named ' + failure_id + ', run "debbit failures" to list them')
+                continue
+            with open(absolute_path('failures', 'exports', failure_id + '.zip'), 'wb') as f:
+                FAILURE_STORE.write_zip(failure_id, f)
+            LOGGER.info('Saved ' + absolute_path('failures', 'exports', failure_id + '.zip'))
+        return
+
+    if not failures:
+        LOGGER.info('No failures recorded')
+        return
+
+    for failure_id, entry in failures.items():
+        size_kb = int(FAILURE_STORE.stored_bytes(failure_id) / 1024)
+        LOGGER.info(datetime.fromtimestamp(entry['created']).strftime("%Y-%m-%d %I:%M%p") + '  ' + failure_id + '  ' + str(len(entry['files'])) + ' files, ' + str(size_kb) + 'KB')
 
+
+# Entry point for "debbit metrics [YYYY-MM]", which prints how long each step of each merchant's purchases took in the
+# given month, the current month by default
+def metrics_command(args):
+    now = CLOCK.now()
     try:
-        with open(filename, 'r', encoding='utf-8') as f:
-            return yaml.safe_load(f.read())
-    except FileNotFoundError:
-        return {}
+        month = datetime.strptime(args[0], '%Y-%m') if args else now
+    except ValueError:
+        LOGGER.error('Usage: debbit metrics [YYYY-MM]')
+        sys.exit(1)
+
+    merchants = step_seconds(METRICS_STORE.load(month.year, month.month))
+    if not merchants:
+        LOGGER.info('No purchase attempts recorded for ' + month.strftime('%B %Y'))
+        return
+
+    LOGGER.info('Purchase attempt step timings for ' + month.strftime('%B %Y') + ', recorded in ' + METRICS_STORE.directory)
+    for merchant_id, steps in sorted(merchants.items()):
+        LOGGER.info('')
+        LOGGER.info(merchant_id)
+        LOGGER.info('    step                        count      p50      p95')
+        for name, secs in steps.items():
+            LOGGER.info('    ' + name.ljust(26) + str(len(secs)).rjust(7) + ''.join([(str(round(percentile(secs, p), 1)) + 's').rjust(9) for p in [50, 95]]))
+
+
+# Returns a read-only snapshot of the month's state, use state.thaw() to get a copy that can be modified
+def load_state(year, month):
+    return STATE_STORE.load(year, month)
+
+
+def load_merchants():
+    merchants = []
+    for card, merchant_confs in CONFIG.cards.items():
+        for merchant_name, merchant_conf in merchant_confs.items():
+            merchants.append(load_merchant(card, merchant_name, merchant_conf))
+    return merchants
 
 
 def load_merchant(card, merchant_name, merchant_conf):
     try:
-        web_automation = __import__('program_files.merchants.' + merchant_name, fromlist=["*"]).web_automation
+        merchant_module = __import__('program_files.merchants.' + merchant_name, fromlist=["*"])
+        web_automation = merchant_module.web_automation
     except (KeyboardInterrupt, SystemExit):
         raise
     except Exception as e:
         LOGGER.error('Error loading ' + merchant_name + '.py from merchants folder')
         raise e
 
-    merchant = Merchant(card, merchant_name, web_automation, merchant_conf)
+    # Optional, merchant modules without COOKIE_DOMAINS keep every cookie, without RESOURCE_ALLOWLIST block every image
+    # when resource_blocking is on, without REQUIRED_RESOURCES can have every category blocked and without preflight()
+    # always start Firefox
+    return Merchant(card, merchant_name, web_automation, merchant_conf, getattr(merchant_module, 'COOKIE_DOMAINS', None), getattr(merchant_module, 'RESOURCE_ALLOWLIST', None), getattr(merchant_module, 'preflight', None), getattr(merchant_module, 'REQUIRED_RESOURCES', None))
 
-    if CONFIG.mode == 'spread':
-        start_spread_schedule(merchant)
+
+# Runs the merchant's next planned burst (or purchase in spread mode) if it's due, otherwise schedules itself for when
+# it is due
+def run_plan(merchant):
+    utils.set_log_merchant(merchant.id, merchant.card_name)
+
+    now = CLOCK.now()
+    retry = RETRY_STORE.get(merchant.id)
+    if retry:
+        resume_retry(merchant, now, retry)
+        return
+
+    plan = current_plan(merchant, now)
+
+    if not plan['slots'] or plan['slots'][0]['unix_time'] > now.timestamp():
+        schedule_plan(merchant, plan)
+        return
+
+    slot = plan['slots'][0]
     if CONFIG.mode == 'burst':
-        Thread(target=burst_loop, args=(merchant,)).start()
+        LOGGER.info('Now bursting ' + str(slot['purchases']) + ' ' + merchant.id + ' ' + plural('purchase', slot['purchases']))
+        burst_purchase(merchant, BurstState(now, slot['purchases']))
+    else:
+        burst_purchase(merchant, BurstState(now, 1))  # a spread purchase is a burst of one
+
+
+# Schedules run_plan() for the plan's next slot, or for when the next plan is needed if no slots are left
+def schedule_plan(merchant, plan):
+    if not plan['slots']:
+        if plan['next_plan_time'] is None:
+            return  # next_spread_offset() already logged why
+        log_next_slot(merchant, plan['next_plan_time'], merchant.burst_count)
+        SCHEDULER.schedule(plan['next_plan_time'], run_plan, merchant)
+        return
 
+    slot = plan['slots'][0]
+    log_next_slot(merchant, slot['unix_time'], slot['purchases'])
+    SCHEDULER.schedule(slot['unix_time'], run_plan, merchant)
+
+
+# Makes the retry of a failed purchase saved in RETRY_STORE once it's due, then carries on with the rest of its burst.
+# Until then run_plan() is scheduled for retry_time, which after a restart keeps the backoff the failure started.
+def resume_retry(merchant, now, retry):
+    if retry['retry_time'] > now.timestamp():
+        LOGGER.info('Retrying ' + merchant.id + ' at ' + retry['human_time'] + ' after ' + str(retry['failures']) + ' failed ' + plural('attempt', retry['failures']) + ', latest ' + retry['failure_class'])
+        LIVE_STATS.backoff(merchant.id, retry['retry_time'])
+        SCHEDULER.schedule(retry['retry_time'], run_plan, merchant)
+        return
+
+    LIVE_STATS.backoff(merchant.id, None)
+    LOGGER.info('Retrying ' + merchant.id + ' now, ' + str(retry['remaining']) + ' ' + plural('purchase', retry['remaining']) + ' left in the burst')
+    burst_purchase(merchant, BurstState(datetime.fromtimestamp(retry['slot_start']), retry['remaining']))
+
+
+# Makes one purchase of a burst and schedules the next purchase after burst_intra_gap seconds. A failed purchase is
+# retried by run_plan() at the retry_time web_automation_wrapper() saved.
+def burst_purchase(merchant, burst_state):
+    utils.set_log_merchant(merchant.id, merchant.card_name)
+
+    result = web_automation_wrapper(merchant, burst_state)
+    if result == Result.failed:
+        SCHEDULER.schedule(RETRY_STORE.get(merchant.id)['retry_time'], run_plan, merchant)
+        return
+
+    burst_state.remaining -= 1
+
+    if result == Result.success and burst_state.remaining > 0:
+        sleep_time = merchant.burst_intra_gap
+        LOGGER.info('Waiting ' + str(sleep_time) + ' ' + plural('second', sleep_time) + ' before next ' + merchant.id + ' purchase')
+        SCHEDULER.schedule(CLOCK.time() + sleep_time, burst_purchase, merchant, burst_state)
+        return
+
+    finish_slot(merchant, burst_state.burst_start, result)
+
+
+# Moves on to the next planned slot if all of the purchases of the slot that started at slot_start succeeded, the
+# recorded purchases mark the slot done (see current_plan()). Otherwise the rest of the month is planned again, starting
+# a day later if the merchant asked to skip in burst mode, or a spread gap later in spread mode. The next slot is always
+# scheduled rather than run here, even if it's due, so a merchant that keeps skipping can't run itself over and over.
+def finish_slot(merchant, slot_start, result):
+    now = CLOCK.now()
+    cur_purchase_count = STATE_STORE.purchase_count(merchant.id, now.year, now.month)
+
+    if result != Result.success and CONFIG.mode == 'burst':
+        burst_gap = get_burst_min_gap(merchant, cur_purchase_count, slot_start) + random.randint(0, int(merchant.burst_time_variance))
+        skip_time = slot_start + timedelta(days=1) if result == Result.skipped else None
+        plan = replan(merchant, now, burst_gap, skip_time)
+    elif result != Result.success:
+        start_offset = next_spread_offset(merchant, now, cur_purchase_count)
+        plan = replan(merchant, now, skip_time=now + timedelta(seconds=start_offset) if start_offset is not None else None)
+    else:
+        plan = current_plan(merchant, now)
 
-def burst_loop(merchant):
-    # These 3 variables are modified during each loop
-    suppress_logs = False
-    burst_gap = None
-    skip_time = datetime.fromtimestamp(0)
+    schedule_plan(merchant, plan)
 
+
+# Returns the merchant's plan for this month with the slots that are already done left out, making a new plan if there
+# is none or it no longer matches the config or state, e.g. debbit was stopped past a planned purchase or the state file
+# was edited.
+def current_plan(merchant, now):
+    plan = PLAN_STORE.get(now.year, now.month, merchant.id)
+
+    if plan and plan['fingerprint'] == plan_fingerprint(merchant):
+        late_secs = 600  # the scheduler may wake up a little late, this isn't a missed slot
+        cur_purchase_count = STATE_STORE.purchase_count(merchant.id, now.year, now.month)
+        slots = [slot for slot in plan['slots'] if slot['purchase_count_before'] >= cur_purchase_count]
+
+        if slots:
+            if slots[0]['purchase_count_before'] == cur_purchase_count and slots[0]['unix_time'] > now.timestamp() - late_secs:
+                return dict(plan, slots=slots)
+        elif plan['purchase_count_after'] == cur_purchase_count and (plan['next_plan_time'] or 0) > now.timestamp() - late_secs:
+            return dict(plan, slots=slots)
+
+    return replan(merchant, now)
+
+
+def replan(merchant, now, burst_gap=None, skip_time=None):
+    if CONFIG.mode == 'burst':
+        slots, next_plan_time = plan_bursts(merchant, now, burst_gap, skip_time)
+    else:
+        slots, next_plan_time = plan_spread(merchant, now, skip_time)
+
+    plan = {
+        'fingerprint': plan_fingerprint(merchant),
+        'planned_at': now.strftime("%Y-%m-%d %I:%M%p"),
+        'slots': slots,
+        'purchase_count_after': STATE_STORE.purchase_count(merchant.id, now.year, now.month) + sum([slot['purchases'] for slot in slots]),
+        'next_plan_time': next_plan_time
+    }
+    PLAN_STORE.put(now.year, now.month, merchant.id, plan)
+
+    purchase_count = sum([slot['purchases'] for slot in slots])
+    LOGGER.info('Planned ' + str(purchase_count) + ' ' + merchant.id + ' ' + plural('purchase', purchase_count) + ' for the rest of ' + now.strftime('%B %Y'))
+    return plan
+
+
+# The merchant's scheduling config. A plan made with a different config is thrown away.
+def plan_fingerprint(merchant):
+    return ' '.join([str(value) for value in [
+        CONFIG.mode, merchant.total_purchases, merchant.amount_min, merchant.amount_max, merchant.burst_count,
+        merchant.min_day, merchant.max_day, merchant.burst_min_gap, merchant.burst_time_variance, merchant.burst_intra_gap, merchant.burst_poll_gap,
+        merchant.spread_min_gap, merchant.spread_time_variance
+    ]])
+
+
+def new_slot(start, amounts, purchase_count_before):
+    return {
+        'unix_time': int(start.timestamp()),
+        'human_time': start.strftime("%Y-%m-%d %I:%M%p"),
+        'purchases': len(amounts),
+        'amounts': amounts,
+        'purchase_count_before': purchase_count_before
+    }
+
+
+def log_next_slot(merchant, unix_time, purchases):
+    human_time = datetime.fromtimestamp(unix_time).strftime("%Y-%m-%d %I:%M%p")
+    if CONFIG.mode == 'burst':
+        LOGGER.info('Bursting next ' + str(purchases) + ' ' + merchant.id + ' ' + plural('purchase', purchases) + ' after ' + human_time)
+    else:
+        LOGGER.info('Scheduling next ' + merchant.id + ' at ' + human_time)
+        LOGGER.info('')
+
+
+# Plans the rest of the month's bursts by stepping through the burst mode rules from now, assuming every purchase
+# succeeds. Returns the planned slots and the unix time the next plan is needed, usually when next month's bursts start.
+def plan_bursts(merchant, now, burst_gap=None, skip_time=None):
+    skip_time = skip_time or datetime.fromtimestamp(0)
+    cur_purchase_count = STATE_STORE.purchase_count(merchant.id, now.year, now.month)
+    purchase_times = [transaction['unix_time'] for transaction in STATE_STORE.last_transactions(merchant.id, now.year, now.month, merchant.burst_count)]
+    past_amounts = STATE_STORE.last_amounts(merchant.id, now.year, now.month)
+
+    if burst_gap is None:
+        burst_gap = get_burst_min_gap(merchant, cur_purchase_count, now)
+
+    slots = []
+    t = now
     while True:
-        now = datetime.now()
-        state = load_state(now.year, now.month)
-        this_burst_count = merchant.burst_count
-        prev_burst_time = 0
-        cur_purchase_count = state.get(merchant.id, {}).get('purchase_count') or 0
-
-        if not burst_gap:  # only applies to first loop
-            burst_gap = get_burst_min_gap(merchant, cur_purchase_count, now)
-
-        if merchant.id in state:
-            if len(state[merchant.id]['transactions']) >= merchant.burst_count:
-                prev_burst_time = state[merchant.id]['transactions'][merchant.burst_count * -1]['unix_time']
-
-            for transaction in state[merchant.id]['transactions'][-min(len(state[merchant.id]['transactions']), merchant.burst_count):]:
-                if transaction['unix_time'] > int(now.timestamp()) - min(get_burst_min_gap(merchant, cur_purchase_count, now), 3600):
-                    this_burst_count -= 1  # Program was stopped during burst within 60 minutes ago, count how many occurred within the last partial burst
-
-        this_burst_count = min(this_burst_count, merchant.total_purchases - cur_purchase_count)
-
-        if prev_burst_time < int(now.timestamp()) - burst_gap \
-                and now.day >= merchant.min_day \
-                and now.day <= (merchant.max_day if merchant.max_day else DAYS_IN_MONTH[now.month] - 1) \
-                and cur_purchase_count < merchant.total_purchases \
-                and now > skip_time:
-
-            LOGGER.info('Now bursting ' + str(this_burst_count) + ' ' + merchant.id + ' ' + plural('purchase', this_burst_count))
-
-            result = web_automation_wrapper(merchant)  # First execution outside of loop so we don't sleep before first execution and don't sleep after last execution
-            cur_purchase_count += 1
-            for i in range(this_burst_count - 1):
-                if result != Result.success:
-                    break
-                sleep_time = merchant.burst_intra_gap
-                LOGGER.info('Waiting ' + str(sleep_time) + ' ' + plural('second', sleep_time) + ' before next ' + merchant.id + ' purchase')
-                time.sleep(sleep_time)
-                result = web_automation_wrapper(merchant)
-                cur_purchase_count += 1
-
-            burst_gap = get_burst_min_gap(merchant, cur_purchase_count, now) + random.randint(0, int(merchant.burst_time_variance))
-
-            if result == Result.skipped:
-                skip_time = now + timedelta(days=1)
-
-            suppress_logs = False
-        elif not suppress_logs:
-            log_next_burst_time(merchant, now, prev_burst_time, burst_gap, skip_time, cur_purchase_count)
-            suppress_logs = True
-        else:
-            time.sleep(merchant.burst_poll_gap)
+        prev_burst_time = purchase_times[merchant.burst_count * -1] if len(purchase_times) >= merchant.burst_count else 0
+
+        # Program was stopped during burst within 60 minutes ago, count how many occurred within the last partial burst
+        recent_purchase_count = len([p for p in purchase_times[-merchant.burst_count:] if p > int(t.timestamp()) - min(get_burst_min_gap(merchant, cur_purchase_count, t), 3600)])
+        this_burst_count = min(merchant.burst_count - recent_purchase_count, merchant.total_purchases - cur_purchase_count)
+
+        if this_burst_count > 0 and is_burst_due(merchant, t, prev_burst_time, burst_gap, skip_time, cur_purchase_count):
+            amounts = []
+            for i in range(this_burst_count):
+                amounts.append(pick_amount(merchant, past_amounts + amounts))
+                purchase_times.append(int(t.timestamp()) + i * merchant.burst_intra_gap)
+
+            slots.append(new_slot(t, amounts, cur_purchase_count))
+            cur_purchase_count += this_burst_count
+            past_amounts += amounts
+            burst_gap = get_burst_min_gap(merchant, cur_purchase_count, t) + random.randint(0, int(merchant.burst_time_variance))
+            prev_burst_time = purchase_times[merchant.burst_count * -1] if len(purchase_times) >= merchant.burst_count else 0
+
+        next_time = next_burst_time(merchant, t, prev_burst_time, burst_gap, skip_time, cur_purchase_count)
+        if next_time <= t:  # not quite due yet, e.g. on the exact second the gap ends
+            next_time = t + timedelta(seconds=merchant.burst_poll_gap)
+
+        if (next_time.year, next_time.month) != (now.year, now.month):
+            return slots, int(next_time.timestamp())
+        t = next_time
+
+
+def is_burst_due(merchant, now, prev_burst_time, burst_gap, skip_time, cur_purchase_count):
+    return prev_burst_time < int(now.timestamp()) - burst_gap \
+        and now.day >= merchant.min_day \
+        and now.day <= (merchant.max_day if merchant.max_day else DAYS_IN_MONTH[now.month] - 1) \
+        and cur_purchase_count < merchant.total_purchases \
+        and now > skip_time
 
 
 def get_burst_min_gap(merchant, cur_purchase_count, now):
@@ -151,7 +417,7 @@ def get_burst_min_gap(merchant, cur_purchase_count, now):
     return min(dynamic_burst_min_gap, default_burst_min_gap)
 
 
-def log_next_burst_time(merchant, now, prev_burst_time, burst_gap, skip_time, cur_purchase_count):
+def next_burst_time(merchant, now, prev_burst_time, burst_gap, skip_time, cur_purchase_count):
     prev_burst_plus_gap_dt = datetime.fromtimestamp(prev_burst_time + burst_gap)
     cur_month_min_day_dt = datetime(now.year, now.month, merchant.min_day)
 
@@ -166,42 +432,54 @@ def log_next_burst_time(merchant, now, prev_burst_time, burst_gap, skip_time, cu
 
     if now.day < merchant.min_day:
         next_burst_time = prev_burst_plus_gap_dt if prev_burst_plus_gap_dt > cur_month_min_day_dt else cur_month_min_day_dt
-        next_burst_count = merchant.burst_count
     elif cur_purchase_count >= merchant.total_purchases or now.day > (merchant.max_day if merchant.max_day else DAYS_IN_MONTH[now.month] - 1):
         next_burst_time = prev_burst_plus_gap_dt if prev_burst_plus_gap_dt > next_month_min_day_dt else next_month_min_day_dt
-        next_burst_count = merchant.burst_count
     else:
         next_burst_time = prev_burst_plus_gap_dt
-        next_burst_count = min(merchant.burst_count, merchant.total_purchases - cur_purchase_count)
 
     if next_burst_time < skip_time:
         next_burst_time = skip_time
 
-    LOGGER.info('Bursting next ' + str(next_burst_count) + ' ' + merchant.id + ' ' + plural('purchase', next_burst_count) + ' after ' + next_burst_time.strftime("%Y-%m-%d %I:%M%p"))
+    return next_burst_time
 
 
-def start_spread_schedule(merchant):
-    now = datetime.now()
-    state = load_state(now.year, now.month)
+# Plans the rest of the month's purchases in spread mode, assuming every purchase succeeds, with none before skip_time.
+# Returns the planned slots and the unix time the next plan is needed, usually when next month's purchases start.
+def plan_spread(merchant, now, skip_time=None):
+    cur_purchase_count = STATE_STORE.purchase_count(merchant.id, now.year, now.month)
+    last_transaction = STATE_STORE.last_transactions(merchant.id, now.year, now.month, 1)
+    past_amounts = STATE_STORE.last_amounts(merchant.id, now.year, now.month)
 
-    if merchant.id not in state:  # first run of the month
-        if now.day >= merchant.min_day:
-            spread_recursion(merchant)
-        else:
-            start_offset = (datetime(now.year, now.month, merchant.min_day) - now).total_seconds()
-            LOGGER.info('Scheduling ' + merchant.id + ' at ' + formatted_date_of_offset(now, start_offset))
-            Timer(start_offset, spread_recursion, [merchant]).start()
-    elif state[merchant.id]['purchase_count'] < merchant.total_purchases and now.timestamp() - state[merchant.id]['transactions'][-1]['unix_time'] > merchant.spread_min_gap:
-        spread_recursion(merchant)
+    if not cur_purchase_count and not last_transaction:  # first run of the month
+        t = now if now.day >= merchant.min_day else datetime(now.year, now.month, merchant.min_day)
+    elif cur_purchase_count < merchant.total_purchases and (not last_transaction or now.timestamp() - last_transaction[-1]['unix_time'] > merchant.spread_min_gap):
+        t = now
     else:
-        schedule_next_spread(merchant)
+        start_offset = next_spread_offset(merchant, now, cur_purchase_count)
+        if start_offset is None:
+            return [], None
+        t = now + timedelta(seconds=start_offset)
 
+    if skip_time and t < skip_time:
+        t = skip_time
 
-def schedule_next_spread(merchant):
-    now = datetime.now()
-    state = load_state(now.year, now.month)
-    cur_purchase_count = state[merchant.id]['purchase_count'] if merchant.id in state else 0
+    slots = []
+    while (t.year, t.month) == (now.year, now.month) and cur_purchase_count < merchant.total_purchases:
+        amount = pick_amount(merchant, past_amounts)
+        slots.append(new_slot(t, [amount], cur_purchase_count))
+        cur_purchase_count += 1
+        past_amounts.append(amount)
+
+        start_offset = next_spread_offset(merchant, t, cur_purchase_count)
+        if start_offset is None:
+            return slots, None
+        t = t + timedelta(seconds=start_offset)
+
+    return slots, int(t.timestamp())
 
+
+# Seconds from now until the next purchase in spread mode, or None if it could not be determined
+def next_spread_offset(merchant, now, cur_purchase_count):
     if cur_purchase_count < merchant.total_purchases:
         remaining_purchase_count = merchant.total_purchases - cur_purchase_count
         month_end_day = merchant.max_day if merchant.max_day else DAYS_IN_MONTH[now.month] - 1
@@ -226,127 +504,270 @@ def schedule_next_spread(merchant):
 
         if range_min <= 0:
             LOGGER.error('Fatal error, could not determine date of next month when scheduling ' + merchant.id)
-            return
+            return None
 
         range_max = range_min + merchant.spread_time_variance
 
-    start_offset = random.randint(int(range_min), int(range_max))
-    LOGGER.info('Scheduling next ' + merchant.id + ' at ' + formatted_date_of_offset(now, start_offset))
-    LOGGER.info('')
-    Timer(start_offset, spread_recursion, [merchant]).start()
-
-
-def spread_recursion(merchant):
-    web_automation_wrapper(merchant)
-    schedule_next_spread(merchant)
+    return random.randint(int(range_min), int(range_max))
 
 
 def record_transaction(merchant_id, amount):
-    now = datetime.now()
+    now = CLOCK.now()
     LOGGER.info('Recording successful ' + merchant_id + ' purchase')
 
-    if not os.path.exists(absolute_path('state')):
-        os.mkdir(absolute_path('state'))
-
-    padded_month = '0' + str(now.month) if now.month < 10 else str(now.month)
-    filename = absolute_path('state', 'debbit_' + str(now.year) + '_' + padded_month + '.txt')
-
-    STATE_WRITE_LOCK.acquire()
-
-    state = load_state(now.year, now.month)
-
-    if merchant_id not in state:
-        state[merchant_id] = {
-            'purchase_count': 0,
-            'transactions': []
-        }
-
-    cur_purchase_count = state[merchant_id]['purchase_count'] + 1
-    state[merchant_id]['purchase_count'] = cur_purchase_count
-    state[merchant_id]['transactions'].append({
+    cur_purchase_count = STATE_STORE.record(now.year, now.month, merchant_id, {
         'amount': str(amount) + ' cents',
         'human_time': now.strftime("%Y-%m-%d %I:%M%p"),
         'unix_time': int(now.timestamp())
     })
 
-    with open(filename, 'w', encoding='utf-8') as f:
-        f.write(yaml.dump(state))
-
-    STATE_WRITE_LOCK.release()
-
     LOGGER.info(str(cur_purchase_count) + ' ' + merchant_id + ' ' + plural('purchase', cur_purchase_count) + ' complete for ' + now.strftime('%B %Y'))
 
 
-def formatted_date_of_offset(now, start_offset):
-    return (now + timedelta(seconds=start_offset)).strftime("%Y-%m-%d %I:%M%p")
+# Makes one purchase attempt. A failed attempt isn't retried here, the failure is classified and the retry saved in
+# RETRY_STORE with the backoff for its class, then Result.failed is returned and the caller schedules run_plan() for
+# retry_time. Nothing waits in the meantime, the worker thread and purchase slot are free for other merchants. Gives up
+# on the merchant once the class has no retries left. burst_state is the burst the purchase belongs to, so the rest
+# of the burst is made after the retry, even after a restart.
+def web_automation_wrapper(merchant, burst_state=None):
+    utils.set_log_merchant(merchant.id, merchant.card_name)
+    retry = RETRY_STORE.get(merchant.id) or {}
+    failures = retry.get('failures', 0)
+    amount = choose_amount(merchant)
+    utils.set_log_amount(amount)
+    if failures == 0 and preflight_skips(merchant):
+        return Result.skipped
+
+    driver = checkout_webdriver(merchant)
+    error_msg = None
+    exception = None
+    failed_span = None
+    LOGGER.info('Spending ' + str(amount) + ' cents with ' + merchant.id + ' now')
+    pace = utils.Pace(merchant.pacing, CONFIG.pacing_profiles[merchant.pacing])
+    utils.set_pace(pace)
+    spans = {}
+    utils.set_spans(spans)
+    started_at = CLOCK.now()
+    start = time.time()
+    try:
+        with Coverage(record_coverage(failures)) as cov:
+            result = merchant.web_automation(driver, merchant, amount)
+    except (KeyboardInterrupt, SystemExit):
+        raise
+    except Exception as e:
+        result = Result.failed
+        error_msg = traceback.format_exc()
+        exception = e
+        failed_span = utils.failed_span(e)
+    finally:
+        utils.set_pace(None)
+        utils.set_spans(None)
+
+    elapsed = time.time() - start
+    LOGGER.info(merchant.id + ' took ' + str(round(elapsed, 1)) + 's, ' + str(round(pace.delay_secs, 1)) + 's of it deliberate delays and ' + str(round(pace.settle_secs, 1)) + 's waiting for pages to settle (pacing: ' + merchant.pacing + ')', extra={'duration': elapsed})
+    if spans:
+        LOGGER.info(merchant.id + ' steps: ' + ', '.join([name + ' ' + str(round(secs, 1)) + 's' for name, secs in spans.items()]))
+    try:
+        METRICS_STORE.record(started_at, merchant.id, result.name, elapsed, pace.delay_secs, spans)
+    except OSError:
+        LOGGER.warning('Unable to record ' + merchant.id + ' step timings: ' + traceback.format_exc())
+    LIVE_STATS.observe(merchant.id, result.name, elapsed)
+    if merchant.preflight:
+        PREFLIGHT_CACHE.invalidate(preflight_key(merchant))  # the balance may have changed, check again next time
+
+    if result == Result.failed:
+        if not error_msg:
+            error_msg = 'Result.failed'
+        failure_class = retries.classify(exception, failed_span)
+        LOGGER.error(merchant.id + ' error (' + failure_class + (' during ' + failed_span if failed_span else '') + '): ' + error_msg)
+        failures += 1
+        class_failures = retries.class_failures(retry)
+        class_failures[failure_class] = class_failures.get(failure_class, 0) + 1
+
+        record_failure(driver, merchant, error_msg, cov)
+        checkin_webdriver(driver, merchant, reuse=failure_class != 'browser_crash')  # the pool also health checks a reused session before the retry
+
+        backoff_secs = retries.backoff_secs(CONFIG.retry_backoff, failure_class, class_failures[failure_class])
+        if backoff_secs is not None:
+            burst_state = burst_state or BurstState(started_at, 1)
+            retry_time = CLOCK.time() + backoff_secs
+            RETRY_STORE.put(merchant.id, {
+                'failures': failures,
+                'class_failures': class_failures,
+                'failure_class': failure_class,
+                'retry_time': int(retry_time),
+                'human_time': datetime.fromtimestamp(retry_time).strftime("%Y-%m-%d %I:%M%p"),
+                'slot_start': int(burst_state.burst_start.timestamp()),
+                'remaining': burst_state.remaining
+            })
+            LIVE_STATS.backoff(merchant.id, retry_time)
+            LOGGER.info(str(failures) + ' ' + merchant.id + ' ' + plural('attempt', failures) + ' failed in a row, latest ' + failure_class + ', trying again in ' + str(backoff_secs) + ' seconds')
+            return result
+        else:
+            RETRY_STORE.remove(merchant.id)  # re-running debbit tries again from a fresh plan
+            exit_msg = merchant.id + ' failed ' + str(failures) + ' times in a row. NOT SCHEDULING MORE ' + merchant.id + '. Stop and re-run debbit to try again.'
+            if not CONFIG.send_failures_to_developer:
+                exit_msg += '  To help get this issue fixed, please set send_failures_to_developer to yes in config.txt or follow instructions at https://jakehilborn.github.io/debbit/#merchant-automation-failed-how-do-i-get-it-fixed'
+            LOGGER.error(exit_msg)
+            notify_failure(exit_msg)
+            LIVE_STATS.stop(merchant.id)
+            raise Exception(exit_msg)  # exits this merchant's thread, not entire program
 
+    RETRY_STORE.remove(merchant.id)  # done with this purchase, or unverified and stopping
 
-def web_automation_wrapper(merchant):
-    failures = 0
-    threshold = 5
-    while failures < threshold:
-        amount = choose_amount(merchant)
-        driver = get_webdriver(merchant)
-        error_msg = None
-        LOGGER.info('Spending ' + str(amount) + ' cents with ' + merchant.id + ' now')
-        try:
-            with Coverage() as cov:
-                result = merchant.web_automation(driver, merchant, amount)
-        except (KeyboardInterrupt, SystemExit):
-            raise
-        except Exception:
-            result = Result.failed
-            error_msg = traceback.format_exc()
+    if result == Result.unverified:
+        record_failure(driver, merchant, 'Result.unverified', cov)
+        checkin_webdriver(driver, merchant, reuse=False)
+        exit_msg = 'Unable to verify ' + merchant.id + ' purchase was successful. Just in case, NOT SCHEDULING MORE ' + merchant.id + '. Stop and re-run debbit to try again.'
+        if not CONFIG.send_failures_to_developer:
+            exit_msg += '  To help get this issue fixed, please set send_failures_to_developer to yes in config.txt or follow instructions at https://jakehilborn.github.io/debbit/#merchant-automation-failed-how-do-i-get-it-fixed'
+        LOGGER.error(exit_msg)
+        notify_failure(exit_msg)
+        LIVE_STATS.stop(merchant.id)
+        sys.exit(1)  # exits this merchant's thread, not entire program
 
-        if result == Result.failed:
-            if not error_msg:
-                error_msg = 'Result.failed'
-            LOGGER.error(merchant.id + ' error: ' + error_msg)
-            failures += 1
+    checkin_webdriver(driver, merchant)
 
-            record_failure(driver, merchant, error_msg, cov)
-            close_webdriver(driver, merchant)
+    if result == Result.success:
+        record_transaction(merchant.id, amount)
 
-            if failures < threshold:
-                LOGGER.info(str(failures) + ' of ' + str(threshold) + ' ' + merchant.id + ' attempts done, trying again in ' + str(60 * failures ** 4) + ' seconds')
-                time.sleep(60 * failures ** 4)  # try again in 1min, 16min, 1.3hr, 4.3hr, 10.4hr
-                continue
-            else:
-                exit_msg = merchant.id + ' failed ' + str(failures) + ' times in a row. NOT SCHEDULING MORE ' + merchant.id + '. Stop and re-run debbit to try again.'
-                if not CONFIG.send_failures_to_developer:
-                    exit_msg += '  To help get this issue fixed, please set send_failures_to_developer to yes in config.txt or follow instructions at https://jakehilborn.github.io/debbit/#merchant-automation-failed-how-do-i-get-it-fixed'
-                LOGGER.error(exit_msg)
-                notify_failure(exit_msg)
-                raise Exception(exit_msg)  # exits this merchant's thread, not entire program
-
-        if result == Result.unverified:
-            record_failure(driver, merchant, 'Result.unverified', cov)
-            close_webdriver(driver, merchant)
-            exit_msg = 'Unable to verify ' + merchant.id + ' purchase was successful. Just in case, NOT SCHEDULING MORE ' + merchant.id + '. Stop and re-run debbit to try again.'
-            if not CONFIG.send_failures_to_developer:
-                exit_msg += '  To help get this issue fixed, please set send_failures_to_developer to yes in config.txt or follow instructions at https://jakehilborn.github.io/debbit/#merchant-automation-failed-how-do-i-get-it-fixed'
-            LOGGER.error(exit_msg)
-            notify_failure(exit_msg)
-            sys.exit(1)  # exits this merchant's thread, not entire program
+    return result
 
-        close_webdriver(driver, merchant)
 
-        if result == Result.success:
-            record_transaction(merchant.id, amount)
+# Asks the merchant's preflight() whether web_automation() would skip the purchase anyway, e.g. because the balance is
+# zero, so Firefox doesn't have to be started just to find that out. preflight() gets an HttpSession with the saved
+# cookies and returns Result.skipped, or None to go ahead with Firefox. A logged out session, an error or anything
+# preflight() can't tell for sure means going ahead. Answers are reused for preflight: ttl_minutes until Firefox runs.
+def preflight_skips(merchant):
+    if not merchant.preflight:
+        return False
 
-        return result
+    cached, result = PREFLIGHT_CACHE.get(preflight_key(merchant), CLOCK.time())
+    if not cached:
+        start = time.time()
+        try:
+            result = merchant.preflight(HttpSession(load_cookies(merchant) or []), merchant)
+        except (KeyboardInterrupt, SystemExit):
+            raise
+        except Exception:
+            LOGGER.warning(merchant.id + ' preflight error, starting Firefox instead: ' + traceback.format_exc())
+            result = None
+        LOGGER.info(merchant.id + ' preflight took ' + str(round(time.time() - start, 1)) + 's', extra={'duration': time.time() - start})
+        PREFLIGHT_CACHE.put(preflight_key(merchant), CLOCK.time(), result)
+
+    if result == Result.skipped:
+        LOGGER.info(merchant.id + ' preflight found nothing to pay' + (' earlier' if cached else '') + ', skipping without starting Firefox')
+        return True
+    return False
+
+
+def preflight_key(merchant):
+    return merchant.name + '_' + merchant.usr
+
+
+# What the status server's /status returns
+def status(merchants):
+    now = CLOCK.now()
+    slots = PURCHASE_EXECUTOR.snapshot()
+    next_runs = next_run_times(merchants)
+
+    merchant_statuses = []
+    for merchant in merchants:
+        next_run = next_runs.get(merchant.id)
+        merchant_statuses.append({
+            'id': merchant.id,
+            'purchase_count': STATE_STORE.purchase_count(merchant.id, now.year, now.month),
+            'total_purchases': merchant.total_purchases,
+            'state': merchant_state(merchant, now, slots),
+            'next_run': datetime.fromtimestamp(next_run).strftime("%Y-%m-%d %I:%M%p") if next_run else None,
+            'next_run_unix_time': int(next_run) if next_run else None
+        })
+
+    return {
+        'version': VERSION,
+        'mode': CONFIG.mode,
+        'human_time': now.strftime("%Y-%m-%d %I:%M%p"),
+        'unix_time': int(now.timestamp()),
+        'merchants': merchant_statuses,
+        'purchase_slots': slots,
+        'browser_pool': {'open_sessions': len(WEB_DRIVER_POOL.sessions), 'launches': WEB_DRIVER_POOL.launches, 'reuses': WEB_DRIVER_POOL.reuses}
+    }
+
+
+# What the status server's /metrics returns, in Prometheus text format
+def prometheus_metrics(merchants):
+    now = CLOCK.now()
+    slots = PURCHASE_EXECUTOR.snapshot()
+    next_runs = next_run_times(merchants)
+    states = {merchant.id: merchant_state(merchant, now, slots) for merchant in merchants}
+
+    lines = prometheus_family('debbit_purchases', 'gauge', 'Successful purchases this month',
+        [({'merchant': merchant.id}, STATE_STORE.purchase_count(merchant.id, now.year, now.month)) for merchant in merchants])
+    lines += prometheus_family('debbit_total_purchases', 'gauge', 'total_purchases from config.txt',
+        [({'merchant': merchant.id}, merchant.total_purchases) for merchant in merchants])
+    lines += prometheus_family('debbit_merchant_state', 'gauge', '1 for what the merchant is doing now, 0 for the other states',
+        [({'merchant': merchant.id, 'state': state}, int(states[merchant.id] == state)) for merchant in merchants for state in MERCHANT_STATES])
+    lines += prometheus_family('debbit_next_run_timestamp_seconds', 'gauge', 'Unix time the merchant is next scheduled to run',
+        [({'merchant': merchant.id}, int(next_runs[merchant.id])) for merchant in merchants if merchant.id in next_runs])
+    lines += LIVE_STATS.prometheus()
+    lines += prometheus_family('debbit_browser_launches_total', 'counter', 'Firefox launches since debbit started', [({}, WEB_DRIVER_POOL.launches)])
+    lines += prometheus_family('debbit_browser_reuses_total', 'counter', 'Purchases that reused an open Firefox since debbit started', [({}, WEB_DRIVER_POOL.reuses)])
+    lines += prometheus_family('debbit_browser_sessions', 'gauge', 'Open Firefox sessions, idle or in use', [({}, len(WEB_DRIVER_POOL.sessions))])
+    lines += prometheus_family('debbit_purchase_slot_wait_seconds_total', 'counter', 'Seconds purchases waited for a free purchase slot (concurrency limits)', [({}, slots['wait_secs'])])
+    lines += prometheus_family('debbit_purchase_slot_acquisitions_total', 'counter', 'Purchase slots handed out since debbit started', [({}, slots['acquisitions'])])
+    return lines
+
+
+MERCHANT_STATES = ['idle', 'waiting', 'running', 'retry_backoff', 'stopped']
+
+
+# One of MERCHANT_STATES. waiting is waiting for a free purchase slot, retry_backoff is waiting to retry a failure.
+def merchant_state(merchant, now, slots):
+    if LIVE_STATS.is_stopped(merchant.id):
+        return 'stopped'
+    if (LIVE_STATS.retry_time(merchant.id) or 0) > now.timestamp():
+        return 'retry_backoff'
+    if merchant.id in slots['running']:
+        return 'running'
+    if merchant.id in slots['waiting']:
+        return 'waiting'
+    return 'idle'
+
+
+# {merchant id: unix time} of each merchant's next scheduled run_plan() or burst_purchase(), or its retry
+def next_run_times(merchants):
+    merchant_ids = {merchant: merchant.id for merchant in merchants}
+    next_runs = {}
+    for due, job, args in SCHEDULER.jobs():
+        if args and args[0] in merchant_ids and merchant_ids[args[0]] not in next_runs:
+            next_runs[merchant_ids[args[0]]] = due
+
+    for merchant in merchants:
+        retry_time = LIVE_STATS.retry_time(merchant.id)
+        if retry_time:
+            next_runs[merchant.id] = retry_time
+    return next_runs
+
+
+# Whether to record which merchant lines run during this attempt. Only failure reports use it.
+def record_coverage(failures):
+    if CONFIG.coverage_policy == 'always':
+        return True
+    if CONFIG.coverage_policy == 'on_retry':
+        return failures > 0
+    if CONFIG.coverage_policy == 'sampled':
+        return random.uniform(0, 100) < CONFIG.coverage_sample_percent
+    return False
 
 
 def choose_amount(merchant):
-    now = datetime.now()
-    state = load_state(now.year, now.month)
+    now = CLOCK.now()
+    return pick_amount(merchant, STATE_STORE.last_amounts(merchant.id, now.year, now.month))
 
-    if merchant.id not in state:  # first purchase, choose any amount in config.txt range
-        return random.randint(merchant.amount_min, merchant.amount_max)
 
-    past_amounts = []
-    for transaction in state[merchant.id]['transactions']:
-        past_amounts.append(int(transaction['amount'][:-6]))  # '50 cents' -> 50
+def pick_amount(merchant, past_amounts):
+    if not past_amounts:  # first purchase, choose any amount in config.txt range
+        return random.randint(merchant.amount_min, merchant.amount_max)
 
     # The amounts we've spent this month are stored in past_amounts. Generate the range of possible values between
     # amount_min and amount_max. Pick a random value in that range, excluding any values in past_amounts. If this
@@ -360,39 +781,88 @@ def choose_amount(merchant):
             return random.choice(remaining_amounts)
 
 
+# Grabs the screenshot and DOM from Firefox, the only part of recording a failure that needs the browser, and leaves
+# writing the failure files, the coverage report and the failure email to FAILURE_WRITER so the browser can be
+# checked in right away
 def record_failure(driver, merchant, error_msg, cov):
-    if not os.path.exists(absolute_path('failures')):
-        os.mkdir(absolute_path('failures'))
-
-    filename_prefix = datetime.now().strftime('%Y-%m-%d_%H-%M-%S-%f') + '_' + merchant.name
-
     info_and_error = VERSION + ' ' + platform.system() + ' ' + error_msg  # TODO add md5 hash of merchant file to check if user modified it
-    with open(absolute_path('failures', filename_prefix + '.txt'), 'w', encoding='utf-8') as f:
-        f.write(info_and_error)
+    failure = FailureArtifacts(datetime.now().strftime('%Y-%m-%d_%H-%M-%S-%f') + '_' + merchant.name, merchant, info_and_error, cov)
 
     try:
-        driver.save_screenshot(absolute_path('failures', filename_prefix + '.png'))
+        failure.screenshot = base64.b64decode(downscale_screenshot(driver, driver.get_screenshot_as_base64()))
+        failure.dom = driver.execute_script("return document.documentElement.outerHTML")
+    except (KeyboardInterrupt, SystemExit):
+        raise
+    except Exception:
+        LOGGER.error('record_failure DOM error: ' + traceback.format_exc())
+
+    FAILURE_WRITER.submit(failure, len(failure.screenshot or b'') + len(failure.dom or ''))
 
-        dom = driver.execute_script("return document.documentElement.outerHTML")
-        dom = scrub_sensitive_data(dom, merchant)
 
-        with open(absolute_path('failures', filename_prefix + '.html'), 'w', encoding='utf-8') as f:
-            f.write(dom)
+# Scales a screenshot down to failures: screenshot_max_width pixels wide using a canvas in the page, so debbit doesn't
+# need an imaging library. Returns the screenshot unchanged if the page doesn't allow it, e.g. a content security policy
+# that blocks data: images.
+def downscale_screenshot(driver, png_base64):
+    if not CONFIG.failure_screenshot_max_width:
+        return png_base64
+
+    try:
+        smaller_png_base64 = driver.execute_async_script("""
+            var png = arguments[0];
+            var maxWidth = arguments[1];
+            var callback = arguments[arguments.length - 1];
+            var image = new Image();
+            image.onload = function() {
+                try {
+                    var scale = Math.min(1, maxWidth / image.width);
+                    var canvas = document.createElement('canvas');
+                    canvas.width = Math.round(image.width * scale);
+                    canvas.height = Math.round(image.height * scale);
+                    canvas.getContext('2d').drawImage(image, 0, 0, canvas.width, canvas.height);
+                    callback(canvas.toDataURL('image/png').split(',')[1]);
+                } catch (e) {
+                    callback(null);
+                }
+            };
+            image.onerror = function() { callback(null); };
+            image.src = 'data:image/png;base64,' + png;
+        """, png_base64, CONFIG.failure_screenshot_max_width)
     except (KeyboardInterrupt, SystemExit):
         raise
     except Exception:
-        LOGGER.error('record_failure DOM error: ' + traceback.format_exc())
+        smaller_png_base64 = None
+
+    return smaller_png_base64 or png_base64
+
+
+# Runs on FAILURE_WRITER's thread. Adds the failure's files to FAILURE_STORE, which compresses them, stores files it
+# already has only once, and removes old failures.
+def write_failure(failure):
+    files = {failure.filename_prefix + '.txt': failure.info_and_error.encode('utf-8')}  # names use / as the separator
+
+    if failure.screenshot:
+        files[failure.filename_prefix + '.png'] = failure.screenshot
+
+    if failure.dom is not None:
+        files[failure.filename_prefix + '.html'] = scrub_sensitive_data(failure.dom, failure.merchant).encode('utf-8')
 
     try:
-        if cov:  # cov is None when a debugger is attached
-            cov.html_report(directory=absolute_path('failures', filename_prefix + '_' + 'coverage'), include='*/merchants/*')
+        if failure.cov:  # cov is None when coverage wasn't recorded for this attempt or a debugger is attached
+            with tempfile.TemporaryDirectory() as coverage_dir:
+                failure.cov.html_report(directory=coverage_dir, include='*/merchants/*')
+                for root, dirs, coverage_files in os.walk(coverage_dir):
+                    for file in coverage_files:
+                        with open(os.path.join(root, file), 'rb') as f:
+                            files[failure.filename_prefix + '_coverage/' + os.path.relpath(os.path.join(root, file), coverage_dir).replace(os.sep, '/')] = f.read()
     except (KeyboardInterrupt, SystemExit):
         raise
     except Exception:
         LOGGER.error('record_failure coverage error: ' + traceback.format_exc())
 
+    FAILURE_STORE.add(failure.filename_prefix, failure.merchant.name, files)
+
     if CONFIG.send_failures_to_developer:
-        report_failure(filename_prefix, info_and_error)  # TODO put the retry number in here. If first failure, nbd, if recurring failures then it's a bigger problem.
+        report_failure(failure.filename_prefix, failure.info_and_error)  # TODO put the retry number in here. If first failure, nbd, if recurring failures then it's a bigger problem.
 
 
 def scrub_sensitive_data(data, merchant):
@@ -406,18 +876,20 @@ def scrub_sensitive_data(data, merchant):
         .replace(merchant.card[-4:], '***card***')  # last 4 digits of card
 
 
+# Zips the failure's files from FAILURE_STORE and emails them. The zip is built in a temporary file that only moves from
+# memory to disk once it passes 1MB, and files that could push it past failures: report_max_mb are left out and listed
+# in the email instead.
 def report_failure(failure_report_filename_prefix, info_and_error):
-    mem_zip = BytesIO()
-    with zipfile.ZipFile(mem_zip, mode='w', compression=zipfile.ZIP_DEFLATED) as z:
-        for root, dirs, files in os.walk(absolute_path('failures')):
-            for file in files:
-                if file.startswith(failure_report_filename_prefix):
-                    z.write(os.path.join(root, file), file)
-                elif failure_report_filename_prefix in root:  # include all files in subdirs that comprise of this failure report
-                    z.write(os.path.join(root, file), os.path.join(root.split(os.sep + 'failures' + os.sep)[1], file))
+    with tempfile.SpooledTemporaryFile(max_size=1024 * 1024) as spooled_zip:
+        left_out = FAILURE_STORE.write_zip(failure_report_filename_prefix, spooled_zip, int(CONFIG.failure_report_max_mb * 1024 * 1024))
+        spooled_zip.seek(0)
+        zip_bytes = spooled_zip.read()
+
+    if left_out:
+        info_and_error += '\n\nLeft out of the zip to keep it under ' + str(CONFIG.failure_report_max_mb) + 'MB: ' + ', '.join(left_out)
 
     # sendgrid is blocking delivery of many file types. Sending the zip as a "pdf" seems to work though.
-    send_email('failure report for developer', 'debbit.failure.notify@gmail.com', failure_report_filename_prefix, info_and_error, 'plain', 'error_report.pdf', 'application/pdf', mem_zip.getvalue())
+    send_email('failure report for developer', 'debbit.failure.notify@gmail.com', failure_report_filename_prefix, info_and_error, 'plain', 'error_report.pdf', 'application/pdf', zip_bytes)
 
 
 def notify_failure(exit_msg):
@@ -440,10 +912,10 @@ def notify_failure(exit_msg):
             '<strong>This debbit failure was only sent to you.</strong> To help get this issue fixed, please consider '
             'changing send_<i>failures_to_developer</i> to <i>yes</i> in the config.txt file. This will automatically send '
             'future error reports to the debbit developer so the issue can be investigated and fixed. You can also share '
-            'this failure manually via email. In the failures folder there are files with timestamps for names. Each '
-            'timestamp has 3 files ending in .txt, .png, .html, and a folder ending in _coverage. Email these files to '
-            'jakehilborn@gmail.com or open an "Issue" at https://github.com/jakehilborn/debbit/issues and attach them '
-            'there. You can send one error or the whole failures folder, the more errors to inspect the more helpful.')\
+            'this failure manually via email. Run <i>debbit failures export</i> to save each recorded failure as a zip '
+            'file in the failures/exports folder. Email these zip files to jakehilborn@gmail.com or open an "Issue" at '
+            'https://github.com/jakehilborn/debbit/issues and attach them there. You can send one error or all of them, '
+            'the more errors to inspect the more helpful.')\
             .format(exit_msg=exit_msg)
 
     send_email('failure notification', to_email, subject, body, 'html')
@@ -503,7 +975,6 @@ def get_webdriver(merchant):
         LOGGER.error(absolute_path('program_files', geckodriver_file) + ' does not exist. Download the latest version of geckodriver from https://github.com/mozilla/geckodriver/releases and extract it. Copy ' + geckodriver_file + ' to ' + absolute_path('program_files'))
         sys.exit(1)
 
-    WEB_DRIVER_LOCK.acquire()  # Only execute one purchase at a time so the console log messages don't inter mix
     options = Options()
     options.headless = CONFIG.hide_web_browser
     profile = webdriver.FirefoxProfile(absolute_path('program_files', 'selenium-cookies-extension', 'firefox-profile'))
@@ -512,6 +983,30 @@ def get_webdriver(merchant):
     profile.set_preference("dom.webdriver.enabled", False)
     profile.set_preference('useAutomationExtension', False)
 
+    for name, value in resource_blocking.preferences(merchant.blocked_resources, merchant.resource_allowlist, merchant.blocked_hosts).items():
+        profile.set_preference(name, value)
+
+    # The sqlite cookie transport runs Firefox directly in the profile's temporary copy, instead of letting geckodriver
+    # copy it again, so cookies.sqlite can be written before Firefox starts and read after it quits. A persistent profile
+    # is used the same way but is kept after Firefox quits, its cookies are only seeded from the cookies file once.
+    profile_dir = PROFILE_STORE.checkout(merchant) if CONFIG.persistent_profiles else None
+    persistent = profile_dir is not None
+    if persistent:
+        prepare_persistent_profile(profile, profile_dir, merchant)
+    elif CONFIG.cookie_transport == 'sqlite':
+        profile.update_preferences()
+        profile_dir = profile.path
+        if merchant.use_cookies:
+            write_cookies_to_profile(profile_dir, merchant)
+
+    if 'images' in merchant.blocked_resources and merchant.resource_allowlist:
+        resource_blocking.write_image_permissions(profile_dir or profile.path, merchant.resource_allowlist)
+
+    if profile_dir:
+        options.add_argument('-profile')
+        options.add_argument(profile_dir)
+        profile = None
+
     try:
         driver = webdriver.Firefox(options=options,
                                  service_log_path=os.devnull,
@@ -521,21 +1016,31 @@ def get_webdriver(merchant):
     except SessionNotCreatedException as e:
         LOGGER.error(str(e) + '\n')
         LOGGER.error('There was a problem starting Firefox. Make sure the latest version of Firefox is installed. If installing/updating Firefox does not fix the issue, try downloading a newer or older version of geckodriver from https://github.com/mozilla/geckodriver/releases and extracting it. Copy ' + geckodriver_file + ' to ' + absolute_path('program_files'))
-        WEB_DRIVER_LOCK.release()
         sys.exit(1)
+    except BaseException:
+        if persistent:
+            PROFILE_STORE.checkin(profile_dir)
+        elif profile_dir:
+            shutil.rmtree(profile_dir, ignore_errors=True)
+        raise
+
+    driver.debbit_profile_dir = profile_dir  # None unless the profile is ours to read after quitting
+    driver.debbit_profile_persistent = persistent  # otherwise profile_dir is deleted after quitting
 
     # Randomize viewport size to help avoid Selenium detection
     driver.set_window_size(random.randint(1050, 1350), random.randint(700, 1000))
 
-    if merchant.use_cookies:
+    if merchant.use_cookies and not profile_dir:
         restore_cookies(driver, merchant)
 
     return driver
 
 
 def close_webdriver(driver, merchant):
+    profile_dir = getattr(driver, 'debbit_profile_dir', None)
+
     try:
-        if merchant.use_cookies:
+        if merchant.use_cookies and not profile_dir:
             persist_cookies(driver, merchant)
     except (KeyboardInterrupt, SystemExit):
         raise
@@ -549,35 +1054,73 @@ def close_webdriver(driver, merchant):
     except Exception:
         pass
 
+    if profile_dir:
+        try:
+            if merchant.use_cookies:
+                read_cookies_from_profile(profile_dir, merchant)  # also for persistent profiles, in case the profile is removed
+        except (KeyboardInterrupt, SystemExit):
+            raise
+        except Exception as e:
+            LOGGER.error(str(e) + ' - proceeding without persisting cookies')
+        finally:
+            if getattr(driver, 'debbit_profile_persistent', False):
+                PROFILE_STORE.checkin(profile_dir)
+            else:
+                shutil.rmtree(profile_dir, ignore_errors=True)
+
+
+# Refreshes a persistent profile's extension and user.js from the freshly copied extension profile so changes to either
+# in a debbit update apply, and seeds its cookies from the cookies file if it has none yet
+def prepare_persistent_profile(profile, profile_dir, merchant):
     try:
-        WEB_DRIVER_LOCK.release()
-    except (KeyboardInterrupt, SystemExit):
+        profile.update_preferences()
+        shutil.copyfile(os.path.join(profile.path, 'user.js'), os.path.join(profile_dir, 'user.js'))
+        shutil.rmtree(os.path.join(profile_dir, 'extensions'), ignore_errors=True)
+        shutil.copytree(os.path.join(profile.path, 'extensions'), os.path.join(profile_dir, 'extensions'))
+    finally:
+        shutil.rmtree(profile.path, ignore_errors=True)
+
+    if not merchant.use_cookies:
+        for file in ['cookies.sqlite', 'cookies.sqlite-wal', 'cookies.sqlite-shm']:
+            if os.path.exists(os.path.join(profile_dir, file)):
+                os.remove(os.path.join(profile_dir, file))
+    elif not os.path.exists(os.path.join(profile_dir, 'cookies.sqlite')):
+        write_cookies_to_profile(profile_dir, merchant)
+
+
+# Waits for a free purchase slot and checks out a warm Firefox session from WEB_DRIVER_POOL, get_webdriver() is only
+# called if no session is open for this merchant and usr. Each checkout_webdriver() must be paired with a
+# checkin_webdriver().
+def checkout_webdriver(merchant):
+    PURCHASE_EXECUTOR.acquire(merchant)
+    try:
+        return WEB_DRIVER_POOL.checkout(merchant)
+    except BaseException:
+        PURCHASE_EXECUTOR.release(merchant)
         raise
-    except Exception:
-        pass
+
+
+# reuse=False closes the browser instead of keeping it open for the next purchase
+def checkin_webdriver(driver, merchant, reuse=True):
+    try:
+        WEB_DRIVER_POOL.checkin(driver, merchant, reuse)
+    finally:
+        PURCHASE_EXECUTOR.release(merchant)
 
 
 def restore_cookies(driver, merchant):
     try:
-        if os.path.exists(absolute_path('program_files', 'cookies', merchant.name + '_' + merchant.usr)):
-            with open(absolute_path('program_files', 'cookies', merchant.name + '_' + merchant.usr), 'r', encoding='utf-8') as f:
-                cookies = f.read()
-        elif os.path.exists(absolute_path('program_files', 'cookies', merchant.id)):  # legacy v2.0 - v2.0.2 cookie format
-            with open(absolute_path('program_files', 'cookies', merchant.id), 'r', encoding='utf-8') as f:
-                cookies = f.read()
-        else:
+        cookies = load_cookies(merchant)
+        if cookies is None:
             return
 
         driver.get('file://' + absolute_path('program_files', 'selenium-cookies-extension', 'restore-cookies.html'))
-        driver.execute_script("document.getElementById('content').textContent = '" + cookies + "'")
-        driver.execute_script("document.getElementById('status').textContent = 'dom-ready'")
-
-        seconds = 30
-        for i in range(seconds * 10):
-            if driver.find_element_by_id('status').text == 'done':
-                return
-            time.sleep(0.1)
-        error_msg = 'Unable to restore cookies after ' + str(seconds) + ' seconds'
+        driver.execute_script("document.getElementById('content').textContent = arguments[0]; document.getElementById('status').textContent = 'dom-ready'", base64.b64encode(json.dumps(cookies).encode('utf-8')).decode('ascii'))
+
+        utils.wait_for_js(driver, "return document.getElementById('status').textContent == 'done';", 30)
+        return
+    except TimeoutException:
+        error_msg = 'Unable to restore cookies after 30 seconds'
     except (KeyboardInterrupt, SystemExit):
         raise
     except Exception as e:
@@ -589,22 +1132,61 @@ def restore_cookies(driver, merchant):
 def persist_cookies(driver, merchant):
     driver.get('file://' + absolute_path('program_files', 'selenium-cookies-extension', 'persist-cookies.html'))
 
-    seconds = 30
-    for i in range(seconds * 10):
-        if driver.find_element_by_id('status').text == 'dom-ready':
-            break
-        if i == seconds * 10 - 1:
-            LOGGER.error('Unable to restore cookies after ' + str(seconds) + ' seconds - proceeding without restoring cookies')
-            return
-        time.sleep(0.1)
+    try:
+        cookies = utils.wait_for_js(driver, "return document.getElementById('status').textContent == 'dom-ready' && document.getElementById('content').textContent;", 30)
+    except TimeoutException:
+        LOGGER.error('Unable to persist cookies after 30 seconds - proceeding without persisting cookies')
+        return
+
+    save_cookies(merchant, json.loads(base64.b64decode(cookies)))
+
 
-    cookies = driver.find_element_by_id('content').text
+# cookies: transport: sqlite counterpart of restore_cookies(), writes the saved cookies into the profile before Firefox
+# starts so no page has to be loaded
+def write_cookies_to_profile(profile_dir, merchant):
+    try:
+        cookies = load_cookies(merchant)
+        if cookies is not None:
+            cookie_db.write_cookies(profile_dir, cookies)
+    except (KeyboardInterrupt, SystemExit):
+        raise
+    except Exception as e:
+        LOGGER.error(str(e) + ' - proceeding without restoring cookies')
+
+
+# cookies: transport: sqlite counterpart of persist_cookies(), reads the cookies Firefox saved to the profile when it quit
+def read_cookies_from_profile(profile_dir, merchant):
+    cookies = cookie_db.read_cookies(profile_dir)
+    if cookies is None:
+        LOGGER.error('Firefox did not save any cookies - proceeding without persisting cookies')
+        return
 
+    save_cookies(merchant, cookies)
+
+
+# Returns the merchant's saved cookies, the cookie dicts of the selenium-cookies-extension, or None. Cookie files are
+# base64 encoded JSON. Expired cookies and cookies outside merchant.cookie_domains are dropped, which also shrinks files
+# saved before the merchant declared its domains.
+def load_cookies(merchant):
+    if os.path.exists(absolute_path('program_files', 'cookies', merchant.name + '_' + merchant.usr)):
+        with open(absolute_path('program_files', 'cookies', merchant.name + '_' + merchant.usr), 'r', encoding='utf-8') as f:
+            cookies = f.read()
+    elif os.path.exists(absolute_path('program_files', 'cookies', merchant.id)):  # legacy v2.0 - v2.0.2 cookie format
+        with open(absolute_path('program_files', 'cookies', merchant.id), 'r', encoding='utf-8') as f:
+            cookies = f.read()
+    else:
+        return None
+
+    return cookie_db.filter_cookies(json.loads(base64.b64decode(cookies)), merchant.cookie_domains, time.time())
+
+
+def save_cookies(merchant, cookies):
     if not os.path.exists(absolute_path('program_files', 'cookies')):
         os.mkdir(absolute_path('program_files', 'cookies'))
 
+    cookies = cookie_db.filter_cookies(cookies, merchant.cookie_domains, time.time())
     with open(absolute_path('program_files', 'cookies', merchant.name + '_' + merchant.usr), 'w', encoding='utf-8') as f:
-        f.write(cookies)
+        f.write(base64.b64encode(json.dumps(cookies).encode('utf-8')).decode('ascii'))
 
     if os.path.exists(absolute_path('program_files', 'cookies', merchant.id)):  # legacy v2.0 - v2.0.2 cookie format
         os.remove(absolute_path('program_files', 'cookies', merchant.id))
@@ -615,6 +1197,16 @@ def absolute_path(*rel_paths):  # works cross platform when running source scrip
     return os.path.join(os.path.dirname(script_path), *rel_paths)
 
 
+# Rotated and gzipped as set in config, or with the defaults before config.txt is read
+def log_file_handler(filename, formatter, config=None):
+    if config:
+        handler = RotatingGzipFileHandler(absolute_path('program_files', filename), config.log_max_mb * 1024 * 1024, config.log_rotate_days * 86400, config.log_backups)
+    else:
+        handler = RotatingGzipFileHandler(absolute_path('program_files', filename))
+    handler.setFormatter(formatter)
+    return handler
+
+
 def plural(word, count):
     if count == 1:
         return word
@@ -662,29 +1254,65 @@ def pyinstaller_runtime_patches():
     __import__('coverage.html', fromlist=["*"]).STATIC_PATH = [absolute_path('program_files', 'coverage-htmlfiles')]
 
 
+# Returns an object with html_report() for record_failure(), or None if coverage isn't being recorded. Python 3.12+ uses
+# the lightweight LineRecorder, older versions trace the merchant automation with coverage.py.
 class Coverage:
-    def __init__(self):
-        if sys.gettrace():
+    def __init__(self, enabled=True):
+        self.cov = None
+        self.recorder = None
+
+        if not enabled:
+            return
+        if LineRecorder.supported():  # sys.monitoring doesn't get in a debugger's way
+            self.recorder = LineRecorder(is_merchant_file)
+        elif sys.gettrace():
             LOGGER.warning('Debugger detected. Not attaching coverage module to merchant automation since it disables the debugger.')
-            self.cov = None
         else:
             self.cov = coverage.Coverage(data_file=None, branch=True)
 
     def __enter__(self):
+        if self.recorder:
+            return self.recorder.__enter__()
         if self.cov:
             self.cov.start()
         return self.cov
 
     def __exit__(self, type, value, traceback):
+        if self.recorder:
+            self.recorder.__exit__(type, value, traceback)
         if self.cov:
             self.cov.stop()
 
 
+def is_merchant_file(filename):
+    return os.sep + 'merchants' + os.sep in filename
+
+
+# Progress through one planned burst, carried from one burst_purchase() to the next
+class BurstState:
+    def __init__(self, burst_start, remaining):
+        self.burst_start = burst_start
+        self.remaining = remaining  # purchases left in the burst
+
+
+# What record_failure() grabbed from Firefox, handed to write_failure() on FAILURE_WRITER's thread
+class FailureArtifacts:
+    def __init__(self, filename_prefix, merchant, info_and_error, cov):
+        self.filename_prefix = filename_prefix
+        self.merchant = merchant
+        self.info_and_error = info_and_error
+        self.cov = cov
+        self.screenshot = None  # png bytes
+        self.dom = None  # outerHTML, scrubbed by write_failure()
+
+
 class Merchant:
-    def __init__(self, card, name, web_automation, merchant_config):
+    def __init__(self, card, name, web_automation, merchant_config, cookie_domains=None, resource_allowlist=None, preflight=None, required_resources=None):
         self.id = str(card) + '_' + name
+        self.card_name = str(card)
         self.name = name
         self.web_automation = web_automation
+        self.cookie_domains = cookie_domains  # None keeps cookies from every domain
 
         self.total_purchases = merchant_config['total_purchases']
         self.amount_min = merchant_config['amount_min']
@@ -718,6 +1346,24 @@ class Merchant:
         self.burst_poll_gap = merchant_config.get('advanced', {}).get('burst', {}).get('poll_gap', 300)  # 5 minutes
         self.spread_min_gap = merchant_config.get('advanced', {}).get('spread', {}).get('min_gap', 14400)  # 4 hours
         self.spread_time_variance = merchant_config.get('advanced', {}).get('spread', {}).get('time_variance', 14400)  # 4 hours
+        self.pacing = merchant_config.get('advanced', {}).get('pacing', CONFIG.pacing_profile)  # how long merchant code pauses between actions
+
+        resource_blocking_config = merchant_config.get('advanced', {}).get('resource_blocking') or {}
+        default_blocked = [category for category in CONFIG.blocked_resources if category not in (required_resources or [])]  # a block list in the merchant's config overrides
+        self.blocked_resources = resource_blocking_config.get('block', default_blocked) if resource_blocking_config.get('enabled', CONFIG.resource_blocking) else []
+        self.resource_allowlist = (resource_allowlist or []) + (resource_blocking_config.get('allow') or [])  # hosts that are never blocked
+        self.blocked_hosts = resource_blocking_config.get('block_hosts') or []  # blocked with the trackers
+
+        # preflight() needs the saved login, without cookies it would always find the session logged out
+        self.preflight = preflight if merchant_config.get('advanced', {}).get('preflight', CONFIG.preflight_enabled) and self.use_cookies else None
+
+        if any([category not in resource_blocking.CATEGORIES for category in self.blocked_resources]):
+            LOGGER.error(self.id + ' resource_blocking "block" can only list ' + ', '.join(resource_blocking.CATEGORIES))
+            sys.exit(1)
+
+        if self.pacing not in CONFIG.pacing_profiles:
+            LOGGER.error(self.id + ' "pacing" must be one of ' + ', '.join(CONFIG.pacing_profiles))
+            sys.exit(1)
 
 
 class Config:
@@ -736,30 +1382,90 @@ class Config:
 
         self.send_failures_to_developer = config.get('send_failures_to_developer')
 
+        if config.get('state_backend', 'yaml') not in ['yaml', 'sqlite']:
+            LOGGER.error('Set config.txt "state_backend" to yaml or sqlite')
+            sys.exit(1)
+        self.state_backend = config.get('state_backend', 'yaml')
+
+        # Optional advanced config or default values.
+        self.max_concurrent_purchases = (config.get('concurrency') or {}).get('max_purchases', 1)  # 1 runs one purchase at a time
+        self.merchant_concurrency = (config.get('concurrency') or {}).get('merchants') or {}  # e.g. {'amazon_gift_card_reload': 1}, unlisted merchants default to 1
+        self.browser_pool_max_sessions = (config.get('browser_pool') or {}).get('max_sessions', max(2, self.max_concurrent_purchases))  # 0 closes Firefox after every purchase
+        self.browser_pool_idle_timeout = (config.get('browser_pool') or {}).get('idle_timeout', 300)  # 5 minutes
+        self.browser_pool_max_uses = (config.get('browser_pool') or {}).get('max_uses', 10)
+
+        self.coverage_policy = (config.get('coverage') or {}).get('policy', 'always')
+        if self.coverage_policy not in ['always', 'never', 'on_retry', 'sampled']:
+            LOGGER.error('Set config.txt coverage "policy" to always, never, on_retry or sampled')
+            sys.exit(1)
+        self.coverage_sample_percent = (config.get('coverage') or {}).get('sample_percent', 10)
+        self.failure_report_max_mb = (config.get('failures') or {}).get('report_max_mb', 10)  # zipped failure report emailed to the developer
+        self.failure_max_age_days = (config.get('failures') or {}).get('max_age_days', 90)
+        self.failure_max_total_mb = (config.get('failures') or {}).get('max_total_mb', 200)
+        self.failure_max_per_merchant = (config.get('failures') or {}).get('max_per_merchant', 20)
+        self.failure_screenshot_max_width = (config.get('failures') or {}).get('screenshot_max_width', 800)
+
+        self.persistent_profiles = (config.get('profiles') or {}).get('persistent', False)  # keep each merchant and usr's Firefox profile between launches
+        self.profile_max_mb = (config.get('profiles') or {}).get('max_mb', 300)
+        self.profile_max_age_days = (config.get('profiles') or {}).get('max_age_days', 60)
+
+        self.pacing_profiles = dict(utils.PACING_PROFILES)
+        for name, profile in ((config.get('pacing') or {}).get('profiles') or {}).items():  # unset intents come from the existing profile or human
+            self.pacing_profiles[name] = dict(self.pacing_profiles.get(name, utils.PACING_PROFILES['human']), **profile)
+        self.pacing_profile = (config.get('pacing') or {}).get('profile', 'human')  # merchants can override with advanced: pacing
+        if self.pacing_profile not in self.pacing_profiles:
+            LOGGER.error('Set config.txt pacing "profile" to one of ' + ', '.join(self.pacing_profiles))
+            sys.exit(1)
+
+        self.log_json = (config.get('logging') or {}).get('json', False)  # also write program_files/debbit_log.jsonl
+        self.log_max_mb = (config.get('logging') or {}).get('max_mb', 10)
+        self.log_rotate_days = (config.get('logging') or {}).get('rotate_days', 7)
+        self.log_backups = (config.get('logging') or {}).get('backups', 10)  # gzipped old log files kept
+
+        self.resource_blocking = (config.get('resource_blocking') or {}).get('enabled', False)
+        self.blocked_resources = (config.get('resource_blocking') or {}).get('block', resource_blocking.CATEGORIES)
+        if any([category not in resource_blocking.CATEGORIES for category in self.blocked_resources]):
+            LOGGER.error('config.txt resource_blocking "block" can only list ' + ', '.join(resource_blocking.CATEGORIES))
+            sys.exit(1)
+
+        self.preflight_enabled = (config.get('preflight') or {}).get('enabled', False)
+        self.preflight_ttl_minutes = (config.get('preflight') or {}).get('ttl_minutes', 60)
+
+        self.retry_backoff = dict(retries.BACKOFF, **(config.get('retries') or {}))  # failure class -> seconds before each retry
+        for failure_class, delays in self.retry_backoff.items():
+            if failure_class not in retries.FAILURE_CLASSES or not isinstance(delays, list) or not all([isinstance(delay, (int, float)) and delay >= 0 for delay in delays]):
+                LOGGER.error('config.txt "retries" can only list ' + ', '.join(retries.FAILURE_CLASSES) + ', each a list of seconds to wait before each retry')
+                sys.exit(1)
+
+        self.status_server_enabled = (config.get('status_server') or {}).get('enabled', False)
+        self.status_server_port = (config.get('status_server') or {}).get('port', 8787)  # only listens on 127.0.0.1
+
+        self.cookie_transport = (config.get('cookies') or {}).get('transport', 'extension')  # sqlite is faster but loses session cookies
+        if self.cookie_transport not in ['sqlite', 'extension']:
+            LOGGER.error('Set config.txt cookies "transport" to sqlite or extension')
+            sys.exit(1)
+
         self.cards = config  # The remainder of the config is cards so we can copy the whole dict. Need to remove global config that is stored at the same level though.
-        for key in ['mode', 'hide_web_browser', 'notify_failure', 'send_failures_to_developer']:
+        for key in ['mode', 'hide_web_browser', 'notify_failure', 'send_failures_to_developer', 'state_backend', 'browser_pool', 'concurrency', 'coverage', 'failures', 'cookies', 'profiles', 'pacing', 'status_server', 'logging', 'resource_blocking', 'preflight', 'retries']:
             self.cards.pop(key, None)
 
 
 if __name__ == '__main__':
-    LOGGER = logging.getLogger('debbit')
     LOGGER.setLevel(logging.INFO)
-    log_format = '%(levelname)s: %(asctime)s %(message)s'
+    log_format = '%(levelname)s: %(asctime)s %(merchant_tag)s%(message)s'
 
     stdout_handler = logging.StreamHandler(sys.stdout)
     stdout_handler.setFormatter(logging.Formatter(log_format))
-    LOGGER.addHandler(stdout_handler)
 
-    file_handler = logging.FileHandler(absolute_path('program_files', 'debbit_log.log'))
-    file_handler.setFormatter(logging.Formatter(log_format))
-    LOGGER.addHandler(file_handler)
+    # Log lines are written by a background thread, see LogPipeline. The log file gets its size and rotation settings
+    # once config.txt is read.
+    LOG_PIPELINE = LogPipeline(LOGGER, utils.MerchantLogFilter())
+    LOG_PIPELINE.set_handlers(stdout_handler, log_file_handler('debbit_log.log', logging.Formatter(log_format)))
+    atexit.register(LOG_PIPELINE.stop)  # write out queued log lines before exiting
 
     pyinstaller_runtime_patches()
 
     # configure global constants
-    STATE_WRITE_LOCK = Lock()
-    WEB_DRIVER_LOCK = Lock()
-    DAYS_IN_MONTH = {1: 31, 2: 28, 3: 31, 4: 30, 5: 31, 6: 30, 7: 31, 8: 31, 9: 30, 10: 31, 11: 30, 12: 31}
     VERSION = 'v2.1.5-dev'
     VERSION_INT = 10
 
@@ -793,5 +1499,47 @@ if __name__ == '__main__':
             sys.exit(1)
 
     CONFIG = Config(config_dict)
+    CLOCK = SystemClock()
 
-    main()
+    log_handlers = [stdout_handler, log_file_handler('debbit_log.log', logging.Formatter(log_format), CONFIG)]
+    if CONFIG.log_json:
+        log_handlers.append(log_file_handler('debbit_log.jsonl', JsonLinesFormatter(), CONFIG))
+    LOG_PIPELINE.set_handlers(*log_handlers)
+
+    if CONFIG.state_backend == 'sqlite':
+        STATE_STORE = SqliteStateStore(absolute_path('state'))
+    else:
+        STATE_STORE = StateStore(absolute_path('state'))
+    PLAN_STORE = PlanStore(absolute_path('state', 'plans'))
+    RETRY_STORE = RetryStore(absolute_path('state'))
+    PURCHASE_EXECUTOR = PurchaseExecutor(CONFIG.max_concurrent_purchases, CONFIG.merchant_concurrency)
+    WEB_DRIVER_POOL = WebDriverPool(get_webdriver, close_webdriver,
+        max_sessions=CONFIG.browser_pool_max_sessions,
+        idle_timeout=CONFIG.browser_pool_idle_timeout,
+        max_uses=CONFIG.browser_pool_max_uses
+    )
+    atexit.register(WEB_DRIVER_POOL.close_all)
+    PROFILE_STORE = ProfileStore(absolute_path('program_files', 'profiles'),
+        max_mb=CONFIG.profile_max_mb,
+        max_age_days=CONFIG.profile_max_age_days
+    )
+    FAILURE_STORE = FailureStore(absolute_path('failures'),
+        max_age_days=CONFIG.failure_max_age_days,
+        max_total_mb=CONFIG.failure_max_total_mb,
+        max_per_merchant=CONFIG.failure_max_per_merchant
+    )
+    FAILURE_WRITER = FailureWriter(write_failure)
+    METRICS_STORE = MetricsStore(absolute_path('state', 'metrics'))
+    LIVE_STATS = LiveStats()
+    PREFLIGHT_CACHE = PreflightCache(CONFIG.preflight_ttl_minutes * 60)
+    atexit.register(FAILURE_WRITER.flush, 120)  # finish writing and sending failure reports before exiting
+    SCHEDULER = Scheduler(clock=CLOCK)
+
+    if sys.argv[1:] == ['plan']:
+        print_plan()
+    elif sys.argv[1:2] == ['failures']:
+        failures_command(sys.argv[2:])
+    elif sys.argv[1:2] == ['metrics']:
+        metrics_command(sys.argv[2:])
+    else:
+        main()
@@ -0,0 +1,168 @@
+import gzip
+import hashlib
+import json
+import os
+import time
+import zipfile
+from threading import Lock
+
+UNCOMPRESSED_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.gif', '.ico', '.zip')  # already compressed, gzip won't help
+
+
+# Keeps failure reports in the failures folder without letting it grow forever.
+#
+# failures/index.json         - every stored failure, its merchant, when it was recorded and last used, and its files
+# failures/blobs/ab/abcd...gz - file contents named by their sha256, gzipped unless already compressed
+#
+# Files with the same contents are stored once, which is most of a coverage report (the same JavaScript, CSS and images
+# every time) and often the DOM when a merchant fails the same way again. After each add() failures older than
+# max_age_days are removed, then the least recently used failures beyond max_per_merchant for a merchant, then the
+# least recently used failures until the blobs fit in max_total_mb. The failure just added is never removed. A limit of
+# 0 or None turns it off.
+#
+# A failure's files are read back with read() or bundled into a zip with write_zip(), which is how they are emailed and
+# how "debbit failures export" hands them to people.
+class FailureStore:
+    def __init__(self, directory, max_age_days=90, max_total_mb=200, max_per_merchant=20):
+        self.directory = directory
+        self.max_age_days = max_age_days
+        self.max_total_mb = max_total_mb
+        self.max_per_merchant = max_per_merchant
+        self.lock = Lock()
+        self.index = None  # loaded on first use
+
+    # files is {relative name: bytes}, names use / as the separator
+    def add(self, failure_id, merchant_name, files):
+        with self.lock:
+            index = self._load_index()
+            now = int(time.time())
+            entry = {'merchant': merchant_name, 'created': now, 'last_used': now, 'files': {}}
+            for name, data in files.items():
+                entry['files'][name] = self._write_blob(index, name, data)
+            index['failures'][failure_id] = entry
+
+            self._apply_retention(index, failure_id)
+            unreferenced = set(index['blobs']) - referenced_blobs(index)
+            for blob in unreferenced:
+                del index['blobs'][blob]
+            self._save_index(index)
+
+            for blob in unreferenced:  # after saving the index so a crash can at worst leave an unused blob behind
+                try:
+                    os.remove(self._blob_path(blob))
+                except FileNotFoundError:
+                    pass
+
+    # [(failure_id, entry)] oldest first
+    def list(self):
+        with self.lock:
+            failures = self._load_index()['failures']
+            return sorted([(failure_id, dict(entry)) for failure_id, entry in failures.items()], key=lambda item: item[1]['created'])
+
+    def names(self, failure_id):
+        with self.lock:
+            return list(self._load_index()['failures'][failure_id]['files'])
+
+    def read(self, failure_id, name):
+        with self.lock:
+            blob = self._load_index()['failures'][failure_id]['files'][name]
+        with open(self._blob_path(blob), 'rb') as f:
+            data = f.read()
+        return gzip.decompress(data) if blob.endswith('.gz') else data
+
+    # Stored size of a failure's files, after dedup files shared with other failures are counted in full
+    def stored_bytes(self, failure_id):
+        with self.lock:
+            index = self._load_index()
+            return sum([index['blobs'][blob] for blob in set(index['failures'][failure_id]['files'].values())])
+
+    # Marks the failure as recently used so the retention policy removes it last
+    def touch(self, failure_id):
+        with self.lock:
+            index = self._load_index()
+            index['failures'][failure_id]['last_used'] = int(time.time())
+            self._save_index(index)
+
+    # Zips the failure's files into fileobj. A file is left out if it could push the zip past max_bytes, returns the
+    # names of the files left out.
+    def write_zip(self, failure_id, fileobj, max_bytes=None):
+        left_out = []
+        with zipfile.ZipFile(fileobj, mode='w', compression=zipfile.ZIP_DEFLATED) as z:
+            for name in self.names(failure_id):
+                data = self.read(failure_id, name)
+                worst_case_bytes = len(data) * 1001 // 1000 + 200 + 2 * len(name)  # deflate barely grows incompressible data, plus zip headers
+                if max_bytes and fileobj.tell() + worst_case_bytes > max_bytes:
+                    left_out.append(name)
+                    continue
+                z.writestr(name, data)
+        self.touch(failure_id)
+        return left_out
+
+    def _apply_retention(self, index, keep_id):
+        failures = index['failures']
+
+        if self.max_age_days:
+            oldest = time.time() - self.max_age_days * 86400
+            for failure_id in [failure_id for failure_id, entry in failures.items() if entry['created'] < oldest and failure_id != keep_id]:
+                del failures[failure_id]
+
+        if self.max_per_merchant:
+            for merchant_name in set([entry['merchant'] for entry in failures.values()]):
+                merchant_ids = [failure_id for failure_id, entry in failures.items() if entry['merchant'] == merchant_name]
+                excess = len(merchant_ids) - self.max_per_merchant
+                for failure_id in least_recently_used_first(failures, [failure_id for failure_id in merchant_ids if failure_id != keep_id])[:max(0, excess)]:
+                    del failures[failure_id]
+
+        if self.max_total_mb:
+            max_bytes = self.max_total_mb * 1024 * 1024
+            for failure_id in least_recently_used_first(failures, [failure_id for failure_id in failures if failure_id != keep_id]):
+                if sum([index['blobs'][blob] for blob in referenced_blobs(index)]) <= max_bytes:
+                    break
+                del failures[failure_id]
+
+    def _write_blob(self, index, name, data):
+        compress = not name.lower().endswith(UNCOMPRESSED_EXTENSIONS)
+        blob = hashlib.sha256(data).hexdigest() + ('.gz' if compress else '')
+        if blob in index['blobs'] and os.path.exists(self._blob_path(blob)):
+            return blob  # already stored for another failure
+
+        payload = gzip.compress(data) if compress else data
+        path = self._blob_path(blob)
+        if not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path + '.tmp', 'wb') as f:
+            f.write(payload)
+        os.replace(path + '.tmp', path)
+
+        index['blobs'][blob] = len(payload)
+        return blob
+
+    def _blob_path(self, blob):
+        return os.path.join(self.directory, 'blobs', blob[:2], blob)
+
+    def _index_filename(self):
+        return os.path.join(self.directory, 'index.json')
+
+    def _load_index(self):
+        if self.index is None:
+            try:
+                with open(self._index_filename(), 'r', encoding='utf-8') as f:
+                    self.index = json.load(f)
+            except FileNotFoundError:
+                self.index = {'version': 1, 'failures': {}, 'blobs': {}}
+        return self.index
+
+    def _save_index(self, index):
+        if not os.path.exists(self.directory):
+            os.makedirs(self.directory)
+        with open(self._index_filename() + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(index, f, separators=(',', ':'))
+        os.replace(self._index_filename() + '.tmp', self._index_filename())
+
+
+def referenced_blobs(index):
+    return set([blob for entry in index['failures'].values() for blob in entry['files'].values()])
+
+
+def least_recently_used_first(failures, failure_ids):
+    return sorted(failure_ids, key=lambda failure_id: (failures[failure_id]['last_used'], failures[failure_id]['created']))
@@ -0,0 +1,67 @@
+import logging
+import time
+import traceback
+from collections import deque
+from threading import Condition, Thread
+
+LOGGER = logging.getLogger('debbit')
+
+
+# Does the slow part of recording a failure on a background thread: writing files, scrubbing the DOM, rendering the
+# coverage report and emailing the failure report. The merchant thread only grabs the screenshot and DOM from Firefox,
+# hands them to submit() and gives the browser back to the pool right away.
+#
+# write(failure) does the work for one failure, failures are written one at a time in the order they were submitted.
+# At most max_pending_bytes of screenshots and DOMs wait in memory, submit() blocks until the writer catches up rather
+# than holding more. A single failure larger than max_pending_bytes is still accepted once nothing else is waiting.
+class FailureWriter:
+    def __init__(self, write, max_pending_bytes=64 * 1024 * 1024):
+        self.write = write
+        self.max_pending_bytes = max_pending_bytes
+
+        self.queue = deque()  # (failure, size in bytes)
+        self.pending_bytes = 0  # queued plus the failure being written
+        self.writing = False
+        self.condition = Condition()
+        self.thread = None
+
+    def submit(self, failure, size):
+        with self.condition:
+            while self.pending_bytes and self.pending_bytes + size > self.max_pending_bytes:
+                self.condition.wait()
+
+            self.queue.append((failure, size))
+            self.pending_bytes += size
+            if not self.thread:
+                self.thread = Thread(target=self._run, name='debbit-failure-writer', daemon=True)
+                self.thread.start()
+            self.condition.notify_all()
+
+    # Waits for every submitted failure to be written. Returns False if timeout seconds passed first.
+    def flush(self, timeout=None):
+        deadline = time.time() + timeout if timeout is not None else None
+        with self.condition:
+            while self.queue or self.writing:
+                remaining = deadline - time.time() if deadline is not None else None
+                if remaining is not None and remaining <= 0:
+                    return False
+                self.condition.wait(remaining)
+        return True
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while not self.queue:
+                    self.condition.wait()
+                failure, size = self.queue.popleft()
+                self.writing = True
+
+            try:
+                self.write(failure)
+            except Exception:
+                LOGGER.error('Error writing failure report: ' + traceback.format_exc())
+            finally:
+                with self.condition:
+                    self.pending_bytes -= size
+                    self.writing = False
+                    self.condition.notify_all()
@@ -0,0 +1,73 @@
+import logging
+import sys
+from threading import Lock
+
+import coverage
+
+LOGGER = logging.getLogger('debbit')
+
+
+# Records which lines of the merchant files ran, using sys.monitoring (Python 3.12+) instead of coverage.py's trace
+# function. Each line reports itself once and is then disabled, so a purchase pays for each merchant line the first
+# time it runs rather than on every line of every Python function on the thread. Nothing is rendered unless
+# record_failure() asks for html_report(), which hands the recorded lines to coverage.py to produce the usual report.
+#
+# sys.monitoring is process wide, so recorders running at the same time for the same merchant file share line data.
+class LineRecorder:
+    lock = Lock()
+    active = []  # recorders currently recording, read by the callbacks
+    tool_registered = False
+
+    def __init__(self, include):
+        self.include = include  # function(filename) that returns True for files to record
+        self.lines = {}  # filename -> set of line numbers that ran
+
+    @staticmethod
+    def supported():
+        return hasattr(sys, 'monitoring')
+
+    def __enter__(self):
+        monitoring = sys.monitoring
+        with LineRecorder.lock:
+            if not LineRecorder.tool_registered:
+                try:
+                    monitoring.use_tool_id(monitoring.COVERAGE_ID, 'debbit')
+                except ValueError:
+                    LOGGER.warning('Another coverage tool is running, not recording merchant coverage')
+                    return None
+                monitoring.register_callback(monitoring.COVERAGE_ID, monitoring.events.PY_START, py_start)
+                monitoring.register_callback(monitoring.COVERAGE_ID, monitoring.events.LINE, line)
+                LineRecorder.tool_registered = True
+
+            LineRecorder.active.append(self)
+            monitoring.set_events(monitoring.COVERAGE_ID, monitoring.events.PY_START)
+            monitoring.restart_events()  # re-arm lines that reported themselves during earlier purchases
+        return self
+
+    def __exit__(self, type, value, traceback):
+        monitoring = sys.monitoring
+        with LineRecorder.lock:
+            if self in LineRecorder.active:
+                LineRecorder.active.remove(self)
+            if not LineRecorder.active and LineRecorder.tool_registered:
+                monitoring.set_events(monitoring.COVERAGE_ID, 0)
+
+    # Same signature as coverage.Coverage.html_report() so record_failure() doesn't care which one it has
+    def html_report(self, directory, include=None):
+        cov = coverage.Coverage(data_file=None)
+        cov.get_data().add_lines({filename: sorted(lines) for filename, lines in self.lines.items()})
+        cov.html_report(directory=directory, include=include)
+
+
+# Turns on line events for functions in files a recorder wants, the first time each function runs
+def py_start(code, instruction_offset):
+    if any([recorder.include(code.co_filename) for recorder in LineRecorder.active]):
+        sys.monitoring.set_local_events(sys.monitoring.COVERAGE_ID, code, sys.monitoring.events.LINE)
+    return sys.monitoring.DISABLE
+
+
+def line(code, line_number):
+    for recorder in LineRecorder.active:
+        if recorder.include(code.co_filename):
+            recorder.lines.setdefault(code.co_filename, set()).add(line_number)
+    return sys.monitoring.DISABLE
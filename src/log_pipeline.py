@@ -0,0 +1,103 @@
+import gzip
+import json
+import logging
+import os
+import queue
+import shutil
+import time
+from datetime import datetime
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+# Fields MerchantLogFilter, or extra={...} on a log call, add to records. The JSON lines log includes them when set.
+CONTEXT_FIELDS = ['merchant_id', 'card', 'phase', 'amount', 'duration']
+
+
+# Takes log writes off the merchant threads. The debbit logger only puts records on an in-memory queue, a single
+# listener thread formats them and writes them to stdout and the log files. A merchant thread never waits on disk I/O to
+# log, even while it holds a purchase slot or a browser.
+#
+# The log filter is applied on the logging thread before the record is queued, so thread-locals like the merchant id
+# are read from the merchant thread that logged rather than from the listener thread.
+#
+# set_handlers() can be called again to replace the handlers, e.g. once config.txt is read, records logged in between
+# stay queued and go to the new handlers. stop() writes everything still queued and is registered with atexit.
+class LogPipeline:
+    def __init__(self, logger, log_filter=None):
+        self.queue = queue.SimpleQueue()
+        self.handler = QueueHandler(self.queue)
+        if log_filter:
+            self.handler.addFilter(log_filter)
+        logger.addHandler(self.handler)
+        self.listener = None
+        self.handlers = []
+
+    def set_handlers(self, *handlers):
+        if self.listener:
+            self.listener.stop()
+        for handler in self.handlers:
+            if handler not in handlers:
+                handler.close()
+
+        self.handlers = list(handlers)
+        self.listener = QueueListener(self.queue, *handlers, respect_handler_level=True)
+        self.listener.start()
+
+    def stop(self):
+        if self.listener:
+            self.listener.stop()
+            self.listener = None
+        for handler in self.handlers:
+            handler.close()
+
+
+# A log file that is rotated once it's larger than max_bytes or older than rotate_secs, whichever comes first. Old
+# segments are gzipped, debbit_log.log.1.gz is the most recent, and only backup_count of them are kept.
+class RotatingGzipFileHandler(RotatingFileHandler):
+    def __init__(self, filename, max_bytes=10 * 1024 * 1024, rotate_secs=7 * 86400, backup_count=10):
+        super().__init__(filename, maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8', delay=True)
+        self.rotate_secs = rotate_secs
+        self.namer = lambda name: name + '.gz'
+        self.rotator = gzip_segment
+        self.rollover_at = self.next_rollover()
+
+    def shouldRollover(self, record):
+        if self.rotate_secs and time.time() >= self.rollover_at and os.path.exists(self.baseFilename) and os.path.getsize(self.baseFilename) > 0:
+            return True
+        return super().shouldRollover(record)
+
+    def doRollover(self):
+        super().doRollover()
+        self.rollover_at = time.time() + self.rotate_secs
+
+    # A segment's age counts from when the file was created where the OS records it, so restarting debbit doesn't keep
+    # pushing the rotation back. Elsewhere it counts from when debbit started and max_bytes still bounds the file.
+    def next_rollover(self):
+        if not self.rotate_secs:
+            return float('inf')
+        try:
+            stat = os.stat(self.baseFilename)
+            started = getattr(stat, 'st_birthtime', None) or (stat.st_ctime if os.name == 'nt' else time.time())
+        except OSError:
+            started = time.time()
+        return started + self.rotate_secs
+
+
+def gzip_segment(source, dest):
+    with open(source, 'rb') as f_in, gzip.open(dest, 'wb') as f_out:
+        shutil.copyfileobj(f_in, f_out)
+    os.remove(source)
+
+
+# One JSON object per line: time, level, message and the CONTEXT_FIELDS that are set. Tracebacks are part of the message.
+class JsonLinesFormatter(logging.Formatter):
+    def format(self, record):
+        line = {
+            'time': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'message': record.getMessage()
+        }
+        for field in CONTEXT_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                line[field] = round(value, 3) if field == 'duration' else value
+        return json.dumps(line)
@@ -0,0 +1,150 @@
+import json
+import logging
+import os
+from threading import Lock
+
+LOGGER = logging.getLogger('debbit')
+
+
+# Keeps how long each step of each purchase attempt took, one file per month in the metrics directory:
+#
+# metrics_YYYY_MM.jsonl - one JSON object per attempt: when it started, the merchant, the result, the whole attempt's
+#                         seconds, the seconds of it spent in utils.pace delays and the seconds of each utils.span step
+#
+# Lines are only ever appended, so a crash can at worst leave one incomplete line which load() skips. Nothing in here
+# is needed to make purchases, deleting the directory is always safe.
+class MetricsStore:
+    def __init__(self, directory):
+        self.directory = directory
+        self.lock = Lock()
+
+    def record(self, now, merchant_id, result, total_secs, delay_secs, spans):
+        line = {
+            'unix_time': int(now.timestamp()),
+            'merchant_id': merchant_id,
+            'result': result,
+            'total': round(total_secs, 3),
+            'delays': round(delay_secs, 3),
+            'steps': {name: round(secs, 3) for name, secs in spans.items()}
+        }
+
+        data = (json.dumps(line) + '\n').encode('utf-8')
+        with self.lock:
+            if not os.path.exists(self.directory):
+                os.makedirs(self.directory)
+            with open(self.filename(now.year, now.month), 'ab+') as f:
+                if f.seek(0, os.SEEK_END) > 0:
+                    f.seek(-1, os.SEEK_END)
+                    if f.read(1) != b'\n':  # debbit was stopped mid-write last time, don't append to the incomplete line
+                        f.write(b'\n')
+                f.write(data)
+
+    def load(self, year, month):
+        if not os.path.exists(self.filename(year, month)):
+            return []
+
+        lines = []
+        with open(self.filename(year, month), 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    lines.append(json.loads(line))
+                except ValueError:
+                    LOGGER.warning('Skipping incomplete line in ' + self.filename(year, month))
+        return lines
+
+    def filename(self, year, month):
+        return os.path.join(self.directory, 'metrics_' + str(year) + '_' + str(month).zfill(2) + '.jsonl')
+
+
+# {merchant_id: {step: [seconds]}} for the given attempts. 'total' and 'delays' are listed as steps too.
+def step_seconds(lines):
+    merchants = {}
+    for line in lines:
+        steps = merchants.setdefault(line['merchant_id'], {})
+        for name, secs in [('total', line['total']), ('delays', line['delays'])] + sorted(line['steps'].items()):
+            steps.setdefault(name, []).append(secs)
+    return merchants
+
+
+# Nearest-rank percentile, always one of the measured values
+def percentile(values, p):
+    ordered = sorted(values)
+    rank = max(1, -(-len(ordered) * p // 100))  # ceil without floats
+    return ordered[int(rank) - 1]
+
+
+LATENCY_BUCKETS = [10, 30, 60, 120, 300, 600, 1800]  # seconds, purchase attempts range from seconds to waiting on MFA
+
+
+# Counts purchase attempts since debbit started for the status server, and remembers which merchants are waiting out a
+# retry backoff or have stopped. Purchase counts for the month come from the state store instead so they survive
+# restarts.
+class LiveStats:
+    def __init__(self, buckets=None):
+        self.buckets = buckets or LATENCY_BUCKETS
+        self.lock = Lock()
+        self.attempts = {}  # (merchant_id, result) -> count
+        self.latencies = {}  # merchant_id -> [count per bucket..., count above the last bucket, sum of seconds]
+        self.backoff_until = {}  # merchant_id -> unix time of the retry
+        self.stopped = set()  # merchant ids that won't be scheduled again until debbit restarts
+
+    def observe(self, merchant_id, result, secs):
+        with self.lock:
+            self.attempts[(merchant_id, result)] = self.attempts.get((merchant_id, result), 0) + 1
+            latency = self.latencies.setdefault(merchant_id, [0] * (len(self.buckets) + 2))
+            latency[next((i for i, bucket in enumerate(self.buckets) if secs <= bucket), len(self.buckets))] += 1
+            latency[-1] += secs
+
+    def backoff(self, merchant_id, until):
+        with self.lock:
+            if until is None:
+                self.backoff_until.pop(merchant_id, None)
+            else:
+                self.backoff_until[merchant_id] = until
+
+    def stop(self, merchant_id):
+        with self.lock:
+            self.stopped.add(merchant_id)
+            self.backoff_until.pop(merchant_id, None)
+
+    # Unix time of the retry the merchant is waiting for, or None if it isn't backing off
+    def retry_time(self, merchant_id):
+        with self.lock:
+            return self.backoff_until.get(merchant_id)
+
+    def is_stopped(self, merchant_id):
+        with self.lock:
+            return merchant_id in self.stopped
+
+    # Prometheus text for the attempt counters and latency histograms
+    def prometheus(self):
+        with self.lock:
+            attempts = dict(self.attempts)
+            latencies = {merchant_id: list(latency) for merchant_id, latency in self.latencies.items()}
+
+        lines = prometheus_family('debbit_purchase_attempts_total', 'counter', 'Purchase attempts since debbit started by result',
+            [({'merchant': merchant_id, 'result': result}, count) for (merchant_id, result), count in sorted(attempts.items())])
+
+        samples = []
+        for merchant_id, latency in sorted(latencies.items()):
+            cumulative = 0
+            for bucket, count in zip(self.buckets + ['+Inf'], latency[:-1]):
+                cumulative += count
+                samples.append(('_bucket', {'merchant': merchant_id, 'le': str(bucket)}, cumulative))
+            samples.append(('_sum', {'merchant': merchant_id}, round(latency[-1], 3)))
+            samples.append(('_count', {'merchant': merchant_id}, cumulative))
+        lines += ['# HELP debbit_purchase_duration_seconds Seconds spent in the merchant automation per purchase attempt',
+                  '# TYPE debbit_purchase_duration_seconds histogram']
+        lines += [prometheus_sample('debbit_purchase_duration_seconds' + suffix, labels, value) for suffix, labels, value in samples]
+        return lines
+
+
+# Lines of one Prometheus metric, samples are [(labels, value)]
+def prometheus_family(name, metric_type, description, samples):
+    return ['# HELP ' + name + ' ' + description, '# TYPE ' + name + ' ' + metric_type] + [prometheus_sample(name, labels, value) for labels, value in samples]
+
+
+def prometheus_sample(name, labels, value):
+    if labels:
+        name += '{' + ','.join([key + '="' + str(label).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') + '"' for key, label in labels.items()]) + '}'
+    return name + ' ' + str(value)
@@ -0,0 +1,64 @@
+import os
+from threading import Lock
+
+import yaml  # PyYAML
+
+
+# Persists each merchant's purchase plan for the month to state/plans/debbit_plan_YYYY_MM_<merchant id>.txt so it can
+# be read by people (or by "debbit plan") without running any purchases. A plan is a plain dict:
+#
+# fingerprint: the merchant's scheduling config when the plan was made, a changed config means the plan is stale
+# planned_at: human readable time the plan was made
+# slots: list of planned bursts (or single purchases in spread mode) in time order, each with
+#     unix_time, human_time, purchases, amounts and purchase_count_before (the month's purchase count before the slot)
+# next_plan_time: unix time after the last slot when a new plan is needed, usually the first day of next month
+#
+# A plan is only written when it is made. Slots are not crossed off the saved plan as they complete, a slot whose
+# purchase_count_before is below the month's purchase count is already done. Each merchant has its own file so
+# planning one merchant never rewrites another merchant's plan.
+class PlanStore:
+    def __init__(self, directory):
+        self.directory = directory
+        self.plans = {}  # (year, month, merchant_id) -> plan, None if the merchant has no plan for the month
+        self.lock = Lock()
+        self.bytes_read = 0
+        self.bytes_written = 0
+
+    def get(self, year, month, merchant_id):
+        with self.lock:
+            if (year, month, merchant_id) not in self.plans:
+                self.plans[(year, month, merchant_id)] = self._read(year, month, merchant_id)
+            return self.plans[(year, month, merchant_id)]
+
+    def put(self, year, month, merchant_id, plan):
+        with self.lock:
+            self.plans[(year, month, merchant_id)] = plan
+            self._save(year, month, merchant_id)
+
+    def stats(self):
+        with self.lock:
+            return {'bytes_read': self.bytes_read, 'bytes_written': self.bytes_written}
+
+    def filename(self, year, month, merchant_id):
+        return os.path.join(self.directory, 'debbit_plan_' + str(year) + '_' + str(month).zfill(2) + '_' + merchant_id + '.txt')
+
+    def _read(self, year, month, merchant_id):
+        try:
+            with open(self.filename(year, month, merchant_id), 'r', encoding='utf-8') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+
+        self.bytes_read += len(data)
+        return yaml.safe_load(data)
+
+    def _save(self, year, month, merchant_id):
+        if not os.path.exists(self.directory):
+            os.makedirs(self.directory)
+
+        filename = self.filename(year, month, merchant_id)
+        data = yaml.dump(self.plans[(year, month, merchant_id)])
+        with open(filename + '.tmp', 'w', encoding='utf-8') as f:
+            f.write(data)
+        self.bytes_written += len(data)
+        os.replace(filename + '.tmp', filename)
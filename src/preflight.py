@@ -0,0 +1,118 @@
+import http.cookiejar
+import urllib.request
+from html.parser import HTMLParser
+from threading import Lock
+
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:91.0) Gecko/20100101 Firefox/91.0'
+
+
+# A plain HTTP client logged in with a merchant's saved cookies, for merchant preflight() hooks. Nothing it receives is
+# saved, the cookies file stays exactly as Firefox left it.
+class HttpSession:
+    def __init__(self, cookies, timeout=30):
+        self.timeout = timeout
+        self.jar = http.cookiejar.CookieJar()
+        for cookie in cookies:
+            self.jar.set_cookie(jar_cookie(cookie))
+
+        self.opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(self.jar))
+        self.opener.addheaders = [
+            ('User-Agent', USER_AGENT),
+            ('Accept', 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8'),
+            ('Accept-Language', 'en-US,en;q=0.5')
+        ]
+
+    # Follows redirects, Page.url is where it ended up. Raises urllib.error.HTTPError for error responses.
+    def get(self, url):
+        with self.opener.open(url, timeout=self.timeout) as response:
+            return Page(response.geturl(), response.read().decode(response.headers.get_content_charset() or 'utf-8', errors='replace'))
+
+
+# A cookie dict of the selenium-cookies-extension as an http.cookiejar cookie
+def jar_cookie(cookie):
+    host_only = cookie.get('hostOnly', False)
+    domain = cookie['domain'] if host_only else '.' + cookie['domain'].lstrip('.')
+    return http.cookiejar.Cookie(
+        version=0, name=cookie['name'], value=cookie['value'], port=None, port_specified=False,
+        domain=domain, domain_specified=not host_only, domain_initial_dot=not host_only,
+        path=cookie.get('path') or '/', path_specified=True, secure=cookie.get('secure', False),
+        expires=int(cookie['expirationDate']) if cookie.get('expirationDate') else None, discard=cookie.get('session', False),
+        comment=None, comment_url=None, rest={'HttpOnly': None} if cookie.get('httpOnly') else {}
+    )
+
+
+# The HTML of a page, with the lookups merchant preflight() hooks need to mirror what web_automation() reads in Firefox.
+# Only what the server sent is here, anything a page renders with javascript is not.
+class Page:
+    def __init__(self, url, html):
+        self.url = url
+        self.html = html
+
+    def has_id(self, element_id):
+        return bool(self._find(lambda tag, attrs, text: attrs.get('id') == element_id))
+
+    # Text of the first element of the tag whose own text contains the text, like the xpath
+    # //tag[contains(text(), 'text')], or None
+    def text_containing(self, tag, text):
+        found = self._find(lambda found_tag, attrs, found_text: found_tag == tag and text in found_text)
+        return found[2].strip() if found else None
+
+    def _find(self, matches):
+        parser = ElementFinder(matches)
+        parser.feed(self.html)
+        parser.close()
+        return parser.found
+
+
+class ElementFinder(HTMLParser):
+    def __init__(self, matches):
+        super().__init__()
+        self.matches = matches
+        self.open = []  # [tag, attrs, own text] of the elements being parsed
+        self.found = None
+
+    def handle_starttag(self, tag, attrs):
+        if self.found:
+            return
+        element = [tag, dict(attrs), '']
+        if self.matches(*element):
+            self.found = element
+        elif tag not in ['br', 'hr', 'img', 'input', 'link', 'meta']:
+            self.open.append(element)
+
+    def handle_endtag(self, tag):
+        while self.open and not self.found:
+            element = self.open.pop()
+            if self.matches(*element):
+                self.found = element
+            if element[0] == tag:
+                break
+
+    def handle_data(self, data):
+        if self.open:
+            self.open[-1][2] += data
+
+
+# Remembers what each account's preflight() returned for ttl_secs. Keyed by merchant and login rather than by card, so
+# several cards paying the same bill share one check.
+class PreflightCache:
+    def __init__(self, ttl_secs):
+        self.ttl_secs = ttl_secs
+        self.lock = Lock()
+        self.entries = {}  # key -> (unix time checked, result)
+
+    # (True, result) if the account was checked less than ttl_secs ago, otherwise (False, None)
+    def get(self, key, now):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry and now - entry[0] < self.ttl_secs:
+                return True, entry[1]
+            return False, None
+
+    def put(self, key, now, result):
+        with self.lock:
+            self.entries[key] = (now, result)
+
+    def invalidate(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
@@ -0,0 +1,81 @@
+import logging
+import os
+import shutil
+import time
+from threading import Lock
+
+LOGGER = logging.getLogger('debbit')
+
+# Cache and crash data in a profile that Firefox rebuilds as needed, removed first when a profile grows past max_mb
+DISPOSABLE = ['cache2', 'startupCache', 'thumbnails', 'shader-cache', 'jumpListCache', 'crashes', 'minidumps',
+              'datareporting', 'saved-telemetry-pings', os.path.join('storage', 'temporary')]
+
+
+# Keeps one Firefox profile per merchant and usr in program_files/profiles so the HTTP cache, cookies, local storage and
+# service workers survive between launches, instead of Firefox starting from a fresh copy of the extension profile
+# every time. Profiles are keyed by merchant.name + '_' + merchant.usr, the same key as the cookies file.
+#
+# A profile is checked out while its Firefox is running. After Firefox quits, checkin() removes the disposable caches if
+# the profile is larger than max_mb and the whole profile if that isn't enough. Profiles unused for max_age_days are
+# removed at most once a day. Removing a profile is safe, it is seeded from the cookies file on its next launch.
+class ProfileStore:
+    def __init__(self, directory, max_mb=300, max_age_days=60):
+        self.directory = directory
+        self.max_mb = max_mb
+        self.max_age_days = max_age_days
+        self.lock = Lock()
+        self.in_use = set()
+        self.last_prune = 0
+
+    # Returns the profile directory, created if needed, or None if another Firefox is already running with it
+    def checkout(self, merchant):
+        self.prune()
+
+        path = os.path.join(self.directory, merchant.name + '_' + merchant.usr)
+        with self.lock:
+            if path in self.in_use:
+                return None
+            self.in_use.add(path)
+
+        if not os.path.exists(path):
+            os.makedirs(path)
+        return path
+
+    def checkin(self, path):
+        try:
+            os.utime(path)  # last used, for prune()
+            if self.max_mb and directory_bytes(path) > self.max_mb * 1024 * 1024:
+                for name in DISPOSABLE:
+                    shutil.rmtree(os.path.join(path, name), ignore_errors=True)
+
+                if directory_bytes(path) > self.max_mb * 1024 * 1024:
+                    LOGGER.info('Firefox profile ' + os.path.basename(path) + ' is still larger than ' + str(self.max_mb) + 'MB without its cache, removing it')
+                    shutil.rmtree(path, ignore_errors=True)
+        finally:
+            with self.lock:
+                self.in_use.discard(path)
+
+    # Removes profiles that haven't been used in max_age_days
+    def prune(self):
+        with self.lock:
+            if not self.max_age_days or time.time() - self.last_prune < 86400 or not os.path.exists(self.directory):
+                return
+            self.last_prune = time.time()
+
+            oldest = time.time() - self.max_age_days * 86400
+            for name in os.listdir(self.directory):
+                path = os.path.join(self.directory, name)
+                if path not in self.in_use and os.path.isdir(path) and os.path.getmtime(path) < oldest:
+                    LOGGER.info('Removing Firefox profile ' + name + ', unused for ' + str(self.max_age_days) + ' days')
+                    shutil.rmtree(path, ignore_errors=True)
+
+
+def directory_bytes(path):
+    total = 0
+    for root, dirs, files in os.walk(path):
+        for file in files:
+            try:
+                total += os.path.getsize(os.path.join(root, file))
+            except OSError:  # Firefox lock files and sockets can disappear while walking
+                pass
+    return total
@@ -1,6 +1,4 @@
 import logging
-import random
-import time
 
 from selenium import common
 from selenium.common.exceptions import TimeoutException, ElementClickInterceptedException, WebDriverException, \
@@ -14,231 +12,256 @@ import utils
 from result import Result
 
 LOGGER = logging.getLogger('debbit')
+COOKIE_DOMAINS = ['amazon.com']  # cookies from other domains, e.g. ads and trackers, aren't saved
+RESOURCE_ALLOWLIST = ['images-na.ssl-images-amazon.com', 'opfcaptcha-prod.s3.amazonaws.com']  # captcha images still load when images are blocked
 
 
 def web_automation(driver, merchant, amount):
-    driver.get('https://www.amazon.com/gp/product/B086KKT3RX')
-
-    WebDriverWait(driver, 90).until(expected_conditions.element_to_be_clickable((By.ID, "gcui-asv-reload-buynow-button")))
-    for i in range(300):
-        if driver.find_element_by_id("gcui-asv-reload-buynow-button").text == 'Buy Now':  # wait for 'Loading...' text to turn into 'Buy Now'
-            break
-        time.sleep(0.1)
-
-    time.sleep(1 + random.random() * 2)  # slow down automation randomly to help avoid bot detection
-    driver.find_element_by_id('gcui-asv-reload-form-custom-amount').send_keys(utils.cents_to_str(amount))
-    time.sleep(1 + random.random() * 2)  # slow down automation randomly to help avoid bot detection
-    driver.find_element_by_id("gcui-asv-reload-buynow-button").click()
-
-    WebDriverWait(driver, 90).until(utils.AnyExpectedCondition(
-        expected_conditions.element_to_be_clickable((By.ID, 'ap_email')),  # first time login
-        expected_conditions.element_to_be_clickable((By.XPATH, "//*[contains(text(),'" + merchant.usr + "')]")),  # username found on login page
-        # Already logged in
-        expected_conditions.element_to_be_clickable((By.XPATH, "//*[contains(text(),'Order Summary')]")),  # Checkout page
-        expected_conditions.element_to_be_clickable((By.XPATH, "//*[contains(text(),'a payment method')]"))  # Another version of the checkout page
-    ))
-
-    if not driver.find_elements_by_xpath("//*[contains(text(),'Order Summary')]") and not driver.find_elements_by_xpath("//*[contains(text(),'a payment method')]"):  # Not in checkout, so we did not auto login. Finish login flow.
-        if driver.find_elements_by_xpath("//*[contains(text(),'" + merchant.usr + "')]"):
-            driver.find_element_by_xpath("//*[contains(text(),'" + merchant.usr + "')]").click()  # click username in case we're on the Switch Accounts page
-            WebDriverWait(driver, 30).until(expected_conditions.element_to_be_clickable((By.ID, 'signInSubmit')))
-            time.sleep(1 + random.random() * 2)
-
-        if driver.find_elements_by_id('ap_email'):  # if first run, fill in email. If subsequent run, nothing to fill in
-            try:
-                driver.find_element_by_id('ap_email').send_keys(merchant.usr)
-                time.sleep(1 + random.random() * 2)
-            except ElementNotInteractableException:  # Sometimes this field is prefilled with Firstname Lastname and does not accept input
-                pass
-
-        if driver.find_elements_by_id('continue'):  # a/b tested new UI flow
-            driver.find_element_by_id('continue').click()
-            WebDriverWait(driver, 5).until(expected_conditions.element_to_be_clickable((By.ID, 'ap_password')))
-            time.sleep(1 + random.random() * 2)
-
-        if driver.find_elements_by_name('rememberMe'):
-            time.sleep(1 + random.random() * 2)
-            driver.find_element_by_name('rememberMe').click()
-
-        driver.find_element_by_id('ap_password').send_keys(merchant.psw)
-        time.sleep(1 + random.random() * 2)
-        driver.find_element_by_id('signInSubmit').click()
-        time.sleep(1 + random.random() * 2)
-
-        handle_anti_automation_challenge(driver, merchant)
-
-        try:  # Push Notification / Email MFA
-            WebDriverWait(driver, 5).until(expected_conditions.element_to_be_clickable((By.XPATH, "//*[contains(text(),'approve the notification')]")))
-            if driver.find_elements_by_xpath("//*[contains(text(),'approve the notification')]"):
-                LOGGER.info('\n')
-                LOGGER.info('Please approve the Amazon login notification sent to your email or phone. Debbit will wait up to 3 minutes.')
-                for i in range(180):  # Wait for up to 3 minutes for user to approve login notification
-                    if not driver.find_elements_by_xpath("//*[contains(text(),'approve the notification')]"):
-                        break
-                    time.sleep(1)
-        except TimeoutException:
-            pass
-
-        try:  # OTP text message
-            WebDriverWait(driver, 5).until(expected_conditions.element_to_be_clickable((By.XPATH, "//*[contains(text(),'phone number ending in')]")))
-            if driver.find_elements_by_id('auth-mfa-remember-device'):
-                driver.find_element_by_id('auth-mfa-remember-device').click()
-
-            sent_to_text = driver.find_element_by_xpath("//*[contains(text(),'phone number ending in')]").text
-            LOGGER.info(sent_to_text)
-            LOGGER.info('Enter OTP here:')
-            otp = input()
+    with utils.span('product_page'):
+        driver.get('https://www.amazon.com/gp/product/B086KKT3RX')
 
-            driver.find_element_by_id('auth-mfa-otpcode').send_keys(otp)
-            time.sleep(1 + random.random() * 2)
-            driver.find_element_by_id('auth-signin-button').click()
-            time.sleep(1 + random.random() * 2)
+        utils.wait_for_element(driver, 90, (By.ID, 'gcui-asv-reload-buynow-button'), clickable=True)
+        try:  # wait for 'Loading...' text to turn into 'Buy Now'
+            utils.wait_for_js(driver, "return document.getElementById(arguments[0]).innerText.trim() == 'Buy Now';", 30, 'gcui-asv-reload-buynow-button')
         except TimeoutException:
             pass
 
-        try:  # OTP email validation
-            WebDriverWait(driver, 5).until(expected_conditions.element_to_be_clickable((By.XPATH, "//*[contains(text(),'One Time Pass')]")))
-            otp_email = True
-        except TimeoutException:
-            otp_email = False
+        utils.pace.type()
+        driver.find_element_by_id('gcui-asv-reload-form-custom-amount').send_keys(utils.cents_to_str(amount))
+        utils.pace.think()
+        driver.find_element_by_id("gcui-asv-reload-buynow-button").click()
+
+    with utils.span('login'):
+        WebDriverWait(driver, 90).until(utils.AnyExpectedCondition(
+            expected_conditions.element_to_be_clickable((By.ID, 'ap_email')),  # first time login
+            expected_conditions.element_to_be_clickable((By.XPATH, "//*[contains(text(),'" + merchant.usr + "')]")),  # username found on login page
+            # Already logged in
+            expected_conditions.element_to_be_clickable((By.XPATH, "//*[contains(text(),'Order Summary')]")),  # Checkout page
+            expected_conditions.element_to_be_clickable((By.XPATH, "//*[contains(text(),'a payment method')]"))  # Another version of the checkout page
+        ))
 
-        try:
-            driver.find_element_by_xpath("//*[contains(text(),'one-time pass')]").click()
-            time.sleep(1 + random.random() * 2)
-            otp_email = True
-        except common.exceptions.NoSuchElementException:
-            pass
+        order_summary, payment_method, username = utils.locate(driver,
+            (By.XPATH, "//*[contains(text(),'Order Summary')]"),
+            (By.XPATH, "//*[contains(text(),'a payment method')]"),
+            (By.XPATH, "//*[contains(text(),'" + merchant.usr + "')]")
+        )
+        if not order_summary['present'] and not payment_method['present']:  # Not in checkout, so we did not auto login. Finish login flow.
+            if username['present']:
+                username['element'].click()  # click username in case we're on the Switch Accounts page
+                WebDriverWait(driver, 30).until(expected_conditions.element_to_be_clickable((By.ID, 'signInSubmit')))
+                utils.pace.think()
+
+            emails = driver.find_elements_by_id('ap_email')
+            if emails:  # if first run, fill in email. If subsequent run, nothing to fill in
+                try:
+                    emails[0].send_keys(merchant.usr)
+                    utils.pace.think()
+                except ElementNotInteractableException:  # Sometimes this field is prefilled with Firstname Lastname and does not accept input
+                    pass
+
+            continue_buttons = driver.find_elements_by_id('continue')
+            if continue_buttons:  # a/b tested new UI flow
+                continue_buttons[0].click()
+                WebDriverWait(driver, 5).until(expected_conditions.element_to_be_clickable((By.ID, 'ap_password')))
+                utils.pace.think()
+
+            remember_me = driver.find_elements_by_name('rememberMe')
+            if remember_me:
+                utils.pace.think()
+                remember_me[0].click()
 
-        if otp_email:
-            if driver.find_elements_by_id('continue'):
-                driver.find_element_by_id('continue').click()
-                time.sleep(1 + random.random() * 2)
+            driver.find_element_by_id('ap_password').send_keys(merchant.psw)
+            utils.pace.think()
+            driver.find_element_by_id('signInSubmit').click()
+            utils.pace.after_click()
 
             handle_anti_automation_challenge(driver, merchant)
 
-            try:  # User may have manually advanced to gift card screen or stopped at OTP input. Handle OTP input if on OTP screen.
-                WebDriverWait(driver, 5).until(expected_conditions.element_to_be_clickable((By.XPATH, "//*[contains(text(),'Enter OTP')]")))
-                sent_to_text = driver.find_element_by_xpath("//*[contains(text(),'@')]").text
-                LOGGER.info(sent_to_text)
-                LOGGER.info('Enter OTP here:')
-                otp = input()
-
-                elem = driver.find_element_by_xpath("//input")
-                elem.send_keys(otp)
-                time.sleep(1 + random.random() * 2)
-                elem.send_keys(Keys.TAB)
-                time.sleep(1 + random.random() * 2)
-                elem.send_keys(Keys.ENTER)
-                time.sleep(1 + random.random() * 2)
-            except TimeoutException:
-                pass
+            with utils.span('mfa'):
+                try:  # Push Notification / Email MFA
+                    WebDriverWait(driver, 5).until(expected_conditions.element_to_be_clickable((By.XPATH, "//*[contains(text(),'approve the notification')]")))
+                    if driver.find_elements_by_xpath("//*[contains(text(),'approve the notification')]"):
+                        LOGGER.info('\n')
+                        LOGGER.info('Please approve the Amazon login notification sent to your email or phone. Debbit will wait up to 3 minutes.')
+                        try:  # Wait for up to 3 minutes for user to approve login notification
+                            utils.wait_for_js(driver, "return !document.evaluate(arguments[0], document, null, XPathResult.FIRST_ORDERED_NODE_TYPE, null).singleNodeValue;", 180, "//*[contains(text(),'approve the notification')]")
+                        except TimeoutException:
+                            pass
+                except TimeoutException:
+                    pass
+
+                try:  # OTP text message
+                    WebDriverWait(driver, 5).until(expected_conditions.element_to_be_clickable((By.XPATH, "//*[contains(text(),'phone number ending in')]")))
+                    remember_device = driver.find_elements_by_id('auth-mfa-remember-device')
+                    if remember_device:
+                        remember_device[0].click()
+
+                    sent_to_text = driver.find_element_by_xpath("//*[contains(text(),'phone number ending in')]").text
+                    LOGGER.info(sent_to_text)
+                    LOGGER.info('Enter OTP here:')
+                    otp = input()
+
+                    driver.find_element_by_id('auth-mfa-otpcode').send_keys(otp)
+                    utils.pace.think()
+                    driver.find_element_by_id('auth-signin-button').click()
+                    utils.pace.after_click()
+                except TimeoutException:
+                    pass
+
+                try:  # OTP email validation
+                    WebDriverWait(driver, 5).until(expected_conditions.element_to_be_clickable((By.XPATH, "//*[contains(text(),'One Time Pass')]")))
+                    otp_email = True
+                except TimeoutException:
+                    otp_email = False
+
+                try:
+                    driver.find_element_by_xpath("//*[contains(text(),'one-time pass')]").click()
+                    utils.pace.after_click()
+                    otp_email = True
+                except common.exceptions.NoSuchElementException:
+                    pass
+
+                if otp_email:
+                    continue_buttons = driver.find_elements_by_id('continue')
+                    if continue_buttons:
+                        continue_buttons[0].click()
+                        utils.pace.after_click()
+
+                    handle_anti_automation_challenge(driver, merchant)
+
+                    try:  # User may have manually advanced to gift card screen or stopped at OTP input. Handle OTP input if on OTP screen.
+                        WebDriverWait(driver, 5).until(expected_conditions.element_to_be_clickable((By.XPATH, "//*[contains(text(),'Enter OTP')]")))
+                        sent_to_text = driver.find_element_by_xpath("//*[contains(text(),'@')]").text
+                        LOGGER.info(sent_to_text)
+                        LOGGER.info('Enter OTP here:')
+                        otp = input()
+
+                        elem = driver.find_element_by_xpath("//input")
+                        elem.send_keys(otp)
+                        utils.pace.type()
+                        elem.send_keys(Keys.TAB)
+                        utils.pace.type()
+                        elem.send_keys(Keys.ENTER)
+                        utils.pace.think()
+                    except TimeoutException:
+                        pass
 
-        try:
-            WebDriverWait(driver, 5).until(expected_conditions.element_to_be_clickable((By.XPATH, "//*[contains(text(),'Not now')]")))
-            driver.find_element_by_xpath("//*[contains(text(),'Not now')]").click()
-            time.sleep(1 + random.random() * 2)
-        except TimeoutException:  # add mobile number page
-            pass
+            try:
+                WebDriverWait(driver, 5).until(expected_conditions.element_to_be_clickable((By.XPATH, "//*[contains(text(),'Not now')]")))
+                driver.find_element_by_xpath("//*[contains(text(),'Not now')]").click()
+                utils.pace.after_click()
+            except TimeoutException:  # add mobile number page
+                pass
 
     # Now expecting to be on checkout page with debit card selection present
-    WebDriverWait(driver, 30).until(utils.AnyExpectedCondition(
-        expected_conditions.element_to_be_clickable((By.XPATH, "//*[contains(text(),'Order Summary')]")),  # Checkout page
-        expected_conditions.element_to_be_clickable((By.XPATH, "//*[contains(text(),'a payment method')]"))  # Another version of the checkout page
-    ))
-
-    if driver.find_elements_by_id('payChangeButtonId'):  # expand list of cards
-        time.sleep(1 + random.random() * 2)
-        driver.find_element_by_id('payChangeButtonId').click()
-        WebDriverWait(driver, 10).until(expected_conditions.element_to_be_clickable((By.XPATH, "//span[contains(text(),'ending in " + merchant.card[-4:] + "')]")))
-
-    if driver.find_elements_by_id('payment-change-link'):  # expand list of cards if prior element did not exist
-        time.sleep(1 + random.random() * 2)
-        driver.find_element_by_id('payment-change-link').click()
-        WebDriverWait(driver, 10).until(expected_conditions.element_to_be_clickable((By.XPATH, "//span[contains(text(),'ending in " + merchant.card[-4:] + "')]")))
-
-    card_selected = False
-    for element in driver.find_elements_by_xpath("//span[contains(text(),'ending in " + merchant.card[-4:] + "')]"):
-        try:  # Amazon has redundant non-clickable elements. This will try each one until one works.
-            time.sleep(1 + random.random() * 2)
-            element.click()
-            card_selected = True
-            break
-        except WebDriverException:
-            pass
-
-    if not card_selected:
-        raise Exception('Unable to find or unable to click on card that has last 4 digits matching config file card.')
+    with utils.span('card_selection'):
+        WebDriverWait(driver, 30).until(utils.AnyExpectedCondition(
+            expected_conditions.element_to_be_clickable((By.XPATH, "//*[contains(text(),'Order Summary')]")),  # Checkout page
+            expected_conditions.element_to_be_clickable((By.XPATH, "//*[contains(text(),'a payment method')]"))  # Another version of the checkout page
+        ))
 
-    if driver.find_elements_by_id('orderSummaryPrimaryActionBtn'):
-        time.sleep(1 + random.random() * 2)
-        driver.find_element_by_id('orderSummaryPrimaryActionBtn').click()  # Click "Use this payment method" button
-    else:  # Find Continue button. There are also non clickable spans with 'Continue' in them so try all of them until one works.
-        for element in driver.find_elements_by_xpath("//span[contains(text(),'Continue')]"):
-            try:
-                time.sleep(1 + random.random() * 2)
-                element.find_element_by_xpath('../..').click()  # the grandparent element of the text is the clickable Continue button
+        change_buttons = driver.find_elements_by_id('payChangeButtonId')
+        if change_buttons:  # expand list of cards
+            utils.pace.think()
+            change_buttons[0].click()
+            WebDriverWait(driver, 10).until(expected_conditions.element_to_be_clickable((By.XPATH, "//span[contains(text(),'ending in " + merchant.card[-4:] + "')]")))
+
+        change_links = driver.find_elements_by_id('payment-change-link')
+        if change_links:  # expand list of cards if prior element did not exist
+            utils.pace.think()
+            change_links[0].click()
+            WebDriverWait(driver, 10).until(expected_conditions.element_to_be_clickable((By.XPATH, "//span[contains(text(),'ending in " + merchant.card[-4:] + "')]")))
+
+        card_selected = False
+        for element in driver.find_elements_by_xpath("//span[contains(text(),'ending in " + merchant.card[-4:] + "')]"):
+            try:  # Amazon has redundant non-clickable elements. This will try each one until one works.
+                utils.pace.think()
+                element.click()
+                card_selected = True
                 break
-            except Exception:
+            except WebDriverException:
                 pass
 
-    WebDriverWait(driver, 10).until(utils.AnyExpectedCondition(
-        expected_conditions.element_to_be_clickable((By.ID, 'submitOrderButtonId')),  # "Place your order" button showing, card ready to be used
-        expected_conditions.element_to_be_clickable((By.ID, 'placeYourOrder')),  # Other checkout page "Place your order" button showing, card ready to be used
-        expected_conditions.element_to_be_clickable((By.XPATH, "//input[@placeholder='ending in " + merchant.card[-4:] + "']"))  # Verify card flow
-    ))
-
-    if driver.find_elements_by_xpath("//input[@placeholder='ending in " + merchant.card[-4:] + "']"):  # Verify card flow
-        elem = driver.find_element_by_xpath("//input[@placeholder='ending in " + merchant.card[-4:] + "']")
-        time.sleep(1 + random.random() * 2)
-        elem.send_keys(merchant.card)
-        time.sleep(1 + random.random() * 2)
-        elem.send_keys(Keys.TAB)
-        time.sleep(1 + random.random() * 2)
-        elem.send_keys(Keys.ENTER)
-
-        time.sleep(10 + random.random() * 2)
-        if driver.find_elements_by_id('orderSummaryPrimaryActionBtn'):
-            driver.find_element_by_id('orderSummaryPrimaryActionBtn').click()  # Click "Use this payment method" button
-        else:  # Find Continue text, the grandparent element of the text is the clickable Continue button
-            driver.find_element_by_xpath("//span[contains(text(),'Continue')]").find_element_by_xpath('../..').click()
+        if not card_selected:
+            raise Exception('Unable to find or unable to click on card that has last 4 digits matching config file card.')
+
+        use_payment_method = driver.find_elements_by_id('orderSummaryPrimaryActionBtn')
+        if use_payment_method:
+            utils.pace.think()
+            use_payment_method[0].click()  # Click "Use this payment method" button
+        else:  # Find Continue button. There are also non clickable spans with 'Continue' in them so try all of them until one works.
+            for element in driver.find_elements_by_xpath("//span[contains(text(),'Continue')]"):
+                try:
+                    utils.pace.think()
+                    element.find_element_by_xpath('../..').click()  # the grandparent element of the text is the clickable Continue button
+                    break
+                except Exception:
+                    pass
 
         WebDriverWait(driver, 10).until(utils.AnyExpectedCondition(
             expected_conditions.element_to_be_clickable((By.ID, 'submitOrderButtonId')),  # "Place your order" button showing, card ready to be used
             expected_conditions.element_to_be_clickable((By.ID, 'placeYourOrder')),  # Other checkout page "Place your order" button showing, card ready to be used
+            expected_conditions.element_to_be_clickable((By.XPATH, "//input[@placeholder='ending in " + merchant.card[-4:] + "']"))  # Verify card flow
         ))
 
-    time.sleep(1 + random.random() * 2)
+        verify_card = driver.find_elements_by_xpath("//input[@placeholder='ending in " + merchant.card[-4:] + "']")
+        if verify_card:  # Verify card flow
+            elem = verify_card[0]
+            utils.pace.type()
+            elem.send_keys(merchant.card)
+            utils.pace.type()
+            elem.send_keys(Keys.TAB)
+            utils.pace.type()
+            elem.send_keys(Keys.ENTER)
+
+            utils.pace.settle(10, jitter=2)
+            use_payment_method = driver.find_elements_by_id('orderSummaryPrimaryActionBtn')
+            if use_payment_method:
+                use_payment_method[0].click()  # Click "Use this payment method" button
+            else:  # Find Continue text, the grandparent element of the text is the clickable Continue button
+                driver.find_element_by_xpath("//span[contains(text(),'Continue')]").find_element_by_xpath('../..').click()
+
+            WebDriverWait(driver, 10).until(utils.AnyExpectedCondition(
+                expected_conditions.element_to_be_clickable((By.ID, 'submitOrderButtonId')),  # "Place your order" button showing, card ready to be used
+                expected_conditions.element_to_be_clickable((By.ID, 'placeYourOrder')),  # Other checkout page "Place your order" button showing, card ready to be used
+            ))
+
+    with utils.span('place_order'):
+        utils.pace.think()
+
+        if not is_order_total_correct(driver, amount):
+            return Result.unverified
+
+        submit_order = driver.find_elements_by_id('submitOrderButtonId')
+        if submit_order:
+            utils.pace.think()
+            submit_order[0].click()  # Click "Place your order" button
+        else:
+            utils.pace.think()
+            driver.find_element_by_id('placeYourOrder').click()  # Other checkout page click "Place your order" button
 
-    if not is_order_total_correct(driver, amount):
-        return Result.unverified
-
-    if driver.find_elements_by_id('submitOrderButtonId'):
-        time.sleep(1 + random.random() * 2)
-        driver.find_element_by_id('submitOrderButtonId').click()  # Click "Place your order" button
-    else:
-        time.sleep(1 + random.random() * 2)
-        driver.find_element_by_id('placeYourOrder').click()  # Other checkout page click "Place your order" button
-
-    try:
-        WebDriverWait(driver, 30).until(expected_conditions.element_to_be_clickable((By.XPATH, "//*[contains(text(), 'your order has been placed') or contains(text(),'Order placed')]")))
-    except TimeoutException:
-        LOGGER.error('Clicked "Place your order" button, but unable to confirm if order was successful.')
-        return Result.unverified
+        try:
+            WebDriverWait(driver, 30).until(expected_conditions.element_to_be_clickable((By.XPATH, "//*[contains(text(), 'your order has been placed') or contains(text(),'Order placed')]")))
+        except TimeoutException:
+            LOGGER.error('Clicked "Place your order" button, but unable to confirm if order was successful.')
+            return Result.unverified
 
-    if driver.find_elements_by_xpath("//*[contains(text(), 'your order has been placed') or contains(text(),'Order placed')]"):
-        return Result.success
-    else:
-        LOGGER.error('Clicked "Place your order" button, but unable to confirm if order was successful.')
-        return Result.unverified
+        if driver.find_elements_by_xpath("//*[contains(text(), 'your order has been placed') or contains(text(),'Order placed')]"):
+            return Result.success
+        else:
+            LOGGER.error('Clicked "Place your order" button, but unable to confirm if order was successful.')
+            return Result.unverified
 
 
+@utils.span('captcha')
 def handle_anti_automation_challenge(driver, merchant):
     try:
         WebDriverWait(driver, 5).until(expected_conditions.element_to_be_clickable((By.XPATH, "//*[contains(text(),'nter the characters')]")))
 
-        time.sleep(1 + random.random() * 2)
-        if driver.find_elements_by_id('ap_password'):
-            driver.find_element_by_id('ap_password').send_keys(merchant.psw)
+        utils.pace.think()
+        passwords = driver.find_elements_by_id('ap_password')
+        if passwords:
+            passwords[0].send_keys(merchant.psw)
 
         LOGGER.info('amazon captcha detected')
         input('''
@@ -1,6 +1,4 @@
 import logging
-import random
-import time
 
 from selenium import common
 from selenium.common.exceptions import TimeoutException
@@ -13,97 +11,104 @@ import utils
 from result import Result
 
 LOGGER = logging.getLogger('debbit')
+COOKIE_DOMAINS = ['att.com']  # cookies from other domains, e.g. ads and trackers, aren't saved
 
 # Written by reddit user reddit.com/u/jonnno_
 
 
 def web_automation(driver, merchant, amount):
-    driver.get('https://www.att.com/my/#/passthrough/overview')
+    with utils.span('login'):
+        driver.get('https://www.att.com/my/#/passthrough/overview')
 
-    # Wait until login screen, promotion pop-up, or account dashboard shows.
-    WebDriverWait(driver, 120).until(utils.AnyExpectedCondition(
-        expected_conditions.element_to_be_clickable((By.NAME, "password")),  # logged out
-        expected_conditions.element_to_be_clickable((By.XPATH, "//*[contains(@id,'ancel')]")),  # mfa flow identified by cancel button
-        expected_conditions.element_to_be_clickable((By.XPATH, "//img[contains(@src,'btnNoThanks')]")),  # logged in
-        expected_conditions.element_to_be_clickable((By.XPATH, "//button[contains(text(),'Make a payment')]"))  # logged in
-    ))
+        # Wait until login screen, promotion pop-up, or account dashboard shows.
+        WebDriverWait(driver, 120).until(utils.AnyExpectedCondition(
+            expected_conditions.element_to_be_clickable((By.NAME, "password")),  # logged out
+            expected_conditions.element_to_be_clickable((By.XPATH, "//*[contains(@id,'ancel')]")),  # mfa flow identified by cancel button
+            expected_conditions.element_to_be_clickable((By.XPATH, "//img[contains(@src,'btnNoThanks')]")),  # logged in
+            expected_conditions.element_to_be_clickable((By.XPATH, "//button[contains(text(),'Make a payment')]"))  # logged in
+        ))
 
-    handle_mfa_code_flow(driver)
+        handle_mfa_code_flow(driver)
 
-    time.sleep(1 + random.random() * 2)  # AT&T is using bot detection software, slow down the automation a bit to help avoid detection
-    if driver.find_elements_by_name('password'):  # password field found, need to log in
-        try:
-            driver.find_element_by_id('userID').send_keys(merchant.usr)
-            time.sleep(1 + random.random() * 2)
-        except common.exceptions.NoSuchElementException:
-            pass
+        utils.pace.think()  # AT&T is using bot detection software, slow down the automation a bit to help avoid detection
+        if driver.find_elements_by_name('password'):  # password field found, need to log in
+            try:
+                driver.find_element_by_id('userID').send_keys(merchant.usr)
+                utils.pace.think()
+            except common.exceptions.NoSuchElementException:
+                pass
 
-        driver.find_element_by_name('password').send_keys(merchant.psw)
-        time.sleep(1 + random.random() * 2)
-        driver.find_element_by_xpath("//button[contains(text(),'Sign in')]").click()
+            driver.find_element_by_name('password').send_keys(merchant.psw)
+            utils.pace.think()
+            driver.find_element_by_xpath("//button[contains(text(),'Sign in')]").click()
+
+            try:
+                # Wait for potential promotions screen, regular account overview, or OTP flow
+                WebDriverWait(driver, 120).until(utils.AnyExpectedCondition(
+                    expected_conditions.element_to_be_clickable((By.XPATH, "//img[contains(@src,'btnNoThanks')]")),
+                    expected_conditions.element_to_be_clickable((By.XPATH, "//button[contains(text(),'Make a payment')]")),
+                    expected_conditions.element_to_be_clickable((By.XPATH, "//*[contains(@id,'ancel')]"))  # mfa flow identified by cancel button
+                ))
+            except TimeoutException:
+                pass  # Try continuing to the makePayment page just in case log in worked, but timeout failed
+
+            utils.pace.think()
+            handle_mfa_code_flow(driver)
+
+    with utils.span('payment_page'):
+        driver.get("https://www.att.com/my/#/makePayment")
+
+        WebDriverWait(driver, 20).until(expected_conditions.element_to_be_clickable((By.ID, "MAP_Amount_TextField")))
+        utils.pace.think()
+
+        cur_balance_html_text = driver.find_element_by_xpath("//span[contains(text(), 'Balance due')]").text
+        cur_balance = cur_balance_html_text.split('$')[1]
+        if utils.str_to_cents(cur_balance) == 0:
+            LOGGER.warning('AT&T balance is zero, will try again later.')
+            return Result.skipped
+        elif utils.str_to_cents(cur_balance) < amount:
+            amount = utils.str_to_cents(cur_balance)
+
+    with utils.span('card_selection'):
+        elem = driver.find_element_by_id('MAP_Amount_TextField')
+        elem.clear()
+        utils.pace.type()
+        elem.send_keys(utils.cents_to_str(amount))
+        utils.pace.think()
+        debit_or_credit = driver.find_elements_by_xpath("//*[contains(text(),'Debit or credit card')]")
+        if debit_or_credit:
+            debit_or_credit[0].click()
+            utils.pace.after_click()
+        driver.find_element_by_xpath("//input[@value='" + merchant.card + "']").click()
+        utils.pace.after_click()
+    with utils.span('place_order'):
+        driver.find_element_by_xpath("//*[contains(text(),'Pay $" + utils.cents_to_str(amount) + "')]").click()
+        utils.pace.after_click()
 
         try:
-            # Wait for potential promotions screen, regular account overview, or OTP flow
             WebDriverWait(driver, 120).until(utils.AnyExpectedCondition(
-                expected_conditions.element_to_be_clickable((By.XPATH, "//img[contains(@src,'btnNoThanks')]")),
-                expected_conditions.element_to_be_clickable((By.XPATH, "//button[contains(text(),'Make a payment')]")),
-                expected_conditions.element_to_be_clickable((By.XPATH, "//*[contains(@id,'ancel')]"))  # mfa flow identified by cancel button
+                expected_conditions.presence_of_element_located((By.XPATH, "//*[contains(text(),'We got your $" + utils.cents_to_str(amount) + " payment')]")),
+                expected_conditions.presence_of_element_located((By.XPATH, "//*[contains(text(),'multiple payments for the same amount')]"))
             ))
-        except TimeoutException:
-            pass  # Try continuing to the makePayment page just in case log in worked, but timeout failed
 
-        time.sleep(1 + random.random() * 2)
-        handle_mfa_code_flow(driver)
+            if driver.find_elements_by_xpath("//*[contains(text(),'multiple payments for the same amount')]"):
+                LOGGER.info("Duplicate payment amount not accepted within 24 hours. Trying again later. Please use a larger range between amount_min and amount_max in config.txt for att_bill_pay to avoid duplicate payment amount scenarios.")
+                return Result.skipped
+            elif driver.find_elements_by_xpath("//*[text()='We got your $ + " + utils.cents_to_str(amount) + " payment']"):
+                return Result.success
+            else:
+                return Result.unverified
 
-    driver.get("https://www.att.com/my/#/makePayment")
-
-    WebDriverWait(driver, 20).until(expected_conditions.element_to_be_clickable((By.ID, "MAP_Amount_TextField")))
-    time.sleep(1 + random.random() * 2)
-
-    cur_balance_html_text = driver.find_element_by_xpath("//span[contains(text(), 'Balance due')]").text
-    cur_balance = cur_balance_html_text.split('$')[1]
-    if utils.str_to_cents(cur_balance) == 0:
-        LOGGER.warning('AT&T balance is zero, will try again later.')
-        return Result.skipped
-    elif utils.str_to_cents(cur_balance) < amount:
-        amount = utils.str_to_cents(cur_balance)
-
-    elem = driver.find_element_by_id('MAP_Amount_TextField')
-    elem.clear()
-    time.sleep(1 + random.random() * 2)
-    elem.send_keys(utils.cents_to_str(amount))
-    time.sleep(1 + random.random() * 2)
-    if driver.find_elements_by_xpath("//*[contains(text(),'Debit or credit card')]"):
-        driver.find_element_by_xpath("//*[contains(text(),'Debit or credit card')]").click()
-        time.sleep(1 + random.random() * 2)
-    driver.find_element_by_xpath("//input[@value='" + merchant.card + "']").click()
-    time.sleep(1 + random.random() * 2)
-    driver.find_element_by_xpath("//*[contains(text(),'Pay $" + utils.cents_to_str(amount) + "')]").click()
-    time.sleep(1 + random.random() * 2)
-
-    try:
-        WebDriverWait(driver, 120).until(utils.AnyExpectedCondition(
-            expected_conditions.presence_of_element_located((By.XPATH, "//*[contains(text(),'We got your $" + utils.cents_to_str(amount) + " payment')]")),
-            expected_conditions.presence_of_element_located((By.XPATH, "//*[contains(text(),'multiple payments for the same amount')]"))
-        ))
-
-        if driver.find_elements_by_xpath("//*[contains(text(),'multiple payments for the same amount')]"):
-            LOGGER.info("Duplicate payment amount not accepted within 24 hours. Trying again later. Please use a larger range between amount_min and amount_max in config.txt for att_bill_pay to avoid duplicate payment amount scenarios.")
-            return Result.skipped
-        elif driver.find_elements_by_xpath("//*[text()='We got your $ + " + utils.cents_to_str(amount) + " payment']"):
-            return Result.success
-        else:
-            return Result.unverified
-
-    except (KeyboardInterrupt, SystemExit):
-        raise
-    except Exception:
-        return Result.unverified  # Purchase command was executed, yet we are unable to verify that it was successfully executed.
-        # since debbit may have spent money but isn't sure, we log the error and stop any further payments for this merchant until the user intervenes
+        except (KeyboardInterrupt, SystemExit):
+            raise
+        except Exception:
+            return Result.unverified  # Purchase command was executed, yet we are unable to verify that it was successfully executed.
+            # since debbit may have spent money but isn't sure, we log the error and stop any further payments for this merchant until the user intervenes
 
-    return Result.success
+        return Result.success
 
 
+@utils.span('mfa')
 def handle_mfa_code_flow(driver):
     if driver.find_elements_by_id('submitDest'):  # MFA flow
         LOGGER.info('One time multi-factor auth required. This will not happen after the first debbit run.')
@@ -116,9 +121,10 @@ def handle_mfa_code_flow(driver):
 
             if multi_mfa_options:
                 mfa_options = {}
+                labels = utils.locate(driver, *[(By.ID, 'm' + str(i) + 'label') for i in range(1, 10)])
                 for i in range(1, 10):
-                    if driver.find_elements_by_id('m' + str(i) + 'label'):
-                        mfa_options[i] = driver.find_element_by_id('m' + str(i) + 'label').text
+                    if labels[i - 1]['present']:
+                        mfa_options[i] = labels[i - 1]['element'].text
                 LOGGER.info('')
                 LOGGER.info('Choose a multi-factor authentication option.')
                 for k, v in mfa_options.items():
@@ -127,9 +133,9 @@ def handle_mfa_code_flow(driver):
                 user_mfa_choice_input = input()    # TODO put timeout around this
                 user_mfa_choice_index = ''.join([c for c in user_mfa_choice_input if c.isdigit()])  # sanitize input to remove all non digit characters
                 driver.find_element_by_id('m' + user_mfa_choice_index + 'label').click()
-                time.sleep(1 + random.random() * 2)
+                utils.pace.after_click()
 
-            time.sleep(1 + random.random() * 2)
+            utils.pace.think()
             driver.find_element_by_id("submitDest").click()
             WebDriverWait(driver, 20).until(expected_conditions.element_to_be_clickable((By.ID, "codeValue")))
             LOGGER.info('Enter OTP here: ')
@@ -137,7 +143,7 @@ def handle_mfa_code_flow(driver):
 
             elem = driver.find_element_by_id("codeValue")
             elem.send_keys(otp)
-            time.sleep(1 + random.random() * 2)
+            utils.pace.think()
             driver.find_element_by_xpath("//*[contains(@id,'ubmit')]").click()  # submit or Submit button
 
             WebDriverWait(driver, 120).until(utils.AnyExpectedCondition(
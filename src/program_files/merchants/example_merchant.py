@@ -1,5 +1,4 @@
 import logging
-import time
 
 from selenium.common.exceptions import TimeoutException, ElementNotInteractableException
 from selenium.webdriver.common.by import By
@@ -11,6 +10,11 @@ from result import Result
 
 LOGGER = logging.getLogger('debbit')
 
+COOKIE_DOMAINS = ['jakehilborn.github.io']  # cookies from other domains, e.g. ads and trackers, aren't saved
+
+# benchmark.py points this at a local copy of the example merchant pages
+BASE_URL = 'https://jakehilborn.github.io/debbit/example-merchant/'
+
 '''
 How to add a new merchant module to debbit
 
@@ -19,12 +23,29 @@ the name of your new file (excluding .py). The file must have a function with th
 `def web_automation(driver, merchant, amount):` that returns a `Result` in all possible scenarios. In error scenarios, you
 may return Result.failed or simply let whatever exception be thrown. It will be caught and handled correctly by debbit.py
 
+Set COOKIE_DOMAINS to the domains the website logs in and pays on. Only cookies for these domains and their subdomains
+are saved between runs. Leave it out to save every cookie.
+
+Optionally add `def preflight(session, merchant):` for websites where a purchase is often skipped, e.g. a bill that's
+already paid. It gets a plain HTTP session with the saved cookies and returns Result.skipped if web_automation() would
+skip anyway, so debbit doesn't start Firefox, or None to go ahead. Only return Result.skipped when the page leaves no
+doubt, a logged out session or a page that has changed should return None.
+
 For more complex scenarios, please refer to the other merchant .py files.
 '''
 
 
+def preflight(session, merchant):
+    page = session.get(BASE_URL + 'payment.html')
+    cur_balance = page.text_containing('span', '$')
+    if cur_balance is not None and utils.str_to_cents(cur_balance) == 0:
+        LOGGER.info('example_merchant balance is zero, will try again later.')
+        return Result.skipped
+    return None
+
+
 def web_automation(driver, merchant, amount):
-    driver.get('https://jakehilborn.github.io/debbit/example-merchant/login.html')
+    driver.get(BASE_URL + 'login.html')
 
     logged_in = utils.is_logged_in(driver, timeout=90,
        logged_out_element=(By.ID, 'password'),
@@ -32,16 +53,16 @@ def web_automation(driver, merchant, amount):
     )
 
     if not logged_in:
-        time.sleep(2)  # pause to let user watch what's happening - not necessary for real merchants
+        utils.pace.watch(2)
 
         try:  # some websites will have the username auto-filled in due to a previous login
             driver.find_element_by_id('username').send_keys(merchant.usr)
         except ElementNotInteractableException:
             pass
 
-        time.sleep(2)  # pause to let user watch what's happening - not necessary for real merchants
+        utils.pace.watch(2)
         driver.find_element_by_id('password').send_keys(merchant.usr)
-        time.sleep(2)  # pause to let user watch what's happening - not necessary for real merchants
+        utils.pace.watch(2)
         driver.find_element_by_id('login').click()
         WebDriverWait(driver, 30).until(expected_conditions.element_to_be_clickable((By.ID, 'submit-payment')))
 
@@ -52,11 +73,11 @@ def web_automation(driver, merchant, amount):
     elif utils.str_to_cents(cur_balance) < amount:
         amount = utils.str_to_cents(cur_balance)
 
-    time.sleep(2)  # pause to let user watch what's happening - not necessary for real merchants
+    utils.pace.watch(2)
     driver.find_element_by_xpath("//*[contains(text(), 'card ending in " + merchant.card + "')]").click()
-    time.sleep(2)  # pause to let user watch what's happening - not necessary for real merchants
+    utils.pace.watch(2)
     driver.find_element_by_id('amount').send_keys(utils.cents_to_str(amount))
-    time.sleep(2)  # pause to let user watch what's happening - not necessary for real merchants
+    utils.pace.watch(2)
     driver.find_element_by_id('submit-payment').click()
 
     try:
@@ -65,5 +86,5 @@ def web_automation(driver, merchant, amount):
         return Result.unverified  # Purchase command was executed, yet we are unable to verify that it was successfully executed.
         # since debbit may have spent money but isn't sure, we log the error and stop any further payments for this merchant until the user intervenes
 
-    time.sleep(5)  # sleep for a bit to show user that payment screen is reached
+    utils.pace.watch(5)  # show user that payment screen is reached, skipped by the fast pacing profile
     return Result.success
@@ -10,6 +10,7 @@ from result import Result
 import utils
 
 LOGGER = logging.getLogger('debbit')
+COOKIE_DOMAINS = ['optimum.net']  # cookies from other domains, e.g. ads and trackers, aren't saved
 
 # Written by reddit user reddit.com/u/TNSepta, PM for any bugs or issues.
 
@@ -0,0 +1,82 @@
+import logging
+import time
+from threading import BoundedSemaphore, Lock
+
+LOGGER = logging.getLogger('debbit')
+
+
+# Limits how many purchases run at the same time. max_purchases caps purchases across all merchants and
+# merchant_limits caps purchases per merchant, e.g. {'amazon_gift_card_reload': 1} allows one Amazon purchase at a time
+# while xfinity_bill_pay and att_bill_pay purchases run in parallel with it. Merchants not listed in merchant_limits
+# default to default_merchant_limit.
+#
+# Usage:
+#
+# PURCHASE_EXECUTOR.acquire(merchant)
+# try:
+#     ... make purchase ...
+# finally:
+#     PURCHASE_EXECUTOR.release(merchant)
+class PurchaseExecutor:
+    def __init__(self, max_purchases=1, merchant_limits=None, default_merchant_limit=1):
+        self.max_purchases = max_purchases
+        self.merchant_limits = merchant_limits or {}
+        self.default_merchant_limit = default_merchant_limit
+
+        self.global_semaphore = BoundedSemaphore(max_purchases)
+        self.merchant_semaphores = {}
+        self.lock = Lock()
+
+        self.running = set()  # merchant ids currently holding a purchase slot
+        self.waiting = set()  # merchant ids waiting for a purchase slot
+        self.total_wait_secs = 0.0
+        self.acquisitions = 0
+
+    def acquire(self, merchant):
+        start = time.time()
+        with self.lock:
+            self.waiting.add(merchant.id)
+
+        merchant_semaphore = self._merchant_semaphore(merchant.name)
+        merchant_semaphore.acquire()  # acquire the merchant slot first so waiting on a busy merchant doesn't hold a global slot
+        try:
+            self.global_semaphore.acquire()
+        except BaseException:
+            merchant_semaphore.release()
+            raise
+        finally:
+            with self.lock:
+                self.waiting.discard(merchant.id)
+
+        wait_secs = time.time() - start
+        with self.lock:
+            self.running.add(merchant.id)
+            self.total_wait_secs += wait_secs
+            self.acquisitions += 1
+
+        if wait_secs >= 1:
+            LOGGER.info('Waited ' + str(int(wait_secs)) + ' seconds for a free purchase slot', extra={'duration': wait_secs})
+
+    def release(self, merchant):
+        with self.lock:
+            self.running.discard(merchant.id)
+
+        self.global_semaphore.release()
+        self._merchant_semaphore(merchant.name).release()
+
+    # Running and waiting merchant ids plus wait totals, copied under the lock for the status server
+    def snapshot(self):
+        with self.lock:
+            return {
+                'running': sorted(self.running),
+                'waiting': sorted(self.waiting),
+                'acquisitions': self.acquisitions,
+                'wait_secs': round(self.total_wait_secs, 3)
+            }
+
+    def _merchant_semaphore(self, merchant_name):
+        with self.lock:
+            if merchant_name not in self.merchant_semaphores:
+                limit = self.merchant_limits.get(merchant_name, self.default_merchant_limit)
+                self.merchant_semaphores[merchant_name] = BoundedSemaphore(max(1, int(limit)))
+            return self.merchant_semaphores[merchant_name]
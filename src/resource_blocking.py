@@ -0,0 +1,107 @@
+import base64
+import json
+import os
+import sqlite3
+import time
+
+import cookie_db
+
+CATEGORIES = ['images', 'media', 'fonts', 'trackers']
+
+# Analytics, ad and session replay hosts seen on merchant checkout pages. A host also blocks its subdomains.
+TRACKER_HOSTS = [
+    'google-analytics.com', 'googletagmanager.com', 'googletagservices.com', 'doubleclick.net', 'googleadservices.com',
+    'googlesyndication.com', 'amazon-adsystem.com', 'connect.facebook.net', 'bat.bing.com', 'ads-twitter.com',
+    'analytics.twitter.com', 'ads.linkedin.com', 'snap.licdn.com', 'ct.pinterest.com', 'sc-static.net',
+    'tr.snapchat.com', 'demdex.net', 'omtrdc.net', 'everesttech.net', 'tiqcdn.com', 'ensighten.com',
+    'quantummetric.com', 'hotjar.com', 'mouseflow.com', 'fullstory.com', 'clarity.ms', 'crazyegg.com',
+    'optimizely.com', 'nr-data.net', 'js-agent.newrelic.com', 'siteintercept.qualtrics.com', 'krxd.net',
+    'scorecardresearch.com', 'adsrvr.org', 'criteo.com', 'criteo.net', 'taboola.com', 'outbrain.com',
+    'mathtag.com', 'rlcdn.com', 'agkn.com', 'adnxs.com', 'rubiconproject.com', 'pubmatic.com', 'casalemedia.com'
+]
+
+PERMISSIONS_SCHEMA_VERSION = 12  # Firefox upgrades an older permissions.sqlite the first time it opens it
+CREATE_PERMISSIONS_TABLES = [
+    'CREATE TABLE IF NOT EXISTS moz_perms (id INTEGER PRIMARY KEY, origin TEXT, type TEXT, permission INTEGER, expireType INTEGER, expireTime INTEGER, modificationTime INTEGER)',
+    'CREATE TABLE IF NOT EXISTS moz_hosts (id INTEGER PRIMARY KEY, host TEXT, type TEXT, permission INTEGER, expireType INTEGER, expireTime INTEGER, modificationTime INTEGER, isInBrowserElement INTEGER)'
+]
+ALLOW = 1
+
+
+# Keeps Firefox from downloading what a purchase doesn't need, which is most of what a merchant's pages load. Opt-in in
+# config.txt, per merchant with advanced: resource_blocking.
+#
+# images   - permissions.default.image blocks every image except from allowed hosts, which get an image permission in
+#            the profile's permissions.sqlite. Merchants list the hosts their captchas are served from.
+# media    - no autoplay and no preloading of audio and video
+# fonts    - web fonts aren't downloaded, pages use the system fonts
+# trackers - requests to TRACKER_HOSTS and the merchant's extra blocked hosts fail right away. A proxy auto-config
+#            script that sends them to a closed port does the blocking, so a host also blocks its subdomains.
+#
+# Allowed hosts are never blocked as trackers either. Firefox profile preferences do all of this instead of the
+# selenium-cookies-extension because the extension is signed by Mozilla and can't be changed without signing it again.
+#
+# Every preference is always set, to Firefox's default when its category isn't blocked, so turning blocking off also
+# turns it off in a persistent profile that kept the earlier values in its prefs.js.
+def preferences(block, allowed_hosts, blocked_hosts):
+    prefs = dict(DEFAULT_PREFERENCES)
+    if 'images' in block:
+        prefs['permissions.default.image'] = 2
+    if 'media' in block:
+        prefs['media.autoplay.default'] = 5
+        prefs['media.preload.default'] = 0
+        prefs['media.preload.auto'] = 0
+    if 'fonts' in block:
+        prefs['gfx.downloadable_fonts.enabled'] = False
+        prefs['browser.display.use_document_fonts'] = 0
+    if 'trackers' in block:
+        hosts = [host for host in TRACKER_HOSTS + blocked_hosts if not any([cookie_db.domain_matches(host, allowed) for allowed in allowed_hosts])]
+        prefs['network.proxy.type'] = 2
+        prefs['network.proxy.autoconfig_url'] = 'data:application/x-ns-proxy-autoconfig;base64,' + base64.b64encode(proxy_auto_config(hosts).encode('utf-8')).decode('ascii')
+    return prefs
+
+
+DEFAULT_PREFERENCES = {
+    'permissions.default.image': 1,
+    'media.autoplay.default': 1,
+    'media.preload.default': 1,
+    'media.preload.auto': 2,
+    'gfx.downloadable_fonts.enabled': True,
+    'browser.display.use_document_fonts': 1,
+    'network.proxy.type': 5,  # use the system proxy settings
+    'network.proxy.autoconfig_url': ''
+}
+
+
+# Sends requests to the hosts and their subdomains to port 9 on localhost, which refuses the connection immediately
+def proxy_auto_config(hosts):
+    return ('function FindProxyForURL(url, host) {'
+            ' var blocked = ' + json.dumps(sorted(set(host.lower() for host in hosts))) + ';'
+            ' for (var i = 0; i < blocked.length; i++) {'
+            '  if (host == blocked[i] || dnsDomainIs(host, "." + blocked[i])) return "PROXY 127.0.0.1:9";'
+            ' }'
+            ' return "DIRECT";'
+            '}')
+
+
+# Lets images load from the hosts and their subdomains while permissions.default.image blocks the rest. Keeps any
+# permissions already in the profile, e.g. in a persistent profile.
+def write_image_permissions(profile_dir, hosts):
+    path = os.path.join(profile_dir, 'permissions.sqlite')
+    now_ms = int(time.time() * 1000)
+
+    db = sqlite3.connect(path)
+    try:
+        for statement in CREATE_PERMISSIONS_TABLES:
+            db.execute(statement)
+        if not db.execute('PRAGMA user_version').fetchone()[0]:
+            db.execute('PRAGMA user_version = ' + str(PERMISSIONS_SCHEMA_VERSION))
+
+        for host in hosts:
+            for scheme in ['https', 'http']:
+                origin = scheme + '://' + host.lstrip('.').lower()
+                db.execute("DELETE FROM moz_perms WHERE origin = ? AND type = 'image'", (origin,))
+                db.execute("INSERT INTO moz_perms (origin, type, permission, expireType, expireTime, modificationTime) VALUES (?, 'image', ?, 0, 0, ?)", (origin, ALLOW, now_ms))
+        db.commit()
+    finally:
+        db.close()
@@ -0,0 +1,131 @@
+import http.client
+import os
+import traceback
+from threading import Lock
+
+import yaml  # PyYAML
+from selenium.common.exceptions import InvalidSessionIdException, NoSuchWindowException, SessionNotCreatedException, TimeoutException, WebDriverException
+
+# Why a purchase attempt failed, each class is retried on its own schedule:
+#
+# network        - the page didn't load, e.g. a page load timeout or Firefox's "problem loading page". Usually gone in
+#                  minutes.
+# page_changed   - the page loaded but didn't look like the merchant code expects, e.g. a missing element or a wait that
+#                  timed out. Anything not recognized as another class. Rarely fixes itself, so retries are spaced out.
+# browser_crash  - Firefox or geckodriver died. Retried soon with a new Firefox.
+# auth_challenge - a wait timed out during multi-factor auth or a captcha, e.g. nobody entered the code. Retrying
+#                  quickly makes more challenges likely. Missing elements there are page_changed like anywhere else.
+FAILURE_CLASSES = ['network', 'page_changed', 'browser_crash', 'auth_challenge']
+
+# Seconds to wait before each retry. Each class counts its own failures of the purchase, so a merchant stops once one
+# class has failed one more time than it has delays. page_changed is the 1min, 16min, 1.3hr, 4.3hr schedule every
+# failure used to get.
+BACKOFF = {
+    'network': [60, 300, 900, 3600],
+    'page_changed': [60, 960, 4860, 15360],
+    'browser_crash': [30, 300, 1800, 7200],
+    'auth_challenge': [3600, 21600]
+}
+
+AUTH_STEPS = ['mfa', 'captcha']  # utils.span names merchants use for auth challenges
+
+# Firefox and geckodriver messages for a page that didn't load, and for a browser that is gone
+NETWORK_ERRORS = ['about:neterror', 'Reached error page', 'Timeout loading page']
+CRASH_ERRORS = ['Failed to decode response from marionette', 'Tried to run command without establishing a connection',
+                'Browsing context has been discarded', 'Browser has closed', 'invalid session id']
+
+
+# One of FAILURE_CLASSES for an exception from web_automation(), or None for a Result.failed it returned. span is the
+# utils.span path the exception was raised in, if any.
+def classify(exception, span=None):
+    if exception is None:
+        return 'page_changed'
+
+    if isinstance(exception, (InvalidSessionIdException, NoSuchWindowException, SessionNotCreatedException)):
+        return 'browser_crash'
+    if isinstance(exception, (ConnectionError, http.client.HTTPException)) or type(exception).__module__.startswith('urllib3'):
+        return 'browser_crash'  # the connection to geckodriver, the merchant's website is only reached through Firefox
+
+    message = str(getattr(exception, 'msg', None) or exception)
+    if isinstance(exception, WebDriverException) and any([error in message for error in CRASH_ERRORS]):
+        return 'browser_crash'
+    if isinstance(exception, WebDriverException) and any([error in message for error in NETWORK_ERRORS]):
+        return 'network'
+
+    # Firefox reports its page load timeout through geckodriver, WebDriverWait and utils' waits raise in Python
+    if isinstance(exception, TimeoutException) and from_browser(exception):
+        return 'network'
+    if isinstance(exception, TimeoutException) and span and span.split('/')[-1] in AUTH_STEPS:
+        return 'auth_challenge'
+    return 'page_changed'
+
+
+def from_browser(exception):
+    return any([frame.filename.replace('\\', '/').endswith('remote/errorhandler.py') for frame in traceback.extract_tb(exception.__traceback__)])
+
+
+# Seconds to wait before retrying after the class's failures-th failure of the purchase, or None once the class has no
+# retries left
+def backoff_secs(backoff, failure_class, failures):
+    delays = backoff[failure_class]
+    return delays[failures - 1] if failures <= len(delays) else None
+
+
+# {failure class: failures} of a retry, a copy. Retries saved before classes were counted separately count every
+# failure as the latest class.
+def class_failures(retry):
+    if not retry:
+        return {}
+    return dict(retry.get('class_failures') or {retry['failure_class']: retry['failures']})
+
+
+# Persists each merchant's pending retry to state/retries.txt so a restart waits out the same backoff instead of
+# retrying right away, or starting over with a fresh plan. A retry is a plain dict:
+#
+# failures: failed attempts in a row for this purchase
+# class_failures: {failure class: failures} of those attempts, each class's count picks its delay
+# failure_class: class of the latest failure, which set retry_time
+# retry_time: unix time of the next attempt, human_time is the same for people
+# slot_start: unix time the burst (or spread purchase) started
+# remaining: purchases of the burst left to make, including the one being retried
+#
+# A merchant's retry is removed once the purchase succeeds, is skipped or is given up on.
+class RetryStore:
+    def __init__(self, directory):
+        self.directory = directory
+        self.lock = Lock()
+        self.retries = None  # merchant_id -> retry, read on first use
+
+    def get(self, merchant_id):
+        with self.lock:
+            return self._load().get(merchant_id)
+
+    def put(self, merchant_id, retry):
+        with self.lock:
+            self._load()[merchant_id] = retry
+            self._save()
+
+    def remove(self, merchant_id):
+        with self.lock:
+            if self._load().pop(merchant_id, None) is not None:
+                self._save()
+
+    def filename(self):
+        return os.path.join(self.directory, 'retries.txt')
+
+    def _load(self):
+        if self.retries is None:
+            try:
+                with open(self.filename(), 'r', encoding='utf-8') as f:
+                    self.retries = yaml.safe_load(f.read()) or {}
+            except FileNotFoundError:
+                self.retries = {}
+        return self.retries
+
+    def _save(self):
+        if not os.path.exists(self.directory):
+            os.makedirs(self.directory)
+
+        with open(self.filename() + '.tmp', 'w', encoding='utf-8') as f:
+            f.write(yaml.dump(self.retries))
+        os.replace(self.filename() + '.tmp', self.filename())
@@ -0,0 +1,93 @@
+import heapq
+import itertools
+import logging
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from threading import Condition, Thread
+
+from clock import SystemClock
+
+LOGGER = logging.getLogger('debbit')
+
+
+# One thread that sleeps until the earliest scheduled job is due and then hands the job to a worker thread. Replaces
+# a thread per merchant waking up every few minutes and a chain of threading.Timer threads.
+#
+# Jobs are plain functions, schedule(due, job, *args) runs job(*args) at unix time due. A job that wants to run again
+# schedules itself before returning. Worker threads are only started when that many jobs are running at once, so
+# max_workers bounds the thread count rather than setting it.
+#
+# The wait is capped at max_sleep seconds because a laptop that sleeps stops the clock Condition.wait() uses. Waking
+# up every max_sleep seconds to compare the wall clock against the next due time costs nothing compared to re-reading
+# state for every merchant.
+#
+# simulate.py runs jobs on its own thread with a VirtualClock, calling pop_next() and advancing the clock to each job's
+# due time instead of calling start().
+class Scheduler:
+    def __init__(self, max_workers=1, max_sleep=300, clock=None):
+        self.max_workers = max_workers
+        self.max_sleep = max_sleep
+        self.clock = clock or SystemClock()
+
+        self.queue = []  # heap of (due, sequence number, job, args)
+        self.sequence = itertools.count()  # breaks ties between jobs due at the same time in the order they were scheduled
+        self.condition = Condition()
+        self.workers = None
+        self.thread = None
+
+    def schedule(self, due, job, *args):
+        with self.condition:
+            heapq.heappush(self.queue, (due, next(self.sequence), job, args))
+            self.condition.notify()  # the new job may be due before the one the scheduler is sleeping until
+
+    def start(self):
+        self.workers = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='debbit-worker')
+        self.thread = Thread(target=self.run, name='debbit-scheduler')
+        self.thread.start()
+
+    def run(self):
+        while True:
+            for job, args in self.wait_for_due_jobs():
+                self.workers.submit(run_job, job, args)
+
+    def wait_for_due_jobs(self):
+        with self.condition:
+            while True:
+                now = self.clock.time()
+                if self.queue and self.queue[0][0] <= now:
+                    due_jobs = []
+                    while self.queue and self.queue[0][0] <= now:
+                        due, sequence, job, args = heapq.heappop(self.queue)
+                        due_jobs.append((job, args))
+                    return due_jobs
+
+                timeout = self.max_sleep
+                if self.queue:
+                    timeout = min(timeout, self.queue[0][0] - now)
+                self.condition.wait(timeout)
+
+    # Removes and returns the earliest (due, job, args) without waiting for it to be due, or None if nothing is scheduled
+    def pop_next(self):
+        with self.condition:
+            if not self.queue:
+                return None
+            due, sequence, job, args = heapq.heappop(self.queue)
+            return due, job, args
+
+    # [(due, job, args)] of every scheduled job, earliest first, without removing them
+    def jobs(self):
+        with self.condition:
+            return [(due, job, args) for due, sequence, job, args in sorted(self.queue)]
+
+    def next_due(self):
+        with self.condition:
+            return self.queue[0][0] if self.queue else None
+
+
+def run_job(job, args):
+    try:
+        job(*args)
+    except SystemExit:
+        pass  # job asked to stop running, it won't be scheduled again
+    except Exception:
+        LOGGER.error('Scheduled job ' + job.__name__ + ' stopped: ' + traceback.format_exc())
@@ -0,0 +1,264 @@
+#!/usr/bin/env python3
+# Runs debbit's scheduling for whole months in a few seconds. Synthetic merchants with randomized configs are planned
+# and purchased against a VirtualClock by the same run_plan(), burst_purchase() and web_automation_wrapper() code
+# debbit runs, except that web_automation() is a stub that never opens Firefox. Use it as a regression benchmark
+# before and after changing anything that decides when purchases happen.
+#
+# python simulate.py --merchants 300 --mode burst --months 2 --seed 1 --json simulation.json
+#
+# --fail-rate makes that fraction of attempts return Result.failed, which are retried as scheduled jobs with the
+# page_changed backoff like real failures. Failure reports aren't written.
+#
+# Reports scheduler CPU time, bytes of state read and written, wakeups per merchant, every merchant that did not
+# make total_purchases purchases between min_day and max_day, and every merchant whose wakeup didn't leave exactly one
+# future job, e.g. one that ran again right away after a skip. Exits with status 1 if any merchant missed or misscheduled.
+import argparse
+import json
+import logging
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import debbit
+from clock import VirtualClock
+from metrics import LiveStats, MetricsStore
+from planner import PlanStore
+from purchase_executor import PurchaseExecutor
+from retries import RetryStore
+from result import Result
+from scheduler import Scheduler, run_job
+from state import StateStore, SqliteStateStore
+from webdriver_pool import WebDriverPool
+
+LOGGER = logging.getLogger('debbit')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Simulate debbit scheduling against a virtual clock')
+    parser.add_argument('--merchants', type=int, default=300, help='number of synthetic merchants')
+    parser.add_argument('--mode', choices=['burst', 'spread'], default='burst')
+    parser.add_argument('--start', default=None, help='first simulated month as YYYY-MM, defaults to next month')
+    parser.add_argument('--months', type=int, default=1, help='number of months to simulate')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--skip-rate', type=float, default=0.0, help='fraction of purchases that return Result.skipped')
+    parser.add_argument('--fail-rate', type=float, default=0.0, help='fraction of purchase attempts that return Result.failed')
+    parser.add_argument('--state-backend', choices=['yaml', 'sqlite'], default='yaml')
+    parser.add_argument('--json', help='also write the report to this file')
+    parser.add_argument('--verbose', action='store_true', help="print debbit's log output")
+    args = parser.parse_args()
+
+    logging.basicConfig(format='%(levelname)s: %(asctime)s %(message)s')
+    LOGGER.setLevel(logging.INFO if args.verbose else logging.WARNING)
+    random.seed(args.seed)
+
+    if args.start:
+        start = datetime.strptime(args.start, '%Y-%m')
+    else:
+        now = datetime.now()
+        start = datetime(now.year + 1, 1, 1) if now.month == 12 else datetime(now.year, now.month + 1, 1)
+
+    state_dir = tempfile.mkdtemp(prefix='debbit_simulation_')
+    try:
+        report = simulate(args, start, state_dir)
+    finally:
+        shutil.rmtree(state_dir, ignore_errors=True)
+
+    print_report(report)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+
+    sys.exit(1 if report['missed'] or report['misscheduled'] else 0)
+
+
+def simulate(args, start, state_dir):
+    debbit.CONFIG = debbit.Config(synthetic_config(args.mode, args.merchants))
+    debbit.CLOCK = VirtualClock(start)
+    debbit.SCHEDULER = Scheduler(clock=debbit.CLOCK)
+    if args.state_backend == 'sqlite':
+        debbit.STATE_STORE = SqliteStateStore(state_dir)
+    else:
+        debbit.STATE_STORE = StateStore(state_dir)
+    debbit.PLAN_STORE = PlanStore(state_dir)
+    debbit.RETRY_STORE = RetryStore(state_dir)
+    debbit.METRICS_STORE = MetricsStore(os.path.join(state_dir, 'metrics'))
+    debbit.LIVE_STATS = LiveStats()
+    debbit.PURCHASE_EXECUTOR = PurchaseExecutor(max_purchases=1)
+    debbit.WEB_DRIVER_POOL = WebDriverPool(lambda merchant: None, lambda driver, merchant: None, max_sessions=0, idle_timeout=0)
+    debbit.record_failure = lambda driver, merchant, error_msg, cov: None  # there is no browser to screenshot
+
+    skipped = set()  # merchant_id of merchants whose last attempt returned Result.skipped
+    merchants = []
+    for card, merchant_confs in debbit.CONFIG.cards.items():
+        for merchant_name, merchant_conf in merchant_confs.items():
+            merchants.append(debbit.Merchant(card, merchant_name, stub_web_automation(args.skip_rate, args.fail_rate, skipped), merchant_conf))
+
+    end = month_start(start, args.months)
+    wakeups = {merchant.id: 0 for merchant in merchants}
+    scheduled = {merchant.id: [] for merchant in merchants}  # due times of each merchant's pending jobs
+    misscheduled = set()
+    schedule = debbit.SCHEDULER.schedule
+
+    def schedule_and_count(due, function, *function_args):
+        scheduled[function_args[0].id].append(due)
+        schedule(due, function, *function_args)
+    debbit.SCHEDULER.schedule = schedule_and_count
+
+    for merchant in merchants:
+        debbit.SCHEDULER.schedule(debbit.CLOCK.time(), debbit.run_plan, merchant)
+
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    while True:
+        job = debbit.SCHEDULER.pop_next()
+        if job is None or job[0] >= end.timestamp():
+            break
+
+        due, function, function_args = job
+        merchant_id = function_args[0].id
+        debbit.CLOCK.advance_to(due)
+        wakeups[merchant_id] += 1
+        scheduled[merchant_id].remove(due)
+        run_job(function, function_args)
+
+        # every wakeup leaves one job behind unless the merchant gave up, and a skip is never retried at the same moment
+        if not debbit.LIVE_STATS.is_stopped(merchant_id) and (len(scheduled[merchant_id]) != 1 or (merchant_id in skipped and scheduled[merchant_id][0] <= due)):
+            misscheduled.add(merchant_id)
+        skipped.discard(merchant_id)
+    cpu_secs = time.process_time() - cpu_start
+    wall_secs = time.perf_counter() - wall_start
+
+    results = []
+    for merchant in merchants:
+        months = []
+        for i in range(args.months):
+            month = month_start(start, i)
+            months.append(check_month(merchant, month.year, month.month))
+        results.append({
+            'merchant_id': merchant.id,
+            'total_purchases': merchant.total_purchases,
+            'burst_count': merchant.burst_count,
+            'min_day': merchant.min_day,
+            'max_day': merchant.max_day,
+            'wakeups': wakeups[merchant.id],
+            'months': months
+        })
+
+    state_stats = debbit.STATE_STORE.stats()
+    plan_stats = debbit.PLAN_STORE.stats()
+    purchases = sum([month['purchases'] for result in results for month in result['months']])
+
+    return {
+        'mode': args.mode,
+        'merchants': len(merchants),
+        'start': start.strftime('%Y-%m'),
+        'months': args.months,
+        'seed': args.seed,
+        'skip_rate': args.skip_rate,
+        'fail_rate': args.fail_rate,
+        'failed_attempts': sum([count for (merchant_id, result), count in debbit.LIVE_STATS.attempts.items() if result == 'failed']),
+        'state_backend': args.state_backend,
+        'cpu_secs': round(cpu_secs, 3),
+        'wall_secs': round(wall_secs, 3),
+        'purchases': purchases,
+        'cpu_ms_per_purchase': round(cpu_secs * 1000 / purchases, 3) if purchases else None,
+        'state_bytes_read': state_stats.get('bytes_read', 0),
+        'state_bytes_written': state_stats.get('bytes_written', 0),
+        'plan_bytes_read': plan_stats['bytes_read'],
+        'plan_bytes_written': plan_stats['bytes_written'],
+        'state_stats': state_stats,
+        'wakeups': sum(wakeups.values()),
+        'wakeups_per_merchant_mean': round(sum(wakeups.values()) / len(merchants), 2) if merchants else 0,
+        'wakeups_per_merchant_max': max(wakeups.values()) if merchants else 0,
+        'missed': [result['merchant_id'] for result in results if not all([month['complete'] for month in result['months']])],
+        'misscheduled': sorted(misscheduled),
+        'results': results
+    }
+
+
+# A month's purchases for one merchant. complete is True if total_purchases purchases were made and none of them were
+# made before min_day or after max_day.
+def check_month(merchant, year, month):
+    transactions = debbit.STATE_STORE.last_transactions(merchant.id, year, month)
+    max_day = merchant.max_day or debbit.DAYS_IN_MONTH[month] - 1
+    days = [datetime.fromtimestamp(t['unix_time']).day for t in transactions]
+    out_of_range = len([day for day in days if day < merchant.min_day or day > max_day])
+
+    return {
+        'month': str(year) + '-' + str(month).zfill(2),
+        'purchases': len(transactions),
+        'last_purchase_day': max(days) if days else None,
+        'out_of_range': out_of_range,
+        'complete': len(transactions) >= merchant.total_purchases and out_of_range == 0
+    }
+
+
+def synthetic_config(mode, merchant_count):
+    config = {
+        'mode': mode,
+        'hide_web_browser': True,
+        'notify_failure': 'your.email@website.com',
+        'send_failures_to_developer': False,
+        'coverage': {'policy': 'never'}  # there is no merchant code worth measuring in a simulation
+    }
+
+    for i in range(merchant_count):
+        amount_min = random.randint(1, 100)
+        merchant_config = {
+            'total_purchases': random.choice([1, 5, 10, 15, 20, 25, 30, 40]),
+            'amount_min': amount_min,
+            'amount_max': amount_min + random.randint(0, 50),
+            'usr': 'user' + str(i),
+            'psw': 'pass',
+            'card': '2222',
+            'burst_count': random.randint(1, 5),
+            'advanced': {}
+        }
+
+        if random.random() < 0.25:
+            merchant_config['advanced']['min_day'] = random.randint(2, 10)
+        if random.random() < 0.25:
+            merchant_config['advanced']['max_day'] = random.randint(20, 27)
+
+        config['card_' + str(i)] = {'simulated_merchant': merchant_config}
+
+    return config
+
+
+def stub_web_automation(skip_rate, fail_rate, skipped):
+    def web_automation(driver, merchant, amount):
+        if random.random() < fail_rate:
+            return Result.failed
+        if random.random() < skip_rate:
+            skipped.add(merchant.id)
+            return Result.skipped
+        return Result.success
+    return web_automation
+
+
+def month_start(start, months_later):
+    month_index = start.year * 12 + start.month - 1 + months_later
+    return datetime(month_index // 12, month_index % 12 + 1, 1)
+
+
+def print_report(report):
+    print(str(report['merchants']) + ' ' + report['mode'] + ' mode merchants, ' + str(report['months']) + ' ' + debbit.plural('month', report['months']) + ' from ' + report['start'] + ', ' + report['state_backend'] + ' state')
+    print('purchases:           ' + str(report['purchases']) + (', ' + str(report['failed_attempts']) + ' failed attempts retried' if report['failed_attempts'] else ''))
+    print('scheduler cpu:       ' + str(report['cpu_secs']) + 's (' + str(report['cpu_ms_per_purchase']) + 'ms per purchase), ' + str(report['wall_secs']) + 's wall')
+    print('state io:            ' + str(report['state_bytes_read']) + ' bytes read, ' + str(report['state_bytes_written']) + ' bytes written')
+    print('plan io:             ' + str(report['plan_bytes_read']) + ' bytes read, ' + str(report['plan_bytes_written']) + ' bytes written')
+    print('wakeups:             ' + str(report['wakeups']) + ' (' + str(report['wakeups_per_merchant_mean']) + ' per merchant, max ' + str(report['wakeups_per_merchant_max']) + ')')
+    if report['misscheduled']:
+        print('not left with exactly one future job: ' + ', '.join(report['misscheduled']))
+    if report['missed']:
+        print('missed total_purchases before max_day: ' + ', '.join(report['missed']))
+    else:
+        print('every merchant made total_purchases purchases between min_day and max_day')
+
+
+if __name__ == '__main__':
+    main()
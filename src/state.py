@@ -0,0 +1,524 @@
+import json
+import logging
+import os
+import re
+import sqlite3
+from datetime import datetime
+from threading import Lock
+from types import MappingProxyType
+
+import yaml  # PyYAML
+
+LOGGER = logging.getLogger('debbit')
+
+
+# Monthly state lives in two files in the state directory:
+#
+# debbit_YYYY_MM.txt     - human readable YAML snapshot, the format debbit has always used
+# debbit_YYYY_MM.journal - transactions recorded since the snapshot was written, one JSON object per line
+#
+# record() appends one fsync'd line to the journal instead of rewriting the whole snapshot, so recording a purchase
+# costs the same at the end of the month as at the start and a crash mid-write can at worst lose the line being
+# written. On startup, and once the journal holds compact_every transactions and at least as many transactions as the
+# snapshot, the journal is folded into a new snapshot which is written to a temporary file and then renamed over the
+# old one. Waiting for the journal to catch up with the snapshot keeps the cost of rewriting the snapshot proportional
+# to the month's purchases rather than to their square when many merchants are configured.
+#
+# load() parses each month once and hands out the same read-only snapshot until the files change. Snapshots are frozen
+# with freeze() so the many merchant threads reading state can't accidentally modify each other's copy, use thaw() to
+# get a modifiable copy. A cached snapshot is thrown away when either file's mtime or size changes, which covers users
+# editing the state file by hand while debbit is running.
+class StateStore:
+    def __init__(self, directory, compact_every=10):
+        self.directory = directory
+        self.compact_every = compact_every
+
+        self.entries = {}  # (year, month) -> (snapshot file signature, journal file signature, frozen state, journal line count)
+        self.lock = Lock()  # guards entries and the counters
+        self.write_lock = Lock()  # serializes record() and compact()
+        self.hits = 0
+        self.misses = 0
+        self.bytes_read = 0
+        self.bytes_written = 0
+
+    def load(self, year, month):
+        snapshot_sig = file_signature(self.snapshot_filename(year, month))
+        journal_sig = file_signature(self.journal_filename(year, month))
+
+        with self.lock:
+            entry = self.entries.get((year, month))
+            if entry and entry[0] == snapshot_sig and entry[1] == journal_sig:
+                self.hits += 1
+                return entry[2]
+            self.misses += 1
+
+        state = self._read_snapshot(year, month)
+        journal = self._read_journal(year, month)
+        for line in journal:
+            apply_transaction(state, line)
+
+        frozen = freeze(state)
+        with self.lock:
+            self.entries[(year, month)] = (snapshot_sig, journal_sig, frozen, len(journal))
+        return frozen
+
+    def record(self, year, month, merchant_id, transaction):
+        with self.write_lock:
+            if not os.path.exists(self.directory):
+                os.mkdir(self.directory)
+
+            state = dict(self.load(year, month))  # only the merchant being recorded is thawed, the others stay frozen
+            if merchant_id in state:
+                state[merchant_id] = thaw(state[merchant_id])
+            line = dict(transaction, merchant_id=merchant_id)
+
+            data = (json.dumps(line) + '\n').encode('utf-8')
+            with open(self.journal_filename(year, month), 'ab+') as f:
+                if f.seek(0, os.SEEK_END) > 0:
+                    f.seek(-1, os.SEEK_END)
+                    if f.read(1) != b'\n':  # debbit was stopped mid-write last time, don't append to the incomplete line
+                        f.write(b'\n')
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            self._count_io(written=len(data))
+
+            apply_transaction(state, line)
+            state[merchant_id] = freeze(state[merchant_id])
+            with self.lock:
+                journal_count = self.entries[(year, month)][3] + 1
+                self.entries[(year, month)] = (
+                    file_signature(self.snapshot_filename(year, month)),
+                    file_signature(self.journal_filename(year, month)),
+                    MappingProxyType(state),
+                    journal_count
+                )
+
+            transaction_count = sum([len(merchant_state['transactions']) for merchant_state in state.values()])
+            if journal_count >= max(self.compact_every, transaction_count - journal_count):
+                self._compact(year, month)
+
+            return state[merchant_id]['purchase_count']
+
+    # Folds the journal into the human readable snapshot. Safe to call at any time, does nothing if the journal is empty.
+    def compact(self, year, month):
+        with self.write_lock:
+            self._compact(year, month)
+
+    def purchase_count(self, merchant_id, year, month):
+        return self.load(year, month).get(merchant_id, {}).get('purchase_count') or 0
+
+    # The month's newest n transactions, oldest first. n=None returns all of the month's transactions.
+    def last_transactions(self, merchant_id, year, month, n=None):
+        transactions = self.load(year, month).get(merchant_id, {}).get('transactions') or ()
+        return transactions[-n:] if n else transactions
+
+    def purchases_since(self, merchant_id, year, month, unix_time):
+        return len([t for t in self.last_transactions(merchant_id, year, month) if t['unix_time'] > unix_time])
+
+    # The month's newest n amounts in cents, oldest first. n=None returns all of the month's amounts.
+    def last_amounts(self, merchant_id, year, month, n=None):
+        return [amount_cents(t) for t in self.last_transactions(merchant_id, year, month, n)]
+
+    # (year, month) of every month with a state file
+    def months(self):
+        months = set()
+        if os.path.exists(self.directory):
+            for filename in os.listdir(self.directory):
+                match = re.fullmatch(r'debbit_(\d{4})_(\d{2})\.(txt|journal)', filename)
+                if match:
+                    months.add((int(match.group(1)), int(match.group(2))))
+        return sorted(months)
+
+    def stats(self):
+        with self.lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'cached_months': len(self.entries),
+                'bytes_read': self.bytes_read,
+                'bytes_written': self.bytes_written
+            }
+
+    def snapshot_filename(self, year, month):
+        return os.path.join(self.directory, 'debbit_' + str(year) + '_' + str(month).zfill(2) + '.txt')
+
+    def journal_filename(self, year, month):
+        return os.path.join(self.directory, 'debbit_' + str(year) + '_' + str(month).zfill(2) + '.journal')
+
+    def _compact(self, year, month):
+        if not os.path.exists(self.journal_filename(year, month)):
+            return
+
+        state = thaw(self.load(year, month))
+        snapshot_filename = self.snapshot_filename(year, month)
+
+        data = yaml.dump(state)
+        with open(snapshot_filename + '.tmp', 'w', encoding='utf-8') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        self._count_io(written=len(data))
+        os.replace(snapshot_filename + '.tmp', snapshot_filename)  # a crash before this line leaves the old snapshot and journal intact
+        os.remove(self.journal_filename(year, month))  # a crash before this line replays the journal again, apply_transaction() skips the duplicates
+
+        with self.lock:
+            self.entries[(year, month)] = (file_signature(snapshot_filename), None, freeze(state), 0)
+
+    def _read_snapshot(self, year, month):
+        try:
+            with open(self.snapshot_filename(year, month), 'r', encoding='utf-8') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return {}
+
+        self._count_io(read=len(data))
+        return yaml.safe_load(data) or {}
+
+    def _read_journal(self, year, month):
+        lines = []
+        try:
+            with open(self.journal_filename(year, month), 'r', encoding='utf-8') as f:
+                for raw_line in f:
+                    self._count_io(read=len(raw_line))
+                    if not raw_line.strip():
+                        continue
+                    try:
+                        lines.append(json.loads(raw_line))
+                    except ValueError:  # debbit was stopped while this line was being written
+                        LOGGER.warning('Ignoring incomplete line in ' + self.journal_filename(year, month) + ': ' + raw_line.strip())
+        except FileNotFoundError:
+            pass
+        return lines
+
+    # Bytes of state files read and written, reported by stats() and simulate.py. Counted in characters, which is the
+    # same thing for the ASCII that debbit writes.
+    def _count_io(self, read=0, written=0):
+        with self.lock:
+            self.bytes_read += read
+            self.bytes_written += written
+
+
+# Optional replacement for StateStore, enabled with "state_backend: sqlite" in config.txt. Transactions are stored in
+# state/debbit.sqlite3 indexed on (merchant_id, unix_time) so the scheduler's questions, e.g. "how many purchases since
+# T" or "what were the last N amounts", are answered with an index lookup instead of walking a month of YAML.
+#
+# The first time each month is seen its YAML state file is imported. compact() exports the month back to the usual
+# human readable debbit_YYYY_MM.txt file so the state folder stays readable and switching back to
+# "state_backend: yaml" loses nothing. compact() runs on startup and as the month's transactions grow, on the same
+# schedule StateStore compacts its journal.
+#
+# Each import and export remembers the YAML files' signature. If the files changed since, e.g. debbit ran with
+# "state_backend: yaml" for a while or the file was edited by hand, the month is imported again on startup and before
+# the next export: the YAML month replaces the sqlite month, plus any transactions sqlite recorded after it last synced
+# with the YAML files. export_yaml() never writes over YAML files that changed since debbit last read them.
+class SqliteStateStore:
+    def __init__(self, directory, compact_every=10):
+        self.directory = directory
+        self.compact_every = compact_every
+        self.yaml_store = StateStore(directory, compact_every)
+        self.records_since_compact = 0
+        self.bytes_written = 0
+        self.lock = Lock()  # sqlite3 connections must not be used by two threads at once
+
+        if not os.path.exists(directory):
+            os.mkdir(directory)
+
+        self.connection = sqlite3.connect(os.path.join(directory, 'debbit.sqlite3'), check_same_thread=False, isolation_level=None)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.create_transactions_table()
+        self.connection.execute('CREATE INDEX IF NOT EXISTS transactions_merchant_time ON transactions (merchant_id, unix_time)')
+        self.connection.execute('''
+            CREATE TABLE IF NOT EXISTS purchase_counts (
+                merchant_id TEXT NOT NULL,
+                year INTEGER NOT NULL,
+                month INTEGER NOT NULL,
+                purchase_count INTEGER NOT NULL,
+                PRIMARY KEY (merchant_id, year, month)
+            )''')
+        self.connection.execute('''
+            CREATE TABLE IF NOT EXISTS imported_months (
+                year INTEGER NOT NULL,
+                month INTEGER NOT NULL,
+                yaml_signature TEXT,
+                synced_rowid INTEGER,
+                PRIMARY KEY (year, month)
+            )''')
+        columns = [row[1] for row in self.connection.execute('PRAGMA table_info(imported_months)')]
+        if 'yaml_signature' not in columns:  # databases made before signatures were kept are merged with the YAML once
+            self.connection.execute('ALTER TABLE imported_months ADD COLUMN yaml_signature TEXT')
+            self.connection.execute('ALTER TABLE imported_months ADD COLUMN synced_rowid INTEGER')
+
+        self.import_yaml()
+
+    # Transaction ids are never reused, even after a month is imported again and its rows are deleted, so every
+    # transaction recorded after a month's synced_rowid has a larger id. Databases made before ids were declared keep
+    # their rowids as ids.
+    def create_transactions_table(self):
+        create_table = '''
+            CREATE TABLE IF NOT EXISTS {} (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                merchant_id TEXT NOT NULL,
+                unix_time INTEGER NOT NULL,
+                amount_cents INTEGER NOT NULL,
+                human_time TEXT NOT NULL
+            )'''
+        columns = [row[1] for row in self.connection.execute('PRAGMA table_info(transactions)')]
+        if columns and 'id' not in columns:
+            with self.connection:
+                self.connection.execute('BEGIN IMMEDIATE')
+                self.connection.execute(create_table.format('transactions_with_ids'))
+                self.connection.execute('INSERT INTO transactions_with_ids (id, merchant_id, unix_time, amount_cents, human_time) SELECT rowid, merchant_id, unix_time, amount_cents, human_time FROM transactions')
+                self.connection.execute('DROP TABLE transactions')  # also drops its index, which is created again below
+                self.connection.execute('ALTER TABLE transactions_with_ids RENAME TO transactions')
+        self.connection.execute(create_table.format('transactions'))
+
+    # Imports every YAML state file that has not been imported yet or has changed since it was imported or exported
+    def import_yaml(self):
+        for year, month in self.yaml_store.months():
+            self.sync_month(year, month)
+
+    def sync_month(self, year, month):
+        signature = self.yaml_signature(year, month)
+        with self.lock:
+            row = self.connection.execute('SELECT yaml_signature, synced_rowid FROM imported_months WHERE year = ? AND month = ?', (year, month)).fetchone()
+        if row and row[0] == signature:
+            return
+
+        if row and not os.path.exists(self.yaml_store.snapshot_filename(year, month)) and not os.path.exists(self.yaml_store.journal_filename(year, month)):
+            with self.lock:  # a month sqlite started, or the YAML files were deleted, nothing to import and the next export writes them
+                self.connection.execute('UPDATE imported_months SET yaml_signature = ? WHERE year = ? AND month = ?', (signature, year, month))
+            return
+
+        if row:
+            LOGGER.info(self.yaml_store.snapshot_filename(year, month) + ' changed since it was last imported or exported, importing it again')
+        else:
+            LOGGER.info('Importing ' + self.yaml_store.snapshot_filename(year, month) + ' into ' + os.path.join(self.directory, 'debbit.sqlite3'))
+        self._import_month(year, month, signature, row[1] if row else None)
+
+    # Replaces the month with the YAML month. Transactions recorded after synced_rowid, the largest transaction id when
+    # the month was last synced, aren't in the YAML files and are kept, None keeps every transaction that isn't in the
+    # YAML files.
+    def _import_month(self, year, month, signature, synced_rowid):
+        state = self.yaml_store.load(year, month)
+        start, end = month_bounds(year, month)
+
+        with self.lock, self.connection:
+            self.connection.execute('BEGIN IMMEDIATE')
+            kept = self.connection.execute(
+                'SELECT merchant_id, unix_time, amount_cents, human_time FROM transactions WHERE unix_time >= ? AND unix_time < ? AND id > ? ORDER BY id',
+                (start, end, synced_rowid if synced_rowid is not None else -1)
+            ).fetchall()
+            self.connection.execute('DELETE FROM transactions WHERE unix_time >= ? AND unix_time < ?', (start, end))
+            self.connection.execute('DELETE FROM purchase_counts WHERE year = ? AND month = ?', (year, month))
+
+            purchase_counts = {}
+            seen = set()
+            for merchant_id, merchant_state in state.items():
+                rows = [(merchant_id, t['unix_time'], amount_cents(t), t['human_time']) for t in merchant_state['transactions']]
+                self.connection.executemany('INSERT INTO transactions (merchant_id, unix_time, amount_cents, human_time) VALUES (?, ?, ?, ?)', rows)
+                seen.update([row[:3] for row in rows])
+                purchase_counts[merchant_id] = merchant_state['purchase_count']
+
+            for row in kept:
+                if row[:3] in seen:
+                    continue
+                seen.add(row[:3])
+                self.connection.execute('INSERT INTO transactions (merchant_id, unix_time, amount_cents, human_time) VALUES (?, ?, ?, ?)', row)
+                purchase_counts[row[0]] = purchase_counts.get(row[0], 0) + 1
+
+            self.connection.executemany(
+                'INSERT INTO purchase_counts (merchant_id, year, month, purchase_count) VALUES (?, ?, ?, ?)',
+                [(merchant_id, year, month, purchase_count) for merchant_id, purchase_count in purchase_counts.items()]
+            )
+            synced_rowid = self.connection.execute('SELECT MAX(id) FROM transactions').fetchone()[0] or 0
+            self.connection.execute('INSERT OR REPLACE INTO imported_months (year, month, yaml_signature, synced_rowid) VALUES (?, ?, ?, ?)',
+                                    (year, month, signature, synced_rowid))
+
+    # Writes the month to the human readable debbit_YYYY_MM.txt file, unless the YAML files changed since they were last
+    # imported or exported
+    def export_yaml(self, year, month):
+        snapshot_filename = self.yaml_store.snapshot_filename(year, month)
+        with self.lock:
+            row = self.connection.execute('SELECT yaml_signature FROM imported_months WHERE year = ? AND month = ?', (year, month)).fetchone()
+            synced_rowid = self.connection.execute('SELECT MAX(id) FROM transactions').fetchone()[0] or 0  # before load(), a newer row is kept
+        if not row or row[0] != self.yaml_signature(year, month):
+            LOGGER.warning('Not overwriting ' + snapshot_filename + ', it changed since debbit last read it. It is imported again before the next export.')
+            return
+
+        state = thaw(self.load(year, month))
+        data = yaml.dump(state)
+        with open(snapshot_filename + '.tmp', 'w', encoding='utf-8') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        with self.lock:
+            self.bytes_written += len(data)
+        os.replace(snapshot_filename + '.tmp', snapshot_filename)
+
+        if os.path.exists(self.yaml_store.journal_filename(year, month)):
+            os.remove(self.yaml_store.journal_filename(year, month))  # already imported, the snapshot now includes it
+
+        signature = self.yaml_signature(year, month)
+        with self.lock:
+            self.connection.execute('UPDATE imported_months SET yaml_signature = ?, synced_rowid = ? WHERE year = ? AND month = ?', (signature, synced_rowid, year, month))
+
+    # The YAML files' (mtime, size) and purchase count total, changes whenever anything else writes to them
+    def yaml_signature(self, year, month):
+        purchase_count = sum([merchant_state['purchase_count'] for merchant_state in self.yaml_store.load(year, month).values()])
+        return json.dumps([file_signature(self.yaml_store.snapshot_filename(year, month)), file_signature(self.yaml_store.journal_filename(year, month)), purchase_count])
+
+    def load(self, year, month):
+        start, end = month_bounds(year, month)
+        state = {}
+        with self.lock:
+            for merchant_id, purchase_count in self.connection.execute(
+                    'SELECT merchant_id, purchase_count FROM purchase_counts WHERE year = ? AND month = ? ORDER BY merchant_id', (year, month)):
+                state[merchant_id] = {'purchase_count': purchase_count, 'transactions': []}
+
+            for merchant_id, unix_time, cents, human_time in self.connection.execute(
+                    'SELECT merchant_id, unix_time, amount_cents, human_time FROM transactions WHERE unix_time >= ? AND unix_time < ? ORDER BY unix_time', (start, end)):
+                if merchant_id in state:
+                    state[merchant_id]['transactions'].append(transaction_dict(unix_time, cents, human_time))
+        return freeze(state)
+
+    def record(self, year, month, merchant_id, transaction):
+        with self.lock, self.connection:
+            self.connection.execute('BEGIN IMMEDIATE')
+            self.connection.execute(
+                'INSERT INTO transactions (merchant_id, unix_time, amount_cents, human_time) VALUES (?, ?, ?, ?)',
+                (merchant_id, transaction['unix_time'], amount_cents(transaction), transaction['human_time'])
+            )
+            self.connection.execute(
+                'INSERT INTO purchase_counts (merchant_id, year, month, purchase_count) VALUES (?, ?, ?, 1) '
+                'ON CONFLICT (merchant_id, year, month) DO UPDATE SET purchase_count = purchase_count + 1',
+                (merchant_id, year, month)
+            )
+            self.connection.execute('INSERT OR IGNORE INTO imported_months (year, month) VALUES (?, ?)', (year, month))
+            purchase_count = self.connection.execute(
+                'SELECT purchase_count FROM purchase_counts WHERE merchant_id = ? AND year = ? AND month = ?', (merchant_id, year, month)
+            ).fetchone()[0]
+            month_count = self.connection.execute('SELECT SUM(purchase_count) FROM purchase_counts WHERE year = ? AND month = ?', (year, month)).fetchone()[0]
+            self.records_since_compact += 1
+            export_due = self.records_since_compact >= max(self.compact_every, month_count - self.records_since_compact)  # same schedule as StateStore
+
+        if export_due:
+            self.compact(year, month)
+
+        return purchase_count
+
+    def compact(self, year, month):
+        with self.lock:
+            self.records_since_compact = 0
+            exists = self.connection.execute('SELECT 1 FROM imported_months WHERE year = ? AND month = ?', (year, month)).fetchone()
+        if exists:
+            self.sync_month(year, month)  # the YAML files may have been edited while debbit was running
+            self.export_yaml(year, month)
+
+    def purchase_count(self, merchant_id, year, month):
+        with self.lock:
+            row = self.connection.execute(
+                'SELECT purchase_count FROM purchase_counts WHERE merchant_id = ? AND year = ? AND month = ?', (merchant_id, year, month)
+            ).fetchone()
+        return row[0] if row else 0
+
+    # The month's newest n transactions, oldest first. n=None returns all of the month's transactions.
+    def last_transactions(self, merchant_id, year, month, n=None):
+        start, end = month_bounds(year, month)
+        with self.lock:
+            rows = self.connection.execute(
+                'SELECT unix_time, amount_cents, human_time FROM transactions WHERE merchant_id = ? AND unix_time >= ? AND unix_time < ? '
+                'ORDER BY unix_time DESC LIMIT ?', (merchant_id, start, end, n if n else -1)
+            ).fetchall()
+        return tuple(freeze(transaction_dict(*row)) for row in reversed(rows))
+
+    def purchases_since(self, merchant_id, year, month, unix_time):
+        start, end = month_bounds(year, month)
+        with self.lock:
+            return self.connection.execute(
+                'SELECT COUNT(*) FROM transactions WHERE merchant_id = ? AND unix_time > ? AND unix_time >= ? AND unix_time < ?',
+                (merchant_id, unix_time, start, end)
+            ).fetchone()[0]
+
+    # The month's newest n amounts in cents, oldest first. n=None returns all of the month's amounts.
+    def last_amounts(self, merchant_id, year, month, n=None):
+        return [amount_cents(t) for t in self.last_transactions(merchant_id, year, month, n)]
+
+    def months(self):
+        with self.lock:
+            return [tuple(row) for row in self.connection.execute('SELECT year, month FROM imported_months ORDER BY year, month')]
+
+    def stats(self):
+        database_bytes = 0
+        for filename in ['debbit.sqlite3', 'debbit.sqlite3-wal']:
+            signature = file_signature(os.path.join(self.directory, filename))
+            database_bytes += signature[1] if signature else 0
+
+        with self.lock:
+            return {
+                'transactions': self.connection.execute('SELECT COUNT(*) FROM transactions').fetchone()[0],
+                'database_bytes': database_bytes,
+                'bytes_written': self.bytes_written  # YAML exports, sqlite's own page writes are not counted
+            }
+
+
+# Applies one journal line to a thawed state dict. Transactions already in the state are skipped so replaying a journal
+# on top of a snapshot it was already compacted into is harmless.
+def apply_transaction(state, line):
+    merchant_id = line['merchant_id']
+    transaction = {k: v for k, v in line.items() if k != 'merchant_id'}
+
+    if merchant_id not in state:
+        state[merchant_id] = {
+            'purchase_count': 0,
+            'transactions': []
+        }
+
+    if transaction in state[merchant_id]['transactions']:
+        return
+
+    state[merchant_id]['purchase_count'] += 1
+    state[merchant_id]['transactions'].append(transaction)
+
+
+# '50 cents' -> 50
+def amount_cents(transaction):
+    return int(transaction['amount'][:-6])
+
+
+def transaction_dict(unix_time, cents, human_time):
+    return {'amount': str(cents) + ' cents', 'human_time': human_time, 'unix_time': unix_time}
+
+
+# unix time of the first second of the month and of the first second of the next month, in local time
+def month_bounds(year, month):
+    start = datetime(year, month, 1)
+    end = datetime(year + 1, 1, 1) if month == 12 else datetime(year, month + 1, 1)
+    return int(start.timestamp()), int(end.timestamp())
+
+
+# (mtime, size) of a file or None if it does not exist. Used to notice when a file was changed by something other than debbit.
+def file_signature(filename):
+    try:
+        stat = os.stat(filename)
+        return stat.st_mtime_ns, stat.st_size
+    except FileNotFoundError:
+        return None
+
+
+# Recursively converts dicts to read-only mappings and lists to tuples
+def freeze(obj):
+    if isinstance(obj, (dict, MappingProxyType)):
+        return MappingProxyType({k: freeze(v) for k, v in obj.items()})
+    if isinstance(obj, (list, tuple)):
+        return tuple(freeze(v) for v in obj)
+    return obj
+
+
+# Inverse of freeze(), returns plain dicts and lists that are safe to modify and yaml.dump
+def thaw(obj):
+    if isinstance(obj, (dict, MappingProxyType)):
+        return {k: thaw(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [thaw(v) for v in obj]
+    return obj
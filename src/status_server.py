@@ -0,0 +1,62 @@
+import http.server
+import json
+import logging
+from threading import Thread
+
+LOGGER = logging.getLogger('debbit')
+
+
+# Optional read-only HTTP server on localhost so monitoring can scrape debbit instead of reading debbit_log.log:
+#
+# GET /status  - JSON from status(), each merchant's purchases this month, next scheduled run and what it's doing
+# GET /metrics - Prometheus text format from metrics(), a list of lines
+#
+# Both are computed on each request from debbit's in-memory state on the server's own thread, no purchase waits on
+# them. Only GET is served and nothing can be changed through the server.
+class StatusServer:
+    def __init__(self, port, status, metrics, host='127.0.0.1'):
+        self.port = port
+        self.host = host
+        self.status = status
+        self.metrics = metrics
+        self.server = None
+
+    def start(self):
+        server = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                try:
+                    path = self.path.split('?')[0]
+                    if path == '/status':
+                        self._send(200, 'application/json', json.dumps(server.status(), indent=2))
+                    elif path == '/metrics':
+                        self._send(200, 'text/plain; version=0.0.4', '\n'.join(server.metrics()) + '\n')
+                    else:
+                        self._send(404, 'text/plain', 'Not found, try /status or /metrics\n')
+                except (KeyboardInterrupt, SystemExit):
+                    raise
+                except Exception as e:
+                    LOGGER.error('Status server error for ' + self.path + ': ' + str(e))
+                    self._send(500, 'text/plain', 'Internal error\n')
+
+            def _send(self, code, content_type, body):
+                data = body.encode('utf-8')
+                self.send_response(code)
+                self.send_header('Content-Type', content_type + '; charset=utf-8')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass  # a scrape every few seconds would flood the log
+
+        self.server = http.server.ThreadingHTTPServer((self.host, self.port), Handler)
+        self.server.daemon_threads = True
+        Thread(target=self.server.serve_forever, name='debbit-status-server', daemon=True).start()
+        LOGGER.info('Serving status at http://' + self.host + ':' + str(self.server.server_address[1]) + '/status and metrics at /metrics')
+
+    def stop(self):
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
@@ -1,8 +1,22 @@
+import functools
 import logging
+import random
+import threading
+import time
 
-from selenium.webdriver.support.wait import WebDriverWait
+from selenium.common.exceptions import JavascriptException, StaleElementReferenceException, TimeoutException, WebDriverException
+from selenium.webdriver.common.by import By
+from selenium.webdriver.support import expected_conditions
 
 LOGGER = logging.getLogger('debbit')
+LOG_CONTEXT = threading.local()
+
+# Seconds of deliberate delay for each pacing intent, a random amount between the two numbers. watch is a multiplier for
+# the seconds merchants ask for. config.txt can change these or add profiles under pacing: profiles.
+PACING_PROFILES = {
+    'human': {'think': [1, 3], 'type': [1, 3], 'after_click': [1, 3], 'watch': 1},  # slow enough to help avoid bot detection
+    'fast': {'think': [0, 0], 'type': [0, 0], 'after_click': [0, 0], 'watch': 0}  # example_merchant, benchmarks and debugging
+}
 
 
 # converts cents int to formatted dollar string
@@ -27,7 +41,8 @@ def str_to_cents(string):
     return int(''.join([c for c in string if c.isdigit()]))
 
 
-# This lambda function finishes the moment either element is visible.
+# This function finishes the moment either element is in the page, both are looked for with one locate() call each time
+# the page changes.
 # Returns False if element found indicating that we need to log in.
 # Returns True if element found indicating that we are already logged in.
 #
@@ -37,12 +52,8 @@ def str_to_cents(string):
 # driver.find_element(By.ID, 'some-element-id')
 # driver.find_element(By.XPATH, "//*[contains(text(),'some text on webpage')]")
 def is_logged_in(driver, timeout=30, logged_out_element=None, logged_in_element=None):
-    login_status = WebDriverWait(driver, timeout).until(
-        lambda driver:
-        (driver.find_elements(*logged_out_element) and 'logged_out')
-        or
-        (driver.find_elements(*logged_in_element) and 'logged_in')
-    )
+    index = wait_for_any(driver, timeout, logged_out_element, logged_in_element)[0]
+    login_status = 'logged_out' if index == 0 else 'logged_in'
 
     if login_status == 'logged_out':  # TODO is there any way we know this is a use_cookies:yes secondary purchase?
         LOGGER.info('login_status=logged_out, logging in now')
@@ -54,6 +65,9 @@ def is_logged_in(driver, timeout=30, logged_out_element=None, logged_in_element=
 
 # Useful with WebDriverWait() and multiple expected conditions.
 # This function finishes the moment any condition returns true.
+# presence_of_element_located(), visibility_of_element_located() and element_to_be_clickable() conditions are all
+# checked with a single locate() call, other conditions are checked one at a time after them. Returns the element of
+# the first condition that is true, or the condition's own result for the other conditions.
 # Example usage:
 #
 # try:
@@ -67,13 +81,327 @@ def is_logged_in(driver, timeout=30, logged_out_element=None, logged_in_element=
 class AnyExpectedCondition:
     def __init__(self, *args):
         self.expected_conditions = args
+        self.located = [condition for condition in args if type(condition) in LOCATOR_CONDITIONS]
 
     def __call__(self, driver):
+        if self.located:
+            try:
+                for condition, found in zip(self.located, locate(driver, *[condition.locator for condition in self.located])):
+                    if found[LOCATOR_CONDITIONS[type(condition)]]:
+                        return found['element']
+            except (KeyboardInterrupt, SystemExit):
+                raise
+            except Exception:
+                pass
+
         for condition in self.expected_conditions:
+            if condition in self.located:
+                continue
             try:
-                if condition(driver):
-                    return True
+                result = condition(driver)
+                if result:
+                    return result
             except (KeyboardInterrupt, SystemExit):
                 raise
             except Exception:
                 pass
+
+
+# Expected conditions AnyExpectedCondition can batch, and the locate() state each one needs
+LOCATOR_CONDITIONS = {
+    expected_conditions.presence_of_element_located: 'present',
+    expected_conditions.visibility_of_element_located: 'visible',
+    expected_conditions.element_to_be_clickable: 'clickable'
+}
+
+
+# Looks up every locator in a single execute_script() call instead of one find_elements() call per locator, returns a
+# list with a dict for each locator in the same order:
+#
+# {'present': True, 'visible': True, 'clickable': False, 'element': <WebElement>}
+#
+# element is the first matching element or None. visible and clickable approximate Selenium's is_displayed() and
+# is_enabled(), see IS_CLICKABLE_JS. locators are (By, value) tuples as passed to driver.find_element(*locator).
+def locate(driver, *locators):
+    results = driver.execute_script(locate_js(locators), *[locator[1] for locator in locators])
+    return [{'present': element is not None, 'visible': visible, 'clickable': clickable, 'element': element} for element, visible, clickable in results]
+
+
+def locate_js(locators):
+    script = IS_CLICKABLE_JS + '\nvar results = [];\n'
+    for i, locator in enumerate(locators):
+        script += 'try { var element = ' + locator_js(locator, 'arguments[' + str(i) + ']') + '; } catch (e) { var element = null; }\n'
+        script += 'results.push(element ? [element, is_visible(element), is_clickable(element)] : [null, false, false]);\n'
+    return script + 'return results;'
+
+
+# Waits until any locator matches an element that is present, or visible or clickable if state says so, and returns
+# (index of the locator, element). The first locator wins if several match at once. Uses wait_for_js() so the wait
+# ends as soon as the page changes. Raises TimeoutException after timeout seconds.
+def wait_for_any(driver, timeout, *locators, state='present'):
+    condition = 'var results = (function() {\n' + locate_js(locators) + '\n}).apply(null, arguments);\n'
+    condition += 'for (var i = 0; i < results.length; i++) {\n'
+    condition += "    if (results[i][" + str(['present', 'visible', 'clickable'].index(state)) + "]) return {index: i, element: results[i][0]};\n"
+    condition += '}\nreturn null;'
+    found = wait_for_js(driver, condition, timeout, *[locator[1] for locator in locators])
+    return found['index'], found['element']
+
+
+# Waits until a JavaScript condition is true in the page and returns its value, e.g.
+#
+# utils.wait_for_js(driver, "return document.getElementById(arguments[0]).innerText == 'Buy Now'", 30, 'buy-button')
+#
+# condition is the body of a function that is passed args. It is checked inside the page every time the DOM changes,
+# plus every 500ms for changes that don't touch the DOM such as a stylesheet loading, so the wait ends the moment the
+# condition holds without sleeping or asking the browser over and over. Errors thrown by condition count as false, which
+# handles elements that don't exist yet. If the page navigates away the wait continues on the new page. Raises
+# TimeoutException like WebDriverWait if the condition is still false after timeout seconds. Any other error, e.g. a
+# crashed Firefox or a closed window, is raised right away.
+def wait_for_js(driver, condition, timeout=30, *args):
+    deadline = time.time() + timeout
+    last_error = None
+    while True:
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            raise TimeoutException('Timed out after ' + str(timeout) + ' seconds waiting for: ' + condition + (' (' + last_error + ')' if last_error else ''))
+
+        try:
+            # At most 20 seconds per call to stay under the default 30 second script timeout
+            result = driver.execute_async_script(WAIT_FOR_JS_START + condition + WAIT_FOR_JS_END, int(min(remaining, 20) * 1000), *args)
+        except TimeoutException:
+            continue
+        except WebDriverException as e:
+            if not is_navigation_error(e):
+                raise
+            last_error = str(e).strip()  # the page navigated while the script ran, check the new page
+            time.sleep(0.1)
+            continue
+
+        if result is not None:
+            return result['value']
+
+
+# "Document was unloaded" and its relatives, the page changed under the script rather than the browser failing
+def is_navigation_error(exception):
+    return isinstance(exception, (JavascriptException, StaleElementReferenceException)) or 'Document was unloaded' in str(exception)
+
+
+WAIT_FOR_JS_START = """
+    var callback = arguments[arguments.length - 1];
+    var timeoutMs = arguments[0];
+    var args = Array.prototype.slice.call(arguments, 1, arguments.length - 1);
+    var done = false;
+    var observer = null;
+
+    function condition() {
+"""
+WAIT_FOR_JS_END = """
+    }
+
+    function finish(result) {
+        if (done) return;
+        done = true;
+        if (observer) observer.disconnect();
+        clearInterval(interval);
+        clearTimeout(timer);
+        callback(result);
+    }
+
+    function check() {
+        try {
+            var value = condition.apply(null, args);
+            if (value) finish({value: value});
+        } catch (e) {}
+    }
+
+    var timer = setTimeout(function() { finish(null); }, timeoutMs);
+    var interval = setInterval(check, 500);
+    observer = new MutationObserver(check);
+    observer.observe(document, {childList: true, subtree: true, attributes: true, characterData: true});
+    check();
+"""
+
+
+# Waits until the element is in the page and returns it. With clickable=True the element must also be visible and not
+# disabled, like expected_conditions.element_to_be_clickable(). locator is a (By, value) tuple as passed to
+# driver.find_element(*locator). Raises TimeoutException after timeout seconds.
+def wait_for_element(driver, timeout, locator, clickable=False):
+    return wait_for_any(driver, timeout, locator, state='clickable' if clickable else 'present')[1]
+
+
+# JavaScript expression that evaluates to the first element matching a locator, or null. value is a JavaScript
+# expression for the locator's value, usually one of the arguments.
+def locator_js(locator, value):
+    by = locator[0]
+    if by == By.ID:
+        return 'document.getElementById(' + value + ')'
+    elif by == By.XPATH:
+        return 'document.evaluate(' + value + ', document, null, XPathResult.FIRST_ORDERED_NODE_TYPE, null).singleNodeValue'
+    elif by == By.CSS_SELECTOR:
+        return 'document.querySelector(' + value + ')'
+    elif by == By.NAME:
+        return 'document.getElementsByName(' + value + ')[0]'
+    elif by == By.CLASS_NAME:
+        return 'document.getElementsByClassName(' + value + ')[0]'
+    elif by == By.TAG_NAME:
+        return 'document.getElementsByTagName(' + value + ')[0]'
+    elif by == By.LINK_TEXT:
+        return 'Array.prototype.find.call(document.links, function(a) { return a.innerText.trim() == ' + value + '; })'
+    elif by == By.PARTIAL_LINK_TEXT:
+        return 'Array.prototype.find.call(document.links, function(a) { return a.innerText.indexOf(' + value + ') != -1; })'
+    raise ValueError('Unsupported locator strategy: ' + str(by))
+
+
+# Approximates Selenium's is_displayed() and is_enabled(): a visible element takes up space and isn't hidden, a
+# clickable one is also not disabled
+IS_CLICKABLE_JS = """
+    function is_visible(element) {
+        var style = window.getComputedStyle(element);
+        return element.getClientRects().length > 0 && style.visibility != 'hidden' && style.opacity != '0';
+    }
+
+    function is_clickable(element) {
+        return is_visible(element) && !element.disabled;
+    }
+"""
+
+
+# Human-like delays for merchant modules, called by intent so they can be tuned in config.txt instead of in code:
+#
+# utils.pace.think()        - before deciding on the next action, e.g. before clicking a button
+# utils.pace.type()         - before typing into a field
+# utils.pace.after_click()  - after clicking, before looking at what happened
+# utils.pace.watch(secs)    - a pause to let people watch debbit work, skipped by the fast profile
+# utils.pace.settle(secs)   - a fixed wait for a page to finish updating, the same in every profile. jitter adds up to
+#                             that many random seconds on top.
+#
+# web_automation_wrapper() gives each purchase attempt its own Pace with the merchant's profile through set_pace(), and
+# logs how much of the attempt was deliberate delay (delay_secs) or settling (settle_secs) versus real work.
+class Pace:
+    def __init__(self, profile_name='human', profile=None):
+        self.profile_name = profile_name
+        self.profile = profile or PACING_PROFILES[profile_name]
+        self.delay_secs = 0
+        self.settle_secs = 0
+
+    def think(self):
+        self._delay(random.uniform(*self.profile['think']))
+
+    def type(self):
+        self._delay(random.uniform(*self.profile['type']))
+
+    def after_click(self):
+        self._delay(random.uniform(*self.profile['after_click']))
+
+    def watch(self, secs):
+        self._delay(secs * self.profile['watch'])
+
+    def settle(self, secs, jitter=0):
+        secs += random.uniform(0, jitter)
+        self.settle_secs += secs
+        time.sleep(secs)
+
+    def _delay(self, secs):
+        if secs > 0:
+            self.delay_secs += secs
+            time.sleep(secs)
+
+
+# The current thread's Pace, set with set_pace(). Threads without one use the human profile.
+class CurrentPace:
+    def __getattr__(self, name):
+        return getattr(getattr(PACE_CONTEXT, 'pace', None) or DEFAULT_PACE, name)
+
+
+PACE_CONTEXT = threading.local()
+DEFAULT_PACE = Pace()
+pace = CurrentPace()
+
+
+def set_pace(attempt_pace):
+    PACE_CONTEXT.pace = attempt_pace
+
+
+# Times a step of a merchant's web_automation(), as a context manager or a decorator:
+#
+# with utils.span('login'):
+#     ...
+#
+# @utils.span('mfa')
+# def handle_mfa_code_flow(driver):
+#
+# Spans inside other spans are named after them, e.g. 'login/mfa'. A step that runs more than once in an attempt is
+# added up. web_automation_wrapper() collects each attempt's spans through set_spans() and records them in the metrics
+# file, spans outside of an attempt are not recorded.
+class Span:
+    def __init__(self, name):
+        self.name = name
+        self.parent = None
+        self.path = None
+        self.start = None
+
+    def __enter__(self):
+        self.parent = getattr(SPAN_CONTEXT, 'path', None)
+        self.path = self.parent + '/' + self.name if self.parent else self.name
+        SPAN_CONTEXT.path = self.path
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        spans = getattr(SPAN_CONTEXT, 'spans', None)
+        if spans is not None:
+            spans[self.path] = spans.get(self.path, 0) + time.perf_counter() - self.start
+        if exc_value is not None and getattr(SPAN_CONTEXT, 'failure', (None,))[0] is not exc_value:
+            SPAN_CONTEXT.failure = (exc_value, self.path)  # the innermost span exits first
+        SPAN_CONTEXT.path = self.parent
+        return False
+
+    def __call__(self, function):
+        @functools.wraps(function)
+        def spanned(*args, **kwargs):
+            with Span(self.name):  # a new Span per call, the decorated function can run in several threads at once
+                return function(*args, **kwargs)
+        return spanned
+
+
+span = Span
+SPAN_CONTEXT = threading.local()
+
+
+# Collects the current thread's spans into attempt_spans, {name: seconds}. Pass None to stop collecting.
+def set_spans(attempt_spans):
+    SPAN_CONTEXT.spans = attempt_spans
+    SPAN_CONTEXT.path = None
+    SPAN_CONTEXT.failure = (None, None)
+
+
+# Path of the span the exception was raised in on the current thread, or None if it was raised outside of any span
+def failed_span(exception):
+    failure = getattr(SPAN_CONTEXT, 'failure', (None, None))
+    return failure[1] if failure[0] is exception else None
+
+
+# Tags every log line written by the current thread with the merchant id and card so log lines from purchases running
+# in parallel can be told apart. Pass None to stop tagging.
+def set_log_merchant(merchant_id, card=None):
+    LOG_CONTEXT.merchant_id = merchant_id
+    LOG_CONTEXT.card = card
+    LOG_CONTEXT.amount = None
+
+
+# Tags the current thread's log lines with the amount in cents of the purchase being made
+def set_log_amount(amount):
+    LOG_CONTEXT.amount = amount
+
+
+# Adds %(merchant_tag)s to log records, e.g. '[1111_amazon_gift_card_reload] ' or '' outside of a merchant thread, and
+# the merchant_id, card, amount and phase (the current span, e.g. 'login/mfa') fields the JSON lines log writes out
+class MerchantLogFilter(logging.Filter):
+    def filter(self, record):
+        merchant_id = getattr(LOG_CONTEXT, 'merchant_id', None)
+        record.merchant_tag = '[' + merchant_id + '] ' if merchant_id else ''
+        record.merchant_id = merchant_id
+        record.card = getattr(LOG_CONTEXT, 'card', None)
+        record.amount = getattr(LOG_CONTEXT, 'amount', None)
+        record.phase = getattr(SPAN_CONTEXT, 'path', None)
+        return True
@@ -0,0 +1,175 @@
+import logging
+import time
+from threading import Condition, Thread
+
+LOGGER = logging.getLogger('debbit')
+
+
+# Keeps Firefox open between purchases so back-to-back purchases for the same merchant and usr (the purchases of a
+# burst, or a retry after a failure) skip starting Firefox, restoring cookies, persisting cookies, and quitting Firefox.
+# Sessions are keyed by merchant.name + '_' + merchant.usr which is the same key used for the cookies file.
+#
+# create_driver(merchant) and destroy_driver(driver, merchant) do the expensive work of starting and quitting Firefox.
+# Idle sessions are quit after idle_timeout seconds, at most max_sessions browsers are open at once, and a session is
+# quit and replaced after max_uses purchases so a long running Firefox doesn't slowly leak memory.
+class WebDriverPool:
+    def __init__(self, create_driver, destroy_driver, max_sessions=2, idle_timeout=300, max_uses=10):
+        self.create_driver = create_driver
+        self.destroy_driver = destroy_driver
+        self.max_sessions = max_sessions
+        self.idle_timeout = idle_timeout
+        self.max_uses = max_uses
+
+        self.sessions = []  # every open session, both idle and in use
+        self.launches = 0
+        self.reuses = 0
+        self.condition = Condition()
+        self.reaper = None
+
+    def checkout(self, merchant):
+        key = session_key(merchant)
+
+        while True:
+            with self.condition:
+                session = self._take_idle_session(key)
+
+                if not session and 0 < self.max_sessions <= len(self.sessions):
+                    evicted = self._take_least_recently_used_idle_session()
+                    if evicted:
+                        self.sessions.remove(evicted)
+                    else:
+                        self.condition.wait()  # every session is in use, wait for one to be checked in
+                        continue
+                else:
+                    evicted = None
+
+                if not session:
+                    session = Session(key, merchant)
+                    self.sessions.append(session)  # reserve the slot before releasing the lock to start Firefox
+
+            if evicted:
+                LOGGER.info('Closing idle Firefox session for ' + evicted.merchant.id + ' to make room for ' + merchant.id)
+                self._destroy(evicted.driver, evicted.merchant)
+
+            if session.driver and not is_healthy(session.driver):
+                LOGGER.warning('Firefox session for ' + merchant.id + ' is no longer responding, starting a new one')
+                self._destroy(session.driver, session.merchant)
+                session.driver = None
+                session.uses = 0
+
+            if session.driver:
+                self.reuses += 1
+                LOGGER.info('Reusing open Firefox session for ' + merchant.id + ' (purchase ' + str(session.uses + 1) + ' of ' + str(self.max_uses) + ' before restart)')
+                session.merchant = merchant
+                session.uses += 1
+                return session.driver
+
+            try:
+                session.driver = self.create_driver(merchant)
+            except BaseException:
+                self._remove(session)
+                raise
+
+            self.launches += 1
+            session.merchant = merchant
+            session.uses = 1
+            self._start_reaper()
+            return session.driver
+
+    # reuse=False quits the browser immediately, e.g. after an unverified purchase when the browser's state is unknown
+    def checkin(self, driver, merchant, reuse=True):
+        with self.condition:
+            session = next((s for s in self.sessions if s.driver is driver), None)
+            if session and reuse and self.max_sessions > 0 and session.uses < self.max_uses:
+                session.in_use = False
+                session.last_used = time.time()
+                self.condition.notify_all()
+                return
+            elif session:
+                self.sessions.remove(session)
+                self.condition.notify_all()
+
+        if session and session.uses >= self.max_uses:
+            LOGGER.info('Firefox session for ' + merchant.id + ' reached ' + str(self.max_uses) + ' purchases, restarting it on next use')
+
+        self.destroy_driver(driver, merchant)
+
+    def close_idle(self, max_idle_secs=None):
+        now = time.time()
+        with self.condition:
+            expired = [s for s in self.sessions if not s.in_use and (max_idle_secs is None or now - s.last_used > max_idle_secs)]
+            for session in expired:
+                self.sessions.remove(session)
+            self.condition.notify_all()
+
+        for session in expired:
+            self._destroy(session.driver, session.merchant)
+
+    def close_all(self):
+        self.close_idle()
+
+    def _take_idle_session(self, key):
+        for session in self.sessions:
+            if session.key == key and not session.in_use:
+                session.in_use = True
+                return session
+        return None
+
+    def _take_least_recently_used_idle_session(self):
+        idle_sessions = [s for s in self.sessions if not s.in_use]
+        if not idle_sessions:
+            return None
+        return min(idle_sessions, key=lambda s: s.last_used)
+
+    def _remove(self, session):
+        with self.condition:
+            if session in self.sessions:
+                self.sessions.remove(session)
+            self.condition.notify_all()
+
+    def _destroy(self, driver, merchant):
+        try:
+            self.destroy_driver(driver, merchant)
+        except (KeyboardInterrupt, SystemExit):
+            raise
+        except Exception as e:
+            LOGGER.error('Error closing Firefox session for ' + merchant.id + ': ' + str(e))
+
+    def _start_reaper(self):
+        with self.condition:
+            if self.reaper or not self.idle_timeout:
+                return
+            self.reaper = Thread(target=self._reap_idle_sessions, daemon=True)
+        self.reaper.start()
+
+    def _reap_idle_sessions(self):
+        while True:
+            time.sleep(min(self.idle_timeout, 60))
+            self.close_idle(self.idle_timeout)
+
+
+class Session:
+    def __init__(self, key, merchant):
+        self.key = key
+        self.merchant = merchant
+        self.driver = None
+        self.uses = 0
+        self.in_use = True
+        self.last_used = time.time()
+
+
+def session_key(merchant):
+    return merchant.name + '_' + merchant.usr
+
+
+# A cheap round trip to geckodriver. Returns False if Firefox crashed, geckodriver died, or the user closed the window.
+def is_healthy(driver):
+    try:
+        if not driver.window_handles:
+            return False
+        driver.switch_to.window(driver.window_handles[0])  # merchant automation may have left a popup focused
+        return driver.current_url is not None
+    except (KeyboardInterrupt, SystemExit):
+        raise
+    except Exception:
+        return False